@@ -15,41 +15,64 @@
     You should have received a copy of the GNU General Public License
     along with QDICOMDiffer.  If not, see <http://www.gnu.org/licenses/>.
 """
-# Imports include comments to indicate their respective licences
-# pydicom is MIT licenced
-try:
-    import dicom as pydicom
-except ImportError:
-    import pydicom
+import sys
+import time
+start_time = time.perf_counter()
+# The batch mode doesn't need a GUI, so it is started before PyQt is imported
+if __name__ == '__main__' and len(sys.argv) > 1 and sys.argv[1] in ('--batch', '--headless'):
+    from core.batch import main
+    sys.exit(main(sys.argv[2:]))
+if __name__ == '__main__':
+    # The generated UI imports its widgets from this module, which would otherwise be run a second time to do so
+    sys.modules['QDICOMDiffer'] = sys.modules['__main__']
+
+# Imports include comments to indicate their respective licences. Only what is needed to show the window is imported
+# up front, so that it appears as soon as possible; pydicom, difflib, the diffing code and the other windows are
+# imported where they are first used instead.
 # PyQt is GPL v3 licenced
 from PyQt5 import QtWidgets
-from PyQt5.QtGui import QStandardItemModel, QStandardItem, QColor, QPainter, QFontMetrics
-from PyQt5.QtWidgets import QFileDialog, QMessageBox, QAbstractItemView, QProgressBar, QLabel, QTreeView, QScrollBar, \
-    QPushButton, QColorDialog, QFontDialog
-from PyQt5.QtCore import QSettings, Qt, QSortFilterProxyModel, QThread, pyqtSignal
+from PyQt5.QtGui import QColor, QPainter, QFontMetrics, QKeySequence, QPalette, QFontDatabase
+from PyQt5.QtWidgets import QFileDialog, QMessageBox, QAbstractItemView, QProgressBar, QLabel, QTreeView, \
+    QPushButton, QColorDialog, QFontDialog, QTableWidget, QTableWidgetItem
+from PyQt5.QtCore import QSettings, Qt, QSortFilterProxyModel, QThread, pyqtSignal, QAbstractItemModel, QModelIndex, \
+    QTimer, QAbstractListModel
 # Python standard library is PSF licenced
-import sys
-import difflib
-import re
+from collections import OrderedDict
+import logging
 import os
 # Other files from this project
-from ui.mainWindow import Ui_MainWindow
-from ui.appearance import Ui_DialogAppearance
+from core.progress import Progress, Cancelled, format_timings
+from core import instruments
+
+import_seconds = time.perf_counter() - start_time
 
+diff_state_role = Qt.UserRole + 1  # the diff state of a row (see core.table) as an int, without making a string
 default_indirect_match_colour = QColor(179, 206, 236)
 default_direct_match_colour = QColor(140, 183, 225)
-GLOBAL_integer_key = 0  # key used to insure all nodes have unique id's
 version = '1.1.1'
 
 class MainWindow(QtWidgets.QMainWindow):
     def __init__(self, ):
         super(MainWindow, self).__init__()
+        from ui.mainWindow import Ui_MainWindow
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
-        self.modelArray = [QStandardItemModel(), QStandardItemModel()]
+        self.modelArray = [DatasetTreeModel(), DatasetTreeModel()]
         self.filterProxyArray = [RecursiveProxyModel(), RecursiveProxyModel()]
         self.treeViewArray = [self.ui.treeView, self.ui.treeView_2]
         self.pathLabelArray = [self.ui.labelPath, self.ui.labelPath_2]
+        self.loadingBarArray = [self.ui.progressBarLoading, self.ui.progressBarLoading_2]
+        # Each load of a pane gets a new generation, so the results of loads that have since been replaced are ignored
+        self.load_generation = [0, 0]
+        self.cache_key_array = [None, None]  # the key of each loaded file in the dataset cache
+        self.loader_threads = []  # kept until they finish, even if their results are no longer wanted
+        self.loader_array = [None, None]  # the thread loading a file into each pane, if any
+        self.diff_when_loaded = False
+        self.search_index_array = [None, None]  # built in the background once the search window is opened
+        self.indexing_tables = [None, None]  # the table of each pane whose index is being (or has been) built
+        self.index_threads = []
+        self.hash_array = [None, None]  # hashes of the datasets and their sequence items, also built in the background
+        self.hash_threads = []
 
         self.setWindowTitle('QDICOMDiffer ' + version)
 
@@ -73,46 +96,116 @@ class MainWindow(QtWidgets.QMainWindow):
             indirect_match_colour = QColor(col)
 
         font = self.settings.value('Appearance/new_font')
+        # The settings for loading and diffing need pydicom, so they are read once the window is up (see load_settings)
+        self.defer_size = None
+        self.stop_before_pixels = False
+        self.dataset_cache = None
+        self.item_keys = None
+        self.background_text_diff = False
 
         for i in range(2):
-            self.modelArray[i].setHorizontalHeaderLabels(['Tag', 'Description', 'Value', 'Different', 'Index'])
             self.filterProxyArray[i].setSourceModel(self.modelArray[i])
-            self.ui.lineEditTagFilter.textChanged.connect(self.filterProxyArray[i].set_tag_filter)
-            self.ui.lineEditDescFilter.textChanged.connect(self.filterProxyArray[i].set_desc_filter)
-            self.ui.lineEditValFilter.textChanged.connect(self.filterProxyArray[i].set_value_filter)
             self.treeViewArray[i].setModel(self.filterProxyArray[i])
             self.treeViewArray[i].setEditTriggers(QAbstractItemView.NoEditTriggers)
-            self.treeViewArray[i].setColumnHidden(3, True)
-            self.treeViewArray[i].setColumnHidden(4, True)
             # the i=i here is needed to ensure i is within the local namespace, without it i evaluates to 1 both times
             self.ui.checkBoxShowOnlyDifferent.stateChanged.connect(
                 lambda state, i=i: self.filterProxyArray[i].set_show_only_different(bool(
                     state)))
             self.treeViewArray[i].file_dropped.connect(lambda filepath, i=i: self.load_file(filepath, i))
+            self.treeViewArray[i].directories_dropped.connect(self.open_directory_diff_window)
+            self.treeViewArray[i].doubleClicked.connect(lambda index, i=i: self.load_deferred_value(index, i))
             self.treeViewArray[i].indirect_match_colour = indirect_match_colour
             self.treeViewArray[i].direct_match_colour = direct_match_colour
             if font is not None:
                 self.treeViewArray[i].setFont(font)
+            self.loadingBarArray[i].hide()
+
+        # The filters are only applied once typing pauses, rather than on every key press
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(150)
+        self.filter_timer.timeout.connect(self.apply_filters)
+        for line_edit in (self.ui.lineEditTagFilter, self.ui.lineEditDescFilter, self.ui.lineEditValFilter):
+            line_edit.textChanged.connect(self.filter_timer.start)
+            line_edit.returnPressed.connect(self.apply_filters)
 
         self.ui.splitter.setSizes([100, 0])
 
+        # How long the stages of the last diff took, kept alongside the status bar messages (Help -> Performance has the
+        # totals over all diffs, when timings are being recorded)
+        self.timingLabel = QLabel()
+        self.statusBar().addPermanentWidget(self.timingLabel)
+
         self.ui.actionOpen.triggered.connect(self.open_files)
         self.ui.actionDiff.triggered.connect(self.do_diff)
+        self.ui.actionDiff_directories.triggered.connect(self.open_directory_diff)
+        self.ui.actionDiff_reference.triggered.connect(self.open_reference_diff)
         self.ui.actionHTML_diff.triggered.connect(self.open_html_diff_window)
+        self.ui.actionSearch.triggered.connect(self.open_search_window)
         self.ui.actionAbout.triggered.connect(self.open_about_window)
+        self.ui.actionPerformance.triggered.connect(self.open_performance_window)
         self.ui.actionAppearance.triggered.connect(self.open_appearance_window)
         self.raw_diff_window = None
         self.html_diff_window = None
         self.appearance_window = None
+        self.directory_diff_window = None
+        self.reference_diff_window = None
+        self.search_window = None
+        self.value_window = None
+        self.performance_window = None
         self.ui.actionText_diff.triggered.connect(self.open_text_diff_window)
         self.ui.actionExpand_all.triggered.connect(self.expand_all)
         self.ui.actionCollapse_all.triggered.connect(self.collapse_all)
         self.dc_array = [None] * 2
+        self.filepath_array = [None] * 2
 
+        # The tree diff is all that is done when diffing, the text and HTML diffs are only made once they are asked
+        # for (or in the background, with Diff/backgroundTextDiff in the settings)
+        self.difference_count = None
         self.diff_result = None
         self.html_diff_result = None
+        self.dataset_lines = None
+        self.text_diff_thread = None
+        self.text_diff_threads = []
+
+        self.show()
 
-        # If we were given command line arguments, try and load them
+        # The rest is done (and any files given on the command line loaded) once the window has been drawn
+        QTimer.singleShot(0, self.finish_startup)
+
+    @instruments.timed('finish start up')
+    def finish_startup(self):
+        instruments.add_time('start up until the window is shown', time.perf_counter() - start_time)
+        self.load_settings()
+        self.load_arguments()
+
+    def load_settings(self):
+        """
+        Reads the settings for loading and diffing, which need pydicom. This is done once the window is up, or as soon as
+        anything needs them if that is sooner (e.g. a file loaded straight after the window was made).
+        """
+        if self.dataset_cache is not None:
+            return
+        with instruments.timed('import pydicom'):
+            from core.reader import default_defer_size
+            from core.cache import DatasetCache, default_cache_size
+            from core.diff import parse_item_keys, default_item_keys
+        # Values larger than this are left in the file until they are needed (0 reads everything up front)
+        self.defer_size = int(self.settings.value('Loading/deferSize', default_defer_size))
+        # The pixel data can also be skipped entirely, for when only the metadata is of interest
+        self.stop_before_pixels = self.settings.value('Loading/stopBeforePixels', 'false') == 'true'
+        # Recently opened files are kept in memory (up to about this many bytes), so opening them again is instant
+        self.dataset_cache = DatasetCache(int(self.settings.value('Loading/cacheSize', default_cache_size)))
+        # Elements used to match up the items of sequences, on top of the default ones (see core.diff)
+        try:
+            self.item_keys = parse_item_keys(self.settings.value('Diff/itemKeys', ''))
+        except ValueError as e:
+            print('Ignoring Diff/itemKeys in settings.ini: ' + str(e))
+            self.item_keys = default_item_keys
+        # Make the text and HTML diffs at a low priority once the tree diff is done, so their windows open at once
+        self.background_text_diff = self.settings.value('Diff/backgroundTextDiff', 'false') == 'true'
+
+    def load_arguments(self):
         arguments = sys.argv[1:]
         for number, line in enumerate(arguments):
             self.load_file(line, number)
@@ -121,8 +214,6 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.ui.splitter.setSizes([50, 50])
                 break
 
-        self.show()
-
     def open_about_window(self):
         msgBox = QMessageBox()
         msgBox.setWindowTitle("About")
@@ -133,6 +224,9 @@ class MainWindow(QtWidgets.QMainWindow):
         msgBox.setIcon(QMessageBox.Information)
         msgBox.exec()
 
+    def open_performance_window(self):
+        self.performance_window = PerformanceWindow()
+
     def open_appearance_window(self):
         self.appearance_window = AppearanceWindow(self.settings, parent=self)
         if self.appearance_window.exec():
@@ -147,28 +241,72 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.treeViewArray[i].repaint()
 
     def open_text_diff_window(self):
-        if self.diff_result is not None:
+        if self.make_text_diffs(text=True):
             self.raw_diff_window = TextDiffWindow(self.diff_result)
-        else:
-            if self.dc_array[0] is not None and self.dc_array[0] is not None:
-                self.ui.splitter.setSizes([50, 50])
-                self.do_diff()
-                # Note that the IDE complains that self.diff_result is still None here
-                # It should have a value set by self.do_diff(), so this is not the case
-                if self.diff_result is not None:
-                    self.raw_diff_window = TextDiffWindow(self.diff_result)
 
     def open_html_diff_window(self):
-        if self.html_diff_result is not None:
+        if self.make_text_diffs(html=True):
             self.html_diff_window = HTMLDiffWindow(self.html_diff_result)
-        else:
-            if self.dc_array[0] is not None and self.dc_array[0] is not None:
-                self.ui.splitter.setSizes([50, 50])
-                self.do_diff()
-                # Note that the IDE complains that self.diff_result is still None here
-                # It should have a value set by self.do_diff(), so this is not the case
-                if self.diff_result is not None:
-                    self.html_diff_window = HTMLDiffWindow(self.html_diff_result)
+
+    def has_text_diffs(self, text=False, html=False):
+        return (not text or self.diff_result is not None) and (not html or self.html_diff_result is not None)
+
+    def make_text_diffs(self, text=False, html=False):
+        """
+        Makes the raw text diff and/or the HTML diff of the loaded files, unless they have been made already, showing
+        the progress. Returns whether they are ready.
+        """
+        if self.has_text_diffs(text, html):
+            return True
+        if self.is_loading() or self.dc_array[0] is None or self.dc_array[1] is None:
+            return False
+        self.ui.splitter.setSizes([50, 50])
+        thread = self.text_diff_thread
+        if thread is None:
+            thread = self.start_text_diff(text, html)
+        elif thread.isRunning():
+            # Already being made in the background, which is now being waited for
+            thread.setPriority(QThread.NormalPriority)
+        self.diffProgressWindow = DiffProgressWindow(thread, parent=self)
+        # The results have been stored by handle_text_diffed by the time the window has closed
+        return self.diffProgressWindow.exec() and self.has_text_diffs(text, html)
+
+    def start_text_diff(self, text=True, html=True, background=False):
+        thread = TextDiffWorkerThread(self.dc_array, text, html, self.dataset_lines)
+        generation = tuple(self.load_generation)
+        thread.diffed.connect(lambda *results, g=generation: self.handle_text_diffed(g, *results))
+        thread.finished.connect(lambda thread=thread: self.handle_text_diff_thread_finished(thread))
+        self.text_diff_threads.append(thread)
+        self.text_diff_thread = thread
+        thread.start(QThread.LowPriority if background else QThread.InheritPriority)
+        return thread
+
+    def handle_text_diffed(self, generation, lines, diff_result, html_diff_result, timings):
+        if generation != tuple(self.load_generation):
+            return
+        self.dataset_lines = lines
+        if diff_result is not None:
+            self.diff_result = diff_result
+        if html_diff_result is not None:
+            self.html_diff_result = html_diff_result
+        self.show_timings('Text diff', timings)
+
+    def show_timings(self, description, timings):
+        """
+        Shows how long a diff took in the status bar, with the time taken by each of its stages in the tool tip
+        """
+        self.timingLabel.setText('{0} took {1:.3f} s'.format(description, sum(timing.seconds for timing in timings)))
+        self.timingLabel.setToolTip(format_timings(timings))
+
+    def handle_text_diff_thread_finished(self, thread):
+        self.text_diff_threads.remove(thread)
+        if self.text_diff_thread is thread:
+            self.text_diff_thread = None
+
+    def cancel_text_diff(self):
+        if self.text_diff_thread is not None:
+            self.text_diff_thread.progress.cancel()
+            self.text_diff_thread = None
 
     def collapse_all(self):
         for i in range(2):
@@ -176,6 +314,7 @@ class MainWindow(QtWidgets.QMainWindow):
             for n in range(3):
                 self.treeViewArray[i].resizeColumnToContents(n)
 
+    @instruments.timed('expand all')
     def expand_all(self):
         for i in range(2):
             self.treeViewArray[i].expandAll()
@@ -183,19 +322,11 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.treeViewArray[i].resizeColumnToContents(n)
                 self.treeViewArray[i].resizeColumnToContents(n)
 
-    def set_value_filter(self, filter):
-        for i in range(2):
-            self.filterProxyArray[i].setFilterKeyColumn(2)
-            self.filterProxyArray[i].setFilterFixedString(filter)
-
-    def show_only_diff(self, new_state):
-        state = (new_state == 2)
+    def apply_filters(self):
+        self.filter_timer.stop()
         for i in range(2):
-            self.filterProxyArray[i].setFilterKeyColumn(3)
-            if state:
-                self.filterProxyArray[i].setFilterFixedString(str(int(state)))
-            else:
-                self.filterProxyArray[i].setFilterFixedString('')
+            self.filterProxyArray[i].set_filters(self.ui.lineEditTagFilter.text(), self.ui.lineEditDescFilter.text(),
+                                                 self.ui.lineEditValFilter.text())
 
     def open_files(self):
         filepaths = self.get_file_paths()
@@ -242,7 +373,47 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.ui.splitter.setSizes([50, 50])
                 break
 
-    def get_file_paths(self):
+    def open_directory_diff(self):
+        directories = []
+        for side in ('left', 'right'):
+            path_from_settings = self.settings.value('Browse/LastOpenedLocation')
+            default_location = path_from_settings if path_from_settings is not None else '.'
+            directory = QFileDialog.getExistingDirectory(self, 'Open ' + side + ' directory ...', default_location)
+            if directory == '':
+                return
+            self.settings.setValue('Browse/LastOpenedLocation', directory)
+            directories.append(directory)
+        self.open_directory_diff_window(directories[0], directories[1])
+
+    def open_directory_diff_window(self, left_directory, right_directory):
+        self.load_settings()
+        self.directory_diff_window = DirectoryDiffWindow(left_directory, right_directory, self.defer_size,
+                                                         self.item_keys)
+        self.directory_diff_window.pair_opened.connect(self.open_pair)
+
+    def open_reference_diff(self):
+        reference_path = self.get_file_paths('Open reference file ...', multiple=False)
+        if reference_path == '':
+            return
+        filepaths = self.get_file_paths('Open files to compare with ' + os.path.basename(reference_path) + ' ...')
+        if len(filepaths) == 0:
+            return
+        self.load_settings()
+        self.reference_diff_window = ReferenceDiffWindow(reference_path, filepaths, self.defer_size, self.item_keys,
+                                                         self.treeViewArray[0].direct_match_colour)
+        self.reference_diff_window.pair_opened.connect(self.open_pair)
+
+    def open_pair(self, left_path, right_path):
+        self.diff_when_loaded = False
+        self.load_file(left_path, 0)
+        self.load_file(right_path, 1)
+        self.ui.splitter.setSizes([50, 50])
+        self.raise_()
+        self.activateWindow()
+        # Files in the cache are loaded straight away, otherwise this waits until they have been
+        self.do_diff()
+
+    def get_file_paths(self, title='Open DICOM file ...', multiple=True):
         path_from_settings = self.settings.value('Browse/LastOpenedLocation')
         default_location = '.'
         if path_from_settings is not None:
@@ -252,36 +423,217 @@ class MainWindow(QtWidgets.QMainWindow):
         This looks a bit strange, but filenames are the first return value of this function
         so we need the [0] on the end to grab what we need
         """
-        return QFileDialog.getOpenFileNames(self, 'Open DICOM file ...', default_location)[0]
+        if not multiple:
+            return QFileDialog.getOpenFileName(self, title, default_location)[0]
+        return QFileDialog.getOpenFileNames(self, title, default_location)[0]
 
     def load_file(self, filepath, file_number):
-        try:
-            dc = pydicom.read_file(filepath)
-            self.dc_array[file_number] = dc
-            self.modelArray[file_number].removeRows(0, self.modelArray[
-                file_number].rowCount())  # Remove any rows from old loaded files
-            dict_to_tree(dc, parent=self.modelArray[file_number].invisibleRootItem())
-            self.pathLabelArray[file_number].setText(filepath)
-            for n in range(3):
-                self.treeViewArray[file_number].resizeColumnToContents(n)
-                if file_number == 1:
-                    reset_tree_diff_state(self.modelArray[0].invisibleRootItem())
-                else:
-                    reset_tree_diff_state(self.modelArray[1].invisibleRootItem())
-                self.diff_result = None
-                self.html_diff_result = None
-        except pydicom.errors.InvalidDicomError:
-            msgBox = QMessageBox()
-            msgBox.setWindowTitle("Error")
-            msgBox.setText('Failed to open ' + filepath + ' (is it a valid DICOM file?)')
-            msgBox.setIcon(QMessageBox.Critical)
-            msgBox.exec()
+        """
+        Starts loading a file into a pane in the background. Anything still loading into that pane is cancelled.
+        """
+        self.load_settings()
+        if self.loader_array[file_number] is not None:
+            self.loader_array[file_number].cancel()
+            self.loader_array[file_number] = None
+        self.load_generation[file_number] += 1
+        generation = self.load_generation[file_number]
+        self.pathLabelArray[file_number].setText('Loading ' + filepath + ' ...')
+        self.statusBar().clearMessage()
+        self.timingLabel.clear()
+
+        defer_size = self.defer_size if self.defer_size > 0 else None
+        cache_key = self.dataset_cache.key(filepath, defer_size, self.stop_before_pixels)
+        cached = self.dataset_cache.get(cache_key)
+        if cached is not None:
+            self.handle_file_loaded(filepath, cached[0], cached[1], file_number, generation, cache_key, cached[2])
+            return
+
+        self.loadingBarArray[file_number].show()
+        loader = FileLoaderThread(filepath, defer_size, self.stop_before_pixels, self.dataset_cache, cache_key)
+        loader.loaded.connect(
+            lambda dc, table, i=file_number, g=generation: self.handle_file_loaded(filepath, dc, table, i, g,
+                                                                                  cache_key))
+        loader.failed.connect(lambda message, i=file_number, g=generation: self.handle_load_failed(message, i, g))
+        loader.finished.connect(lambda loader=loader, i=file_number: self.handle_loader_finished(loader, i))
+        self.loader_threads.append(loader)
+        self.loader_array[file_number] = loader
+        loader.start()
+
+    def handle_loader_finished(self, loader, file_number):
+        self.loader_threads.remove(loader)
+        if self.loader_array[file_number] is loader:
+            self.loader_array[file_number] = None
+
+    def is_loading(self, file_number=None):
+        if file_number is None:
+            return any(self.loadingBarArray[i].isVisibleTo(self) for i in range(2))
+        return self.loadingBarArray[file_number].isVisibleTo(self)
+
+    @instruments.timed('show loaded file')
+    def handle_file_loaded(self, filepath, dc, table, file_number, generation, cache_key=None, extras=None):
+        if generation != self.load_generation[file_number]:
+            return
+        extras = extras or {}
+        self.loadingBarArray[file_number].hide()
+        self.dc_array[file_number] = dc
+        self.filepath_array[file_number] = filepath
+        self.cache_key_array[file_number] = cache_key
+        self.modelArray[file_number].set_table(table)  # This replaces any rows from old loaded files
+        # A file from the cache comes with its search index and hashes, if they were built while it was open before
+        self.search_index_array[file_number] = extras.get('search_index')
+        if self.search_window is not None and self.search_window.isVisible():
+            self.build_search_indexes()
+        self.build_hashes(file_number, generation, extras.get('hashes'))
+        self.pathLabelArray[file_number].setText(filepath)
+        for n in range(3):
+            self.treeViewArray[file_number].resizeColumnToContents(n)
+        self.modelArray[1 - file_number].reset_diff_state()
+        self.cancel_text_diff()
+        self.difference_count = None
+        self.diff_result = None
+        self.html_diff_result = None
+        self.dataset_lines = None
+        if self.diff_when_loaded and not self.is_loading():
+            self.diff_when_loaded = False
+            self.do_diff()
+
+    def build_search_indexes(self):
+        """
+        Starts building the search index of each loaded file that doesn't have one yet in the background. Indexes are
+        only built once the search window is opened, as building one expands every row of the file's table.
+        """
+        for file_number in range(2):
+            table = self.modelArray[file_number].table
+            if table is None or self.search_index_array[file_number] is not None or \
+                    self.indexing_tables[file_number] is table:
+                continue
+            self.indexing_tables[file_number] = table
+            index_thread = SearchIndexThread(table)
+            index_thread.built.connect(lambda index, i=file_number: self.handle_search_index_built(index, i))
+            index_thread.finished.connect(lambda index_thread=index_thread: self.index_threads.remove(index_thread))
+            self.index_threads.append(index_thread)
+            index_thread.start()
+        if self.search_window is not None:
+            self.search_window.set_indexes(self.search_index_array)
+
+    def build_hashes(self, file_number, generation, hashes=None):
+        self.hash_array[file_number] = None
+        if hashes is not None:
+            self.handle_hashed(hashes, file_number, generation)
+            return
+        hash_thread = HashThread(self.dc_array[file_number])
+        hash_thread.hashed.connect(lambda hashes, i=file_number, g=generation: self.handle_hashed(hashes, i, g))
+        hash_thread.finished.connect(lambda hash_thread=hash_thread: self.hash_threads.remove(hash_thread))
+        self.hash_threads.append(hash_thread)
+        hash_thread.start()
+
+    def handle_hashed(self, hashes, file_number, generation):
+        if generation != self.load_generation[file_number]:
+            return
+        self.hash_array[file_number] = hashes
+        self.dataset_cache.update(self.cache_key_array[file_number], hashes=hashes)
+        # Values left in the file aren't hashed, so whether files with them are the same is only known after a diff
+        if None not in self.hash_array and self.hash_array[0][()] is not None and self.hash_array[1][()] is not None:
+            # Comparing the hashes of the two datasets is enough to tell whether they are the same, without a diff
+            if self.hash_array[0][()] == self.hash_array[1][()]:
+                self.statusBar().showMessage('The files are identical')
+            elif self.difference_count is None:
+                self.statusBar().showMessage('The files are different')
+
+    def handle_search_index_built(self, index, file_number):
+        # The index is only wanted if the pane still shows the table it was built from. (A load generation wouldn't do,
+        # as the index may have been started for the file still shown while another was loading into the pane.)
+        if index.table is not self.modelArray[file_number].table:
+            return
+        self.search_index_array[file_number] = index
+        if self.search_window is not None:
+            self.search_window.set_indexes(self.search_index_array)
+        # The index was built on the fully expanded table, so the cache keeps a copy of that for the rows to match
+        self.dataset_cache.update(self.cache_key_array[file_number], table=index.table.copy(), search_index=index)
+
+    def open_search_window(self):
+        if self.search_window is None:
+            self.search_window = SearchWindow()
+            self.search_window.result_selected.connect(self.show_table_row)
+        self.search_window.show()
+        self.search_window.raise_()
+        self.search_window.activateWindow()
+        self.build_search_indexes()
+
+    def show_table_row(self, file_number, row):
+        """
+        Selects a row of a file in its tree, expanding its parents and scrolling it into view
+        """
+        index = self.filterProxyArray[file_number].mapFromSource(self.modelArray[file_number].index_for_row(row))
+        if not index.isValid():
+            return  # the row is hidden by the filters
+        if self.ui.splitter.sizes()[file_number] == 0:
+            self.ui.splitter.setSizes([50, 50])
+        view = self.treeViewArray[file_number]
+        parent = index.parent()
+        while parent.isValid():
+            view.expand(parent)
+            parent = parent.parent()
+        view.setCurrentIndex(index)
+        view.scrollTo(index)
+
+    def handle_load_failed(self, message, file_number, generation):
+        if generation != self.load_generation[file_number]:
+            return
+        self.loadingBarArray[file_number].hide()
+        self.diff_when_loaded = False
+        # Go back to showing the file that is still loaded, if any
+        self.pathLabelArray[file_number].setText(self.filepath_array[file_number] or '')
+        msgBox = QMessageBox()
+        msgBox.setWindowTitle("Error")
+        msgBox.setText(message)
+        msgBox.setIcon(QMessageBox.Critical)
+        msgBox.exec()
+
+    def load_deferred_value(self, index, file_number):
+        from core.diff import is_streamed
+        source_index = self.filterProxyArray[file_number].mapToSource(index)
+        if not source_index.isValid():
+            return
+        model = self.modelArray[file_number]
+        row = model.table_row(source_index)
+        # Binary values are never shown in full in the tree, so are streamed into the value window rather than read in
+        if not is_streamed(model.table.source[row]):
+            model.load_deferred(source_index)
+            # The value is now held in the dataset, which may be the one in the cache
+            self.dataset_cache.update(self.cache_key_array[file_number])
+            self.treeViewArray[file_number].resizeColumnToContents(2)
+        if model.table.is_truncated(row):
+            # Too long to show in the tree, so the whole value is shown in a window of its own
+            tag, desc, _ = model.table.strings(row)
+            self.value_window = ValueWindow(model.table.source[row], tag + ' ' + desc + ' - ' +
+                                            (self.filepath_array[file_number] or ''))
 
     def do_diff(self):
-        self.diffProgressWindow = DiffProgressWindow(self.dc_array, self.modelArray, parent=self)
+        if self.is_loading():
+            # Diff as soon as the files have finished loading instead
+            self.diff_when_loaded = True
+            return
+        if self.dc_array[0] is None or self.dc_array[1] is None:
+            return
+        # Subtrees with the same hashes are skipped, if both files have been hashed by now
+        hashes = self.hash_array if None not in self.hash_array else None
+        thread = DiffWorkerThread(self.dc_array, [model.table for model in self.modelArray], hashes, self.item_keys)
+        self.diffProgressWindow = DiffProgressWindow(thread, parent=self)
+        thread.start()
         if self.diffProgressWindow.exec():
-            self.html_diff_result = self.diffProgressWindow.get_html_diff_result()
-            self.diff_result = self.diffProgressWindow.get_diff_result()
+            highlights, difference_count, timings = self.diffProgressWindow.results
+            for i in range(2):
+                self.modelArray[i].apply_highlights(highlights[i])
+            self.difference_count = difference_count
+            self.show_timings('Diff', timings)
+            if difference_count == 0:
+                self.statusBar().showMessage('The files are identical')
+            else:
+                self.statusBar().showMessage('{0:d} difference{1}'.format(difference_count,
+                                                                          's' if difference_count > 1 else ''))
+            if self.background_text_diff and self.text_diff_thread is None and not self.has_text_diffs(True, True):
+                self.start_text_diff(background=True)
 
 # Class taken from stackoverflow user Eric Hulser, url: http://stackoverflow.com/a/11764662
 class EnhancedQLabel(QLabel):
@@ -301,9 +653,74 @@ class EnhancedQLabel(QLabel):
         painter.drawText(self.rect(), self.alignment(), elided)
 
 
+class PerformanceWindow(QtWidgets.QWidget):
+    """
+    Shows the timers and counters of the hot paths (see core.instruments) as they are updated, and takes captures with
+    cProfile and tracemalloc for attaching to bug reports
+    """
+
+    def __init__(self):
+        super(PerformanceWindow, self).__init__()
+        self.checkBoxEnabled = QtWidgets.QCheckBox('Record timings and counters')
+        self.checkBoxEnabled.setChecked(instruments.is_enabled())
+        self.resetButton = QPushButton('Reset')
+        self.captureButton = QPushButton()
+        self.textEdit = QtWidgets.QPlainTextEdit()
+        self.textEdit.setReadOnly(True)
+        self.textEdit.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
+        self.textEdit.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.buttonLayout = QtWidgets.QHBoxLayout()
+        self.buttonLayout.addWidget(self.checkBoxEnabled)
+        self.buttonLayout.addStretch()
+        self.buttonLayout.addWidget(self.resetButton)
+        self.buttonLayout.addWidget(self.captureButton)
+        self.layout = QtWidgets.QVBoxLayout()
+        self.layout.addLayout(self.buttonLayout)
+        self.layout.addWidget(self.textEdit)
+        self.setLayout(self.layout)
+        self.setWindowTitle('Performance')
+        self.resize(650, 450)
+
+        self.checkBoxEnabled.toggled.connect(instruments.enable)
+        self.resetButton.clicked.connect(self.reset)
+        self.captureButton.clicked.connect(self.toggle_capture)
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(1000)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start()
+        self.refresh()
+        self.show()
+
+    def refresh(self):
+        self.captureButton.setText('Stop capture and save ...' if instruments.is_capturing() else 'Start capture')
+        self.checkBoxEnabled.setChecked(instruments.is_enabled())
+        report = instruments.report()
+        if report != self.textEdit.toPlainText():
+            self.textEdit.setPlainText(report)
+
+    def reset(self):
+        instruments.reset()
+        self.refresh()
+
+    def toggle_capture(self):
+        if not instruments.is_capturing():
+            instruments.start_capture()
+        else:
+            report_path = QFileDialog.getSaveFileName(self, 'Save capture ...', 'QDICOMDiffer-profile.txt')[0]
+            if report_path == '':
+                return
+            instruments.stop_capture(report_path)
+        self.refresh()
+
+    def closeEvent(self, event):
+        self.refresh_timer.stop()
+        super(PerformanceWindow, self).closeEvent(event)
+
+
 class AppearanceWindow(QtWidgets.QDialog):
     def __init__(self, settings, parent=None):
         super(AppearanceWindow, self).__init__(parent)
+        from ui.appearance import Ui_DialogAppearance
         self.ui = Ui_DialogAppearance()
         self.ui.setupUi(self)
         self.settings = settings
@@ -362,191 +779,871 @@ class AppearanceWindow(QtWidgets.QDialog):
             self.new_font = font
 
 class DiffProgressWindow(QtWidgets.QDialog):
-    def __init__(self, dc_array, model_array, parent=None):
+    """
+    Shows the progress of a diff worker thread (started by the caller, and possibly already running in the background),
+    and lets it be cancelled. The results the thread emitted are kept in results once the dialog has been accepted.
+    """
+
+    def __init__(self, worker_thread, parent=None):
         super(DiffProgressWindow, self).__init__(parent)
         self.progressBar = QProgressBar()
         self.label = QLabel("Diffing ...")
+        self.timingLabel = QLabel()
+        self.cancelButton = QPushButton('Cancel')
         self.layout = QtWidgets.QVBoxLayout()
         self.layout.addWidget(self.label, alignment=Qt.AlignVCenter)
         self.layout.addWidget(self.progressBar, alignment=Qt.AlignVCenter)
+        self.layout.addWidget(self.timingLabel, alignment=Qt.AlignVCenter)
+        self.layout.addWidget(self.cancelButton, alignment=Qt.AlignRight)
         self.setLayout(self.layout)
         self.setWindowTitle('Diff progress')
 
-        self.diff_result = None
-        self.html_diff_result = None
+        self.results = None
 
         self.show()
 
-        self.workerThread = DiffWorkerThread(dc_array, model_array)
-        self.workerThread.lines_to_process.connect(lambda num_of_lines: self.progressBar.setMaximum(num_of_lines))
-        self.workerThread.current_line.connect(lambda line: self.progressBar.setValue(line))
-        self.workerThread.start()
-        self.workerThread.finished.connect(self.handle_finished)
-
-    def handle_finished(self, html_diff_result, diff_result):
-        self.html_diff_result = html_diff_result
-        self.diff_result = diff_result
+        self.workerThread = worker_thread
+        self.workerThread.progress_changed.connect(self.handle_progress)
+        self.workerThread.cancelled.connect(self.handle_cancelled)
+        self.workerThread.diffed.connect(self.handle_finished)
+        self.cancelButton.clicked.connect(self.reject)
+        if self.workerThread.results is not None:
+            # It finished in the background before there was anything here to hear about it
+            QTimer.singleShot(0, lambda: self.handle_finished(*self.workerThread.results))
+
+    def handle_progress(self, stage, done, total):
+        self.label.setText(stage + " ...")
+        self.progressBar.setMaximum(total)
+        self.progressBar.setValue(done)
+        self.timingLabel.setText(format_timings(self.workerThread.progress.timings))
+
+    def reject(self):
+        # Ask the worker to stop, the dialog is closed once it has
+        self.label.setText("Cancelling ...")
+        self.cancelButton.setEnabled(False)
+        self.workerThread.progress.cancel()
+
+    def handle_cancelled(self):
+        super(DiffProgressWindow, self).reject()
+
+    def handle_finished(self, *results):
+        self.results = results
+        # The timings are always emitted last
+        self.timingLabel.setText(format_timings(results[-1]))
         self.accept()
 
-    def get_html_diff_result(self):
-        return self.html_diff_result
-
-    def get_diff_result(self):
-        return self.diff_result
-
 
 class DiffWorkerThread(QThread):
     """
-    Worker thread that does the diffing and highlighting of nodes
+    Worker thread that does the tree diff, and works out which rows need highlighting. It doesn't touch the models
+    themselves; the highlights are applied by the GUI thread once it's finished.
     """
 
-    def __init__(self, dc_array, modelArray):
+    def __init__(self, dc_array, table_array, hashes=None, item_keys=None):
         super(DiffWorkerThread, self).__init__()
         self.dc_array = dc_array
-        self.modelArray = modelArray
-        self.lines_processed = 0
+        self.table_array = table_array
+        self.hashes = hashes
+        self.item_keys = item_keys
+        self.highlights = None
+        self.difference_count = 0
+        self.results = None
+        # Progress updates are rate limited so the signals they emit can't flood the GUI event loop
+        self.progress = Progress(self.emit_progress)
+
+    def emit_progress(self, stage, done, total):
+        instruments.count('progress signals')
+        self.progress_changed.emit(stage, done, total)
+
+    @instruments.profiled_thread()
+    def run(self):
+        try:
+            self.diff()
+        except Cancelled:
+            self.cancelled.emit()
+            return
+        self.results = (self.highlights, self.difference_count, self.progress.timings)
+        self.diffed.emit(*self.results)
+
+    def diff(self):
+        from core.diff import diff_datasets, ADDED, REMOVED, CHANGED
+        progress = self.progress
+        with progress.stage('Tree diff'):
+            records = diff_datasets(self.dc_array[0], self.dc_array[1], progress, self.hashes, self.item_keys)
+            progress.update(len(records))
+        self.difference_count = len(records)
+
+        with progress.stage('Highlighting', len(records)):
+            # Rows only in the right file don't exist on the left, and vice versa
+            self.highlights = [
+                self.table_array[0].highlights([record.path for record in records if record.kind == CHANGED],
+                                               [record.path for record in records if record.kind == REMOVED]),
+                # Sequence items matched by key can be at a different path on the right
+                self.table_array[1].highlights([record.right_path or record.path for record in records
+                                                if record.kind == CHANGED],
+                                               [record.path for record in records if record.kind == ADDED])]
+
+    progress_changed = pyqtSignal(str, int, int, name='progress_changed')
+    cancelled = pyqtSignal(name='cancelled')
+    diffed = pyqtSignal(object, int, object, name='diffed')
+
+
+class TextDiffWorkerThread(QThread):
+    """
+    Worker thread that makes the raw text diff and/or the HTML diff of two datasets. These take much longer than the
+    tree diff and are only needed once their windows are opened, so they are made separately from it. The lines of
+    the datasets can be passed in if they have been made already.
+    """
+
+    def __init__(self, dc_array, text=True, html=True, lines=None):
+        super(TextDiffWorkerThread, self).__init__()
+        self.dc_array = dc_array
+        self.text = text
+        self.html = html
+        self.lines = lines
+        self.diff_result = None
+        self.html_diff_result = None
+        self.results = None
+        self.progress = Progress(self.emit_progress)
+
+    def emit_progress(self, stage, done, total):
+        instruments.count('progress signals')
+        self.progress_changed.emit(stage, done, total)
 
+    @instruments.profiled_thread()
     def run(self):
+        try:
+            self.diff()
+        except Cancelled:
+            self.cancelled.emit()
+            return
+        self.results = (self.lines, self.diff_result, self.html_diff_result, self.progress.timings)
+        self.diffed.emit(*self.results)
+
+    def diff(self):
+        import difflib
+        from core.diff import dataset_lines
+        from core.htmldiff import HtmlDiffReport
+        progress = self.progress
         # To diff the two dictionaries with difflib, they need to be a list of lines terminated with \n
         # Code taken from the DicomDiff example from pydicom, which can be found at the following url
         # https://github.com/darcymason/pydicom/blob/master/pydicom/examples/DicomDiff.py
-        rep = []
-        for dataset in self.dc_array:
-            lines = str(dataset).split("\n")
-            lines = [line + "\n" for line in lines]  # add the newline to end
-            rep.append(lines)
-
-        htmldiff = difflib.HtmlDiff()
-        self.html_diff_result = htmldiff.make_file(rep[0], rep[1])
-
-        diff = difflib.Differ()
-        # We do this diff because this looks nicer, and use this copy to display to the user as the 'raw diff'
-        self.diff_result = list(diff.compare(rep[0], rep[1]))
-
-        columns_to_save = [0, 1, 2]
-        index_col = 4
-
-        # Note that here a variabled ending in _2 refers to the file / pane on the right
-        string_representation_unkeyed = []
-        tree_to_string_list(self.modelArray[0].invisibleRootItem(), string_representation_unkeyed, columns_to_save)
-        list_of_keys = []
-        tree_to_string_list(self.modelArray[0].invisibleRootItem(), list_of_keys, [index_col])
-
-        string_representation_2_unkeyed = []
-        tree_to_string_list(self.modelArray[1].invisibleRootItem(), string_representation_2_unkeyed, columns_to_save)
-        list_of_keys_2 = []
-        tree_to_string_list(self.modelArray[1].invisibleRootItem(), list_of_keys_2, [index_col])
-
-        # If we don't convert to a list here, we can only iterate over the result once as it returns generators
-        unkeyed_diff_list = list(diff.compare(string_representation_unkeyed, string_representation_2_unkeyed))
-
-        list_old_stuff = []
-        list_old_stuff_2 = []
-        for line in unkeyed_diff_list:
-            if not line.startswith('?') and not line.startswith('+'):
-                list_old_stuff.append(line)
-            if not line.startswith('?') and not line.startswith('-'):
-                list_old_stuff_2.append(line)
-
-        diff_list_with_keys = []
-        for i in range(len(list_old_stuff)):
-            if i % 3 == 0:
-                diff_list_with_keys.append(list_of_keys[int(i / 3)])
-            diff_list_with_keys.append(list_old_stuff[i])
-
-        diff_list_with_keys_2 = []
-        for i in range(len(list_old_stuff_2)):
-            if i % 3 == 0:
-                diff_list_with_keys_2.append(list_of_keys_2[int(i / 3)])
-            diff_list_with_keys_2.append(list_old_stuff_2[i])
-
-        num_lines = len(diff_list_with_keys) + len(diff_list_with_keys_2)
-        self.lines_to_process.emit(num_lines)
-        self.highlight_nodes(diff_list_with_keys, self.modelArray[0], '-')
-        self.highlight_nodes(diff_list_with_keys_2, self.modelArray[1], '+')
-        self.finished.emit(self.html_diff_result, self.diff_result)
-
-    # TODO: This was designed before I learnt about QModelIndex. It might be faster if redesigned to use that
-    def highlight_nodes(self, diff_list, model, plus_or_minus):
-        find_identifier_regex = r':\s(.*$)'  # Extracts the identifier from the index line in match group 0
-        identifier = 'NOT_SET'
-        for line_number, line in enumerate(diff_list):
-            self.lines_processed += 1
-            self.current_line.emit(self.lines_processed)
-            # Save the last seen index, so when we need to go find a node, we know it's index
-            if '# INDEX' in line:
-                identifier = re.findall(find_identifier_regex, line)[0]
-            # Handle lines that were different between the two files
-            elif line.startswith(plus_or_minus):
-                # Use the index we saved to find the node in the tree
-                node = search_nodes_recursively(model.invisibleRootItem(),
-                                                '# INDEX: ' + str(identifier), 4)
-                if node is not None:
-                    # Mark the row as an exact match
-                    node_children = get_children(node, model)
-                    node_children[3].setText('1')
-
-                    # Mark all parent rows as an indirect match
-                    list_of_parents = []
-                    get_all_parents(node, list_of_parents)
-                    for parent in list_of_parents:
-                        node_children = get_children(parent, model)
-                        if node_children[3].text() != 1:
-                            node_children[3].setText('2')
-
-    lines_to_process = pyqtSignal(int, name='lines_to_process')
-    current_line = pyqtSignal(int, name='current_line')
-    finished = pyqtSignal(object, object, name='finished')
+        rep = self.lines
+        if rep is None:
+            rep = []
+            with progress.stage('Stringify', len(self.dc_array)):
+                for dataset in self.dc_array:
+                    rep.append(dataset_lines(dataset))
+                    progress.update(len(rep))
+            self.lines = rep
+        number_of_lines = len(rep[0]) + len(rep[1])
+
+        if self.html:
+            with progress.stage('Matching'):
+                # Only the matching is done here, the HTML itself is rendered a page at a time when it is looked at
+                self.html_diff_result = HtmlDiffReport(rep[0], rep[1], [getattr(dataset, 'filename', None) or ''
+                                                                        for dataset in self.dc_array])
+                self.html_diff_result.match()
+
+        if self.text:
+            with progress.stage('Differ', number_of_lines):
+                diff = difflib.Differ()
+                # We do this diff because this looks nicer, and use this copy to display to the user as the 'raw diff'
+                diff_result = []
+                for line in diff.compare(rep[0], rep[1]):
+                    diff_result.append(line)
+                    if not line.startswith('?'):
+                        progress.check()
+                        # Lines common to both files stand for a line from each of them
+                        progress.update(progress.done + (2 if line.startswith(' ') else 1))
+                self.diff_result = diff_result
+
+    progress_changed = pyqtSignal(str, int, int, name='progress_changed')
+    cancelled = pyqtSignal(name='cancelled')
+    diffed = pyqtSignal(object, object, object, object, name='diffed')
+
+
+class FileLoaderThread(QThread):
+    """
+    Worker thread that reads a file and creates the table of its top level rows, adding them to the cache. Once
+    cancelled, it stops at the next step (pydicom can't be interrupted while it reads the file) without caching or
+    emitting anything.
+    """
+
+    def __init__(self, filepath, defer_size, stop_before_pixels, cache, cache_key):
+        super(FileLoaderThread, self).__init__()
+        self.filepath = filepath
+        self.defer_size = defer_size
+        self.stop_before_pixels = stop_before_pixels
+        self.cache = cache
+        self.cache_key = cache_key
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    @instruments.profiled_thread()
+    @instruments.timed('load file')
+    def run(self):
+        # pydicom is MIT licenced
+        from pydicom.errors import InvalidDicomError
+        from core.reader import read_dataset
+        from core.table import DatasetTable
+        try:
+            dc = read_dataset(self.filepath, defer_size=self.defer_size, stop_before_pixels=self.stop_before_pixels)
+            if self.cancelled:
+                return
+            table = DatasetTable(dc)
+        except InvalidDicomError:
+            self.failed.emit('Failed to open ' + self.filepath + ' (is it a valid DICOM file?)')
+            return
+        except Exception as e:
+            self.failed.emit('Failed to open ' + self.filepath + ' (' + str(e) + ')')
+            return
+        if self.cancelled:
+            return
+        # The cache keeps the original table, the pane gets a copy of its own to expand and highlight
+        self.cache.put(self.cache_key, dc, table)
+        self.loaded.emit(dc, table.copy())
+
+    loaded = pyqtSignal(object, object, name='loaded')
+    failed = pyqtSignal(str, name='failed')
+
+
+class HashThread(QThread):
+    """
+    Worker thread that hashes a dataset and its sequence items (see core.hashing)
+    """
+
+    def __init__(self, dataset):
+        super(HashThread, self).__init__()
+        self.dataset = dataset
+
+    @instruments.profiled_thread()
+    @instruments.timed('hash')
+    def run(self):
+        from core.hashing import subtree_hashes
+        self.hashed.emit(subtree_hashes(self.dataset))
+
+    hashed = pyqtSignal(object, name='hashed')
+
+
+class SearchIndexThread(QThread):
+    """
+    Worker thread that builds the search index of a table
+    """
+
+    def __init__(self, table):
+        super(SearchIndexThread, self).__init__()
+        self.table = table
+
+    @instruments.profiled_thread()
+    @instruments.timed('build search index')
+    def run(self):
+        from core.search import SearchIndex
+        self.built.emit(SearchIndex(self.table))
+
+    built = pyqtSignal(object, name='built')
+
+
+class SearchWindow(QtWidgets.QWidget):
+    """
+    Searches both files for elements by tag, keyword, description or value (see core.search for the queries
+    understood). Selecting a result shows it in the tree.
+    """
+    max_results = 1000  # any more are counted, but not listed
+
+    def __init__(self):
+        super(SearchWindow, self).__init__()
+        self.lineEditQuery = QtWidgets.QLineEdit()
+        self.lineEditQuery.setPlaceholderText('e.g. patient name, (0018,*), *UID* or /^1\\.2/')
+        self.label = QLabel()
+        self.table = QTableWidget(0, 4)
+        self.table.setHorizontalHeaderLabels(['File', 'Tag', 'Description', 'Value'])
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.verticalHeader().hide()
+        self.layout = QtWidgets.QVBoxLayout()
+        self.layout.addWidget(self.lineEditQuery)
+        self.layout.addWidget(self.label)
+        self.layout.addWidget(self.table)
+        self.setLayout(self.layout)
+        self.setWindowTitle('Search')
+        self.resize(600, 400)
+
+        self.indexes = [None, None]
+        self.results = []  # (file number, table row) of each result listed
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(150)
+        self.search_timer.timeout.connect(self.search)
+        self.lineEditQuery.textChanged.connect(self.search_timer.start)
+        self.lineEditQuery.returnPressed.connect(self.search)
+        self.table.currentCellChanged.connect(self.handle_current_cell_changed)
+
+    def set_indexes(self, indexes):
+        self.indexes = list(indexes)
+        self.search()
+
+    def search(self):
+        import re
+        self.search_timer.stop()
+        query = self.lineEditQuery.text()
+        self.results = []
+        match_count = 0
+        try:
+            for file_number, index in enumerate(self.indexes):
+                if index is not None:
+                    rows = index.search(query)
+                    match_count += len(rows)
+                    self.results.extend((file_number, row) for row in rows)
+        except re.error as e:
+            self.label.setText('Invalid regular expression: ' + str(e))
+            self.table.setRowCount(0)
+            return
+        del self.results[self.max_results:]
+
+        self.table.setRowCount(0)
+        self.table.setRowCount(len(self.results))
+        for n, (file_number, row) in enumerate(self.results):
+            strings = self.indexes[file_number].table.strings(row)
+            self.table.setItem(n, 0, QTableWidgetItem('Left' if file_number == 0 else 'Right'))
+            for column in range(3):
+                self.table.setItem(n, column + 1, QTableWidgetItem(strings[column]))
+
+        text = '{0} matches'.format(match_count)
+        if match_count > len(self.results):
+            text += ' (showing the first {0})'.format(len(self.results))
+        if any(index is None for index in self.indexes):
+            text += ' (still indexing, or no file loaded on one side)'
+        self.label.setText(text)
+
+    def handle_current_cell_changed(self, row, column, previous_row, previous_column):
+        if 0 <= row < len(self.results) and row != previous_row:
+            self.result_selected.emit(*self.results[row])
+
+    result_selected = pyqtSignal(int, int, name='result_selected')
+
+
+class ValueWindow(QtWidgets.QWidget):
+    """
+    Shows the whole of a value that is too long to show in the tree
+    """
+
+    def __init__(self, data_element, title):
+        super(ValueWindow, self).__init__()
+        from core.diff import value_lines, max_value_lines
+        lines = value_lines(data_element)
+        self.label = QLabel(title)
+        self.textEdit = QtWidgets.QPlainTextEdit()
+        self.textEdit.setReadOnly(True)
+        self.textEdit.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
+        self.textEdit.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.textEdit.setPlainText('\n'.join(lines))
+        if len(lines) == max_value_lines:
+            self.label.setText(title + ' (first {0:d} lines)'.format(max_value_lines))
+        self.layout = QtWidgets.QVBoxLayout()
+        self.layout.addWidget(self.label)
+        self.layout.addWidget(self.textEdit)
+        self.setLayout(self.layout)
+        self.setWindowTitle('Value')
+        self.resize(700, 500)
+        self.show()
+
+
+class DirectoryDiffWindow(QtWidgets.QWidget):
+    """
+    Summary of the diff of two directories, with a row for each pair of files. Double clicking a row opens that pair
+    in the main window.
+    """
+
+    def __init__(self, left_directory, right_directory, defer_size, item_keys=None):
+        super(DirectoryDiffWindow, self).__init__()
+        self.label = QLabel('Diffing ' + left_directory + ' and ' + right_directory + ' ...')
+        self.table = QTableWidget(0, 4)
+        self.table.setHorizontalHeaderLabels(['Status', 'Left', 'Right', 'Differences'])
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.doubleClicked.connect(self.open_row)
+        self.layout = QtWidgets.QVBoxLayout()
+        self.layout.addWidget(self.label)
+        self.layout.addWidget(self.table)
+        self.setLayout(self.layout)
+        self.setWindowTitle('Directory diff')
+        self.counts = {}
+        self.results = []
+
+        self.workerThread = DirectoryDiffWorkerThread(left_directory, right_directory, defer_size, item_keys)
+        self.workerThread.pair_finished.connect(self.add_result)
+        self.workerThread.finished.connect(self.handle_finished)
+        self.workerThread.start()
+
+        self.resize(900, 500)
+        self.show()
+
+    def add_result(self, result):
+        self.results.append(result)
+        self.counts[result.status] = self.counts.get(result.status, 0) + 1
+        row = self.table.rowCount()
+        self.table.insertRow(row)
+        values = [result.status, result.left or '', result.right or '',
+                  result.error if result.error is not None else str(len(result.differences))]
+        for column, value in enumerate(values):
+            self.table.setItem(row, column, QTableWidgetItem(value))
+
+    def handle_finished(self):
+        self.label.setText(', '.join('{0} {1}'.format(count, status) for status, count in sorted(self.counts.items())))
+        for column in range(3):
+            self.table.resizeColumnToContents(column)
+
+    def open_row(self, index):
+        result = self.results[index.row()]
+        if result.left is not None and result.right is not None:
+            self.pair_opened.emit(result.left, result.right)
+
+    def closeEvent(self, event):
+        self.workerThread.cancel()
+        super(DirectoryDiffWindow, self).closeEvent(event)
+
+    pair_opened = pyqtSignal(str, str, name='pair_opened')
+
+
+class DirectoryDiffWorkerThread(QThread):
+    """
+    Worker thread that pairs up and diffs the files of two directories, using a pool of worker processes
+    """
+
+    def __init__(self, left_directory, right_directory, defer_size, item_keys=None):
+        super(DirectoryDiffWorkerThread, self).__init__()
+        self.left_directory = left_directory
+        self.right_directory = right_directory
+        self.defer_size = defer_size if defer_size > 0 else None
+        self.item_keys = item_keys
+        self._cancelled = False
+
+    @instruments.profiled_thread()
+    def run(self):
+        from concurrent.futures import ProcessPoolExecutor
+        from core.directory import diff_directories
+        with ProcessPoolExecutor() as executor:
+            for result in diff_directories(self.left_directory, self.right_directory, executor, self.defer_size,
+                                           self.item_keys):
+                if self._cancelled:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    return
+                instruments.count('pair results')
+                self.pair_finished.emit(result)
+
+    def cancel(self):
+        self._cancelled = True
+
+    pair_finished = pyqtSignal(object, name='pair_finished')
+
+
+class ReferenceDiffWindow(QtWidgets.QWidget):
+    """
+    Matrix of the differences of many files from a reference file, with a row for each element that is different in
+    any of them and a column for each file. Double clicking a file's cell opens it with the reference in the main
+    window.
+    """
+    fixed_columns = 4  # columns before the first file
+
+    def __init__(self, reference_path, filepaths, defer_size, item_keys=None, colour=default_direct_match_colour):
+        super(ReferenceDiffWindow, self).__init__()
+        self.label = QLabel('Diffing ' + str(len(filepaths)) + ' files against ' + reference_path + ' ...')
+        self.table = QTableWidget(0, self.fixed_columns)
+        self.table.setHorizontalHeaderLabels(['Tag', 'Description', 'Reference', 'Different in'])
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.doubleClicked.connect(self.open_cell)
+        self.layout = QtWidgets.QVBoxLayout()
+        self.layout.addWidget(self.label)
+        self.layout.addWidget(self.table)
+        self.setLayout(self.layout)
+        self.setWindowTitle('Reference diff - ' + os.path.basename(reference_path))
+        self.colour = colour
+        from core.matrix import DifferenceMatrix
+        self.matrix = DifferenceMatrix(reference_path)
+        self.file_count = len(filepaths)
+
+        self.workerThread = ReferenceDiffWorkerThread(reference_path, filepaths, defer_size, item_keys)
+        self.workerThread.file_finished.connect(self.add_result)
+        self.workerThread.failed.connect(self.label.setText)
+        self.workerThread.finished.connect(self.handle_finished)
+        self.workerThread.start()
+
+        self.resize(900, 500)
+        self.show()
+
+    def add_result(self, result):
+        from core.matrix import path_text, path_description
+        matrix = self.matrix
+        for position in matrix.add_result(result):
+            matrix_row = matrix.rows[position]
+            self.table.insertRow(position)
+            reference_value = matrix.reference_values[matrix_row]
+            for column, text in enumerate([path_text(matrix_row.path), path_description(matrix_row.path),
+                                           reference_value if reference_value is not None else '<absent>']):
+                self.table.setItem(position, column, QTableWidgetItem(text))
+            # Every file diffed before this one has the same value as the reference here
+            for column in range(len(matrix.files) - 1):
+                self.table.setItem(position, self.fixed_columns + column, QTableWidgetItem())
+
+        file_column = len(matrix.files) - 1
+        column = self.fixed_columns + file_column
+        self.table.insertColumn(column)
+        header = QTableWidgetItem(os.path.basename(result['right']))
+        header.setToolTip(result.get('error') or result['right'])
+        self.table.setHorizontalHeaderItem(column, header)
+        for row, matrix_row in enumerate(matrix.rows):
+            value, different = matrix.value(matrix_row, file_column)
+            item = QTableWidgetItem()
+            if different:
+                item.setText(value if value is not None else '<absent>')
+                item.setBackground(self.colour)
+                self.table.setItem(row, 3, QTableWidgetItem(str(matrix.different_count(matrix_row))))
+            self.table.setItem(row, column, item)
+        if result.get('error') is not None:
+            header.setText(header.text() + ' (error)')
+        self.label.setText('Diffed {0:d} of {1:d} files against {2}'.format(len(matrix.files), self.file_count,
+                                                                           matrix.reference_path))
+
+    def handle_finished(self):
+        errors = sum(1 for error in self.matrix.errors if error is not None)
+        identical = sum(1 for cells, error in zip(self.matrix.cells, self.matrix.errors)
+                        if len(cells) == 0 and error is None)
+        if len(self.matrix.files) == self.file_count:
+            self.label.setText('{0:d} identical, {1:d} different, {2:d} error'.format(
+                identical, len(self.matrix.files) - identical - errors, errors))
+        for column in range(self.fixed_columns):
+            self.table.resizeColumnToContents(column)
+
+    def open_cell(self, index):
+        column = index.column() - self.fixed_columns
+        if column >= 0 and self.matrix.errors[column] is None:
+            self.pair_opened.emit(self.matrix.reference_path, self.matrix.files[column])
+
+    def closeEvent(self, event):
+        self.workerThread.cancel()
+        super(ReferenceDiffWindow, self).closeEvent(event)
+
+    pair_opened = pyqtSignal(str, str, name='pair_opened')
+
+
+class ReferenceDiffWorkerThread(QThread):
+    """
+    Worker thread that diffs many files against a reference file, using a pool of worker processes
+    """
+
+    def __init__(self, reference_path, filepaths, defer_size, item_keys=None):
+        super(ReferenceDiffWorkerThread, self).__init__()
+        self.reference_path = reference_path
+        self.filepaths = filepaths
+        self.defer_size = defer_size if defer_size > 0 else None
+        self.item_keys = item_keys
+        self._cancelled = False
+
+    @instruments.profiled_thread()
+    def run(self):
+        from concurrent.futures import ProcessPoolExecutor
+        from core.matrix import diff_against_reference
+        with ProcessPoolExecutor() as executor:
+            try:
+                for result in diff_against_reference(self.reference_path, self.filepaths, executor, self.defer_size,
+                                                     self.item_keys):
+                    if self._cancelled:
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        return
+                    instruments.count('reference results')
+                    self.file_finished.emit(result)
+            except Exception as e:
+                # The reference itself couldn't be read
+                self.failed.emit('Error reading {0}: {1}'.format(self.reference_path, e))
+
+    def cancel(self):
+        self._cancelled = True
+
+    file_finished = pyqtSignal(object, name='file_finished')
+    failed = pyqtSignal(str, name='failed')
 
 
 class TextDiffWindow(QtWidgets.QWidget):
+    """
+    The raw diff of the two files. Only the lines that are on screen are ever drawn, so it opens just as quickly
+    however long the diff is.
+    """
+
+    @instruments.timed('open text diff window')
     def __init__(self, diff):
         super(TextDiffWindow, self).__init__()
-        self.textEdit = QtWidgets.QTextEdit()
-        self.layout = QtWidgets.QHBoxLayout()
-        self.layout.addWidget(self.textEdit)
-        self.textEdit.setReadOnly(True)
+        self.model = DiffLinesModel(diff)
+        self.linesView = DiffLinesView(self.model)
+        self.previousButton = QPushButton('Previous change')
+        self.lineLabel = QLabel()
+        self.nextButton = QPushButton('Next change')
+        self.buttonLayout = QtWidgets.QHBoxLayout()
+        self.buttonLayout.addWidget(self.lineLabel)
+        self.buttonLayout.addStretch()
+        self.buttonLayout.addWidget(self.previousButton)
+        self.buttonLayout.addWidget(self.nextButton)
+        self.layout = QtWidgets.QVBoxLayout()
+        self.layout.addLayout(self.buttonLayout)
+        self.layout.addWidget(self.linesView)
         self.setWindowTitle('Text diff')
 
-        for line in diff:
-            if line.startswith('+'):
-                self.textEdit.setTextColor(Qt.darkGreen)
-            elif line.startswith('-'):
-                self.textEdit.setTextColor(Qt.red)
-            elif line.startswith('?'):
-                self.textEdit.setTextColor(Qt.darkYellow)
-            else:
-                self.textEdit.setTextColor(Qt.black)
-            self.textEdit.append(line)
+        self.previousButton.clicked.connect(
+            lambda: self.linesView.go_to_row(self.model.previous_change(self.linesView.current_row)))
+        self.nextButton.clicked.connect(
+            lambda: self.linesView.go_to_row(self.model.next_change(self.linesView.current_row)))
+        self.linesView.current_row_changed.connect(self.update_line_label)
+        self.update_line_label(-1)
 
         self.setLayout(self.layout)
         self.resize(600, 700)
 
         self.show()
-        self.textEdit.verticalScrollBar().triggerAction(QScrollBar.SliderToMinimum)
+
+    def update_line_label(self, row):
+        if row == -1:
+            self.lineLabel.setText('{0} lines'.format(self.model.rowCount()))
+        else:
+            self.lineLabel.setText('Line {0} of {1}'.format(row + 1, self.model.rowCount()))
+
+
+class DiffLinesModel(QAbstractListModel):
+    """
+    A read only list model of the lines of a difflib.Differ diff, coloured by their prefix
+    """
+    line_colours = {'+': QColor(Qt.darkGreen), '-': QColor(Qt.red), '?': QColor(Qt.darkYellow)}
+
+    def __init__(self, lines):
+        super(DiffLinesModel, self).__init__()
+        self.lines = lines
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.lines)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        line = self.lines[index.row()]
+        if role == Qt.DisplayRole:
+            return line.rstrip('\n')
+        if role == Qt.ForegroundRole:
+            return self.line_colours.get(line[:1], None)
+        return None
+
+    def is_change_start(self, row):
+        # Changes are runs of lines that aren't common to both files
+        return not self.lines[row].startswith(' ') and (row == 0 or self.lines[row - 1].startswith(' '))
+
+    def next_change(self, row):
+        """
+        Returns the first line of the next change after row, or -1 if there isn't one
+        """
+        for n in range(row + 1, len(self.lines)):
+            if self.is_change_start(n):
+                return n
+        return -1
+
+    def previous_change(self, row):
+        """
+        Returns the first line of the last change before row, or -1 if there isn't one
+        """
+        for n in range(min(row, len(self.lines)) - 1, -1, -1):
+            if self.is_change_start(n):
+                return n
+        return -1
+
+
+class DiffLinesView(QtWidgets.QAbstractScrollArea):
+    """
+    Shows the lines of a list model. Item views lay out every row when they are given a model, which takes seconds
+    for millions of lines, so this only ever looks at (and draws) the rows that are on screen. Rows can be selected
+    with the mouse or keyboard and copied.
+    """
+
+    def __init__(self, model, parent=None):
+        super(DiffLinesView, self).__init__(parent)
+        self.model = model
+        self.current_row = -1
+        self.anchor_row = -1  # the other end of the selection from current_row
+        self.max_width = 0  # width of the widest line drawn so far, which is all the horizontal scroll bar knows of
+        self.viewport().setBackgroundRole(QPalette.Base)
+        self.viewport().setAutoFillBackground(True)
+        self.setFocusPolicy(Qt.StrongFocus)
+        self.update_scroll_bars()
+
+    def line_height(self):
+        return QFontMetrics(self.font()).height()
+
+    def visible_rows(self):
+        return max(1, self.viewport().height() // self.line_height())
+
+    def update_scroll_bars(self):
+        self.verticalScrollBar().setRange(0, max(0, self.model.rowCount() - self.visible_rows()))
+        self.verticalScrollBar().setPageStep(self.visible_rows())
+        self.horizontalScrollBar().setRange(0, max(0, self.max_width - self.viewport().width()))
+        self.horizontalScrollBar().setPageStep(self.viewport().width())
+
+    def resizeEvent(self, event):
+        super(DiffLinesView, self).resizeEvent(event)
+        self.update_scroll_bars()
+
+    def scrollContentsBy(self, dx, dy):
+        self.viewport().update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self.viewport())
+        metrics = QFontMetrics(self.font())
+        line_height = metrics.height()
+        palette = self.palette()
+        first = self.verticalScrollBar().value()
+        x = 4 - self.horizontalScrollBar().value()
+        selection_start, selection_end = sorted((self.anchor_row, self.current_row))
+        widest = self.max_width
+        for row in range(first, min(self.model.rowCount(), first + self.visible_rows() + 1)):
+            y = (row - first) * line_height
+            index = self.model.index(row)
+            text = self.model.data(index)
+            if selection_start <= row <= selection_end and self.current_row != -1:
+                painter.fillRect(0, y, self.viewport().width(), line_height, palette.highlight())
+                painter.setPen(palette.highlightedText().color())
+            else:
+                colour = self.model.data(index, Qt.ForegroundRole)
+                painter.setPen(colour if colour is not None else palette.text().color())
+            painter.drawText(x, y + metrics.ascent(), text)
+            widest = max(widest, metrics.width(text) + 8)
+        painter.end()
+        if widest != self.max_width:
+            self.max_width = widest
+            self.update_scroll_bars()
+
+    def row_at(self, y):
+        return min(self.verticalScrollBar().value() + y // self.line_height(), self.model.rowCount() - 1)
+
+    def set_current_row(self, row, extend_selection=False):
+        if row < 0:
+            return
+        self.current_row = row
+        if not extend_selection:
+            self.anchor_row = row
+        # Scroll just far enough for the row to be on screen
+        top = self.verticalScrollBar().value()
+        if row < top:
+            self.verticalScrollBar().setValue(row)
+        elif row >= top + self.visible_rows():
+            self.verticalScrollBar().setValue(row - self.visible_rows() + 1)
+        self.viewport().update()
+        self.current_row_changed.emit(row)
+
+    def go_to_row(self, row):
+        """
+        Selects a row, scrolling it to the top of the view
+        """
+        if row < 0:
+            return
+        self.verticalScrollBar().setValue(row)
+        self.set_current_row(row)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.set_current_row(self.row_at(event.pos().y()), bool(event.modifiers() & Qt.ShiftModifier))
+
+    def mouseMoveEvent(self, event):
+        if event.buttons() & Qt.LeftButton:
+            self.set_current_row(max(0, self.row_at(event.pos().y())), True)
+
+    def keyPressEvent(self, event):
+        if event.matches(QKeySequence.Copy) and self.current_row != -1:
+            selection_start, selection_end = sorted((self.anchor_row, self.current_row))
+            QtWidgets.QApplication.clipboard().setText(
+                ''.join(self.model.lines[selection_start:selection_end + 1]))
+            return
+        moves = {Qt.Key_Up: -1, Qt.Key_Down: 1, Qt.Key_PageUp: -self.visible_rows(),
+                 Qt.Key_PageDown: self.visible_rows(), Qt.Key_Home: -self.model.rowCount(),
+                 Qt.Key_End: self.model.rowCount()}
+        if event.key() in moves and self.model.rowCount() > 0:
+            row = min(max(self.current_row + moves[event.key()], 0), self.model.rowCount() - 1)
+            self.set_current_row(row, bool(event.modifiers() & Qt.ShiftModifier))
+            return
+        super(DiffLinesView, self).keyPressEvent(event)
+
+    current_row_changed = pyqtSignal(int, name='current_row_changed')
 
 
 class HTMLDiffWindow(QtWidgets.QWidget):
-    def __init__(self, diff):
+    """
+    Side by side diff of the two files, shown a page at a time
+    """
+
+    @instruments.timed('open HTML diff window')
+    def __init__(self, report):
         super(HTMLDiffWindow, self).__init__()
+        self.report = report
+        self.page_number = 0
 
         self.textEdit = QtWidgets.QTextEdit()
+        self.textEdit.setReadOnly(True)
+        self.checkBoxOnlyChanges = QtWidgets.QCheckBox('Only show changes')
+        self.checkBoxOnlyChanges.setChecked(report.context is not None)
+        self.previousButton = QPushButton('Previous')
+        self.pageLabel = QLabel()
+        self.nextButton = QPushButton('Next')
+        self.exportButton = QPushButton('Export ...')
+        self.buttonLayout = QtWidgets.QHBoxLayout()
+        self.buttonLayout.addWidget(self.checkBoxOnlyChanges)
+        self.buttonLayout.addStretch()
+        self.buttonLayout.addWidget(self.previousButton)
+        self.buttonLayout.addWidget(self.pageLabel)
+        self.buttonLayout.addWidget(self.nextButton)
+        self.buttonLayout.addWidget(self.exportButton)
         self.horLayout = QtWidgets.QVBoxLayout()
+        self.horLayout.addLayout(self.buttonLayout)
         self.horLayout.addWidget(self.textEdit)
-        self.textEdit.setReadOnly(True)
-        self.textEdit.setHtml(diff)
         self.setLayout(self.horLayout)
         self.setWindowTitle('HTML diff')
 
+        self.checkBoxOnlyChanges.stateChanged.connect(self.set_only_changes)
+        self.previousButton.clicked.connect(lambda: self.show_page(self.page_number - 1))
+        self.nextButton.clicked.connect(lambda: self.show_page(self.page_number + 1))
+        self.exportButton.clicked.connect(self.export)
+        self.show_page(0)
+
         self.show()
         self.raise_()  # sometimes the window doesn't appear on top for some reason
         self.resize(600, 700)
 
+    def set_only_changes(self, state):
+        from core.htmldiff import default_context
+        self.report.set_context(default_context if state else None)
+        self.show_page(0)
+
+    def show_page(self, page_number):
+        page_count = self.report.page_count()
+        self.page_number = max(0, min(page_number, page_count - 1))
+        self.textEdit.setHtml(self.report.page_html(self.page_number))
+        self.pageLabel.setText('Page {0} of {1}'.format(self.page_number + 1, max(page_count, 1)))
+        self.previousButton.setEnabled(self.page_number > 0)
+        self.nextButton.setEnabled(self.page_number < page_count - 1)
+
+    def export(self):
+        filepath, _ = QFileDialog.getSaveFileName(self, 'Export HTML diff', '', 'HTML files (*.html);;All files (*)')
+        if filepath == '':
+            return
+        with open(filepath, 'w', encoding='utf-8') as file:
+            self.report.write(file)
+
 
 class DroppableTreeView(QTreeView):
     """
     A subclass of QTreeView that emits the file location of files dropped on it
     """
+    # The diff states of core.table that are drawn highlighted, looked up when the first highlighted row is drawn
+    direct_states = None
+    indirect_state = None
 
     def __init__(self, *args):
         super(DroppableTreeView, self).__init__(*args)
@@ -570,24 +1667,126 @@ class DroppableTreeView(QTreeView):
         if event.mimeData().hasUrls:
             event.setDropAction(Qt.CopyAction)
             event.accept()
-            self.file_dropped.emit(event.mimeData().urls()[0].toLocalFile())
+            paths = [url.toLocalFile() for url in event.mimeData().urls()]
+            if len(paths) == 2 and os.path.isdir(paths[0]) and os.path.isdir(paths[1]):
+                self.directories_dropped.emit(paths[0], paths[1])
+            else:
+                self.file_dropped.emit(paths[0])
         else:
             event.ignore()
 
     def drawRow(self, painter, options, index):
-        if index.sibling(index.row(), 3).data() == '1':
-            painter.fillRect(options.rect, self.direct_match_colour)
-        if index.sibling(index.row(), 3).data() == '2':
-            painter.fillRect(options.rect, self.indirect_match_colour)
+        state = index.data(diff_state_role)
+        if state:
+            if DroppableTreeView.direct_states is None:
+                # Rows only have a diff state once a diff has been done, by which time core.table has been imported
+                from core.table import DIRECT_SUBTREE, DIRECT, INDIRECT
+                DroppableTreeView.direct_states = (DIRECT, DIRECT_SUBTREE)
+                DroppableTreeView.indirect_state = INDIRECT
+            if state in self.direct_states:
+                painter.fillRect(options.rect, self.direct_match_colour)
+            elif state == self.indirect_state:
+                painter.fillRect(options.rect, self.indirect_match_colour)
         super(DroppableTreeView, self).drawRow(painter, options, index)
 
     file_dropped = pyqtSignal(str, name='file_dropped')
+    directories_dropped = pyqtSignal(str, str, name='directories_dropped')
+
+
+class DatasetTreeModel(QAbstractItemModel):
+    """
+    A read only tree model of a pydicom dataset. Rows are stored in a DatasetTable, and are only created when a view
+    asks for them, so nothing is done for the contents of sequences that are never expanded.
+    """
+    header_labels = ['Tag', 'Description', 'Value']
+
+    def __init__(self):
+        super(DatasetTreeModel, self).__init__()
+        self.table = None
+
+    def set_table(self, table):
+        self.beginResetModel()
+        self.table = table
+        self.endResetModel()
+
+    def index(self, row, column, parent=QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        return self.createIndex(row, column, self.table.child(self.table_row(parent), row))
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        parent_row = self.table.parent[index.internalId()]
+        if parent_row == 0:
+            return QModelIndex()
+        return self.createIndex(self.table.row_in_parent[parent_row], 0, parent_row)
+
+    def rowCount(self, parent=QModelIndex()):
+        if self.table is None or parent.column() > 0:
+            return 0
+        return self.table.child_count(self.table_row(parent))
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.header_labels)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return self.table.strings(index.internalId())[index.column()]
+        if role == diff_state_role:
+            return self.table.diff_state(index.internalId())
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.header_labels[section]
+        return None
+
+    def table_row(self, index):
+        """
+        Returns the row number in the table of a model index (the root of the table for an invalid index)
+        """
+        return index.internalId() if index.isValid() else 0
+
+    def index_for_row(self, row):
+        """
+        Returns the model index of a row number in the table
+        """
+        if row == 0:
+            return QModelIndex()
+        return self.createIndex(self.table.row_in_parent[row], 0, row)
+
+    def apply_highlights(self, highlights):
+        # Every row may change, so let attached views and proxies refresh everything in one go
+        self.layoutAboutToBeChanged.emit()
+        self.table.apply_highlights(highlights)
+        self.layoutChanged.emit()
+
+    def load_deferred(self, index):
+        """
+        Reads the value of a deferred element in from the file, so it can be displayed in full
+        """
+        row = self.table_row(index)
+        if index.isValid() and self.table.is_deferred(row):
+            self.table.load_deferred(row)
+            self.dataChanged.emit(self.createIndex(index.row(), 0, row), self.createIndex(index.row(), 2, row))
+
+    def reset_diff_state(self):
+        if self.table is not None:
+            # Every row may change, so let attached views and proxies refresh everything in one go
+            self.layoutAboutToBeChanged.emit()
+            self.table.reset_diff_state()
+            self.layoutChanged.emit()
 
 
 class RecursiveProxyModel(QSortFilterProxyModel):
     """
-    A subclass of QSortFilterProxyModel that does recursive and multi column filtering
+    A subclass of QSortFilterProxyModel that does recursive and multi column filtering. Which rows to show is worked
+    out for the whole table in one pass when the filters change, and remembered for the last few sets of filters.
     """
+    memo_size = 16
 
     def __init__(self):
         super(RecursiveProxyModel, self).__init__()
@@ -595,167 +1794,79 @@ class RecursiveProxyModel(QSortFilterProxyModel):
         self._value_filter = ''
         self._tag_filter = ''
         self._desc_filter = ''
+        self._visible = None  # a 1 for each table row that passes the filters, or None if there aren't any filters
+        self._stale = True  # whether _visible needs working out again
+        self._memo = OrderedDict()  # filters -> (matching rows, visible rows), most recently used last
+
+    def setSourceModel(self, model):
+        super(RecursiveProxyModel, self).setSourceModel(model)
+        # Rows are filtered by their diff state and strings, so the results are out of date when either changes
+        model.modelAboutToBeReset.connect(self.clear_memo)
+        model.layoutAboutToBeChanged.connect(self.clear_memo)
+        model.dataChanged.connect(self.handle_data_changed)
+
+    def set_filters(self, tag_filter, desc_filter, value_filter):
+        self._tag_filter = tag_filter
+        self._desc_filter = desc_filter
+        self._value_filter = value_filter
+        self._stale = True
+        self.invalidateFilter()
 
     def set_value_filter(self, new_filter):
-        self._value_filter = new_filter
-        self.invalidateFilter()
+        self.set_filters(self._tag_filter, self._desc_filter, new_filter)
 
     def set_desc_filter(self, new_filter):
-        self._desc_filter = new_filter
-        self.invalidateFilter()
+        self.set_filters(self._tag_filter, new_filter, self._value_filter)
 
     def set_tag_filter(self, new_filter):
-        self._tag_filter = new_filter
-        self.invalidateFilter()
+        self.set_filters(new_filter, self._desc_filter, self._value_filter)
 
     def set_show_only_different(self, new_bool):
         self._show_only_different = new_bool
+        self._stale = True
         self.invalidateFilter()
 
-    def filterAcceptsRow(self, source_row, source_parent):
-        if self.row_matches_filters(source_row, source_parent):
-            # TODO: Change matched row to make it show up differently. Perhaps underline / italics?
-            return True
-
-        # We also want a node to be visible if it has any children that match (otherwise you won't be able to see those
-        # matches
-        return self.has_matching_children(source_row, source_parent)
-
-    def row_matches_filters(self, row_num, parent):
-        model = self.sourceModel()
-        parent_obj = model.itemFromIndex(parent)
-        if parent_obj is not None:
-            tag = parent_obj.child(row_num, 0).text()
-            desc = parent_obj.child(row_num, 1).text()
-            value = parent_obj.child(row_num, 2).text()
-            different = parent_obj.child(row_num, 3).text()
-        else:
-            tag = model.item(row_num, 0).text()
-            desc = model.item(row_num, 1).text()
-            value = model.item(row_num, 2).text()
-            different = model.item(row_num, 3).text()
-
-        accepted = self._tag_filter.lower() in tag.lower() and self._desc_filter.lower() in desc.lower() \
-                   and self._value_filter.lower() in value.lower()
-        if self._show_only_different:
-            accepted = accepted and ( different == '1' or different == '2')
-
-        return accepted
-
-    def has_matching_children(self, source_row, source_parent):
-        model = self.sourceModel()
-        index = model.index(source_row, 0, parent=source_parent)
-        number_of_children = model.rowCount(index)
-        for i in range(number_of_children):
-            if self.filterAcceptsRow(i, index):
-                return True
-        return False
-
-
-def dict_to_tree(dc, parent=None):
-    """
-    Fills a Qt tree data structure with a pydicom dictionary. I was unsure exactly what layout to use, so I mainly copied
-    the structure used by the the pydicom tree example using wxwidgets, avaiable here:
-    https://github.com/darcymason/pydicom/blob/dev/pydicom/examples/dicomtree.py
-    """
-    # This regex is used to match a memory offset used in the description of pydicom sequences
-    # comma, whitespace, the word 'at', whitespace, followed by seven to 12 hex digits
-    sequence_regex = r',\sat\s[0-9A-F]{7,12}'
-    for data_element in dc:
-        tag = str(data_element.tag)
-        desc = data_element.description()
-        value = str(data_element).replace(desc, '').replace(tag, '').strip()
-        """
-        This is a weird one. By default, pydicom includes a memory offset which we need to remove because it is
-        non deterministic. Any non-deterministic stuff in the description will make diffing two files impossible.
-        More info here https://github.com/darcymason/pydicom/issues/107
-        """
-        value = re.sub(sequence_regex, '', value)
-        new_child = QStandardItem(tag)
-
-        parent.appendRow([new_child, QStandardItem(desc),
-                          QStandardItem(value),
-                          QStandardItem('0'),
-                          QStandardItem("# INDEX: " + str(get_unique_value()))])
-        if data_element.VR == "SQ":
-            if len(data_element.value) != 0:
-                for i, dataset in enumerate(data_element.value):
-                    sq_item_description = data_element.name.replace(" Sequence", "")  # XXX not i18n
-                    item_text = "{0:s} {1:d}".format(sq_item_description, i + 1)
-                    child = QStandardItem()
-                    new_child.appendRow(
-                        [child, QStandardItem(sq_item_description), QStandardItem(item_text), QStandardItem('0'),
-                         QStandardItem("# INDEX: " + str(get_unique_value()))])
-                    dict_to_tree(dataset, parent=child)
-            else:
-                pass
-
-
-def get_children(node, model):
-    children = []
-    if node is not None:
-        parent = node.parent()
-        row = node.row()
-        if parent is not None:
-            for column in range(5):
-                children.append(parent.child(row, column))
-        else:
-            for column in range(5):
-                children.append(model.item(row, column))
-
-    return children
-
-
-def reset_tree_diff_state(node):
-    """
-    Resets the diff state on all children of a node, to any depth
-    """
-    if node is not None:
-        row_count = node.rowCount()
-        for row in range(row_count):
-            node.child(row, 3).setText('0')
-            reset_tree_diff_state(node.child(row,0))
-
-def search_nodes_recursively(node, token, column):
-    """
-    Searches a node and all of it's children for a value of 'token' on column 'column'
-    """
-    match = None
-    if node is not None:
-        row_count = node.rowCount()
-        for row in range(row_count):
-            if node.child(row, column).text() == token:
-                match = node.child(row, column)
-                return match
-            else:
-                match = search_nodes_recursively(node.child(row, 0), token, column)
-                if match is not None:
-                    return match
-    return match
-
-
-def get_all_parents(node, list_of_nodes):
-    parent = node.parent()
-    if parent is not None:
-        list_of_nodes.append(parent)
-        get_all_parents(parent, list_of_nodes)
-    else:
-        return
+    def clear_memo(self, *args):
+        self._memo.clear()
+        self._stale = True
 
+    def handle_data_changed(self, *args):
+        self.clear_memo()
+        if self._visible is not None:
+            self.invalidateFilter()
 
-def get_unique_value():
-    global GLOBAL_integer_key
-    # Just a simple integer unique key
-    value = GLOBAL_integer_key
-    GLOBAL_integer_key += 1
-    return value
-
-
-def tree_to_string_list(node, string_representation, columns_to_save, ):
-    for i in range(node.rowCount()):
-        for j in columns_to_save:
-            string_representation.append(node.child(i, j).text())
-        tree_to_string_list(node.child(i), string_representation, columns_to_save)
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self._stale:
+            self.update_visible_rows()
+        if self._visible is None:
+            return True
+        table = self.sourceModel().table
+        return bool(self._visible[table.child(self.sourceModel().table_row(source_parent), source_row)])
+
+    def update_visible_rows(self):
+        self._stale = False
+        table = self.sourceModel().table
+        filters = (self._tag_filter.lower(), self._desc_filter.lower(), self._value_filter.lower(),
+                   self._show_only_different)
+        if table is None or filters == ('', '', '', False):
+            self._visible = None
+            return
+        if filters in self._memo:
+            instruments.count('filter memo hits')
+            self._memo.move_to_end(filters)
+            self._visible = self._memo[filters][1]
+            return
+
+        # Adding to a filter can only remove matches, so only the rows matched by a shorter filter need testing
+        candidates = None
+        for (tag_filter, desc_filter, value_filter, show_only_different), (matches, _) in self._memo.items():
+            if show_only_different == filters[3] and tag_filter in filters[0] and desc_filter in filters[1] \
+                    and value_filter in filters[2] and (candidates is None or len(matches) < len(candidates)):
+                candidates = matches
+        self._memo[filters] = table.filter_rows(*filters, candidates=candidates)
+        if len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+        self._visible = self._memo[filters][1]
 
 
 if __name__ == '__main__':
@@ -764,6 +1875,27 @@ if __name__ == '__main__':
             print("This program should not be run as root, exiting ...")
             sys.exit(1)
 
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    # --profile records timings and counters (shown in Help -> Performance, and printed on exit), --profile=FILE also
+    # captures a profile of the whole session with cProfile and tracemalloc, and writes it to FILE on exit
+    profile = False
+    capture_path = None
+    for argument in list(sys.argv[1:]):
+        if argument == '--profile' or argument.startswith('--profile='):
+            sys.argv.remove(argument)
+            profile = True
+            instruments.enable()
+            if argument.startswith('--profile='):
+                capture_path = argument.split('=', 1)[1]
+                instruments.start_capture()
+    instruments.add_time('import modules', import_seconds)
     app = QtWidgets.QApplication(sys.argv)
-    GUI = MainWindow()
-    sys.exit(app.exec())
+    with instruments.timed('construct main window'):
+        GUI = MainWindow()
+    status = app.exec()
+    if capture_path is not None and instruments.is_capturing():
+        instruments.stop_capture(capture_path)
+        print('Profile written to ' + capture_path)
+    if profile:
+        print(instruments.report())
+    sys.exit(status)
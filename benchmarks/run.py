@@ -0,0 +1,279 @@
+"""
+    Times each stage of loading and diffing a pair of files, for synthetic datasets of different shapes (see
+    benchmarks.synthetic), and reports the peak memory each stage allocated.
+
+    Run from the top of the repository with e.g.
+
+        python -m benchmarks.run
+        python -m benchmarks.run --case nested --repeat 5
+        python -m benchmarks.run --elements 5000 --depth 2 --items 20 --different 0.1
+
+    Results can be saved as a baseline (--save), and are compared with the baseline if there is one. A stage that got
+    slower than its baseline by more than the threshold is flagged, and the exit status is then 1. Baselines depend on
+    the machine they were made on, so they are best kept locally rather than shared.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import argparse
+import difflib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Allow running this file directly as well as with -m
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import Case, cases, make_pair
+from core.diff import diff_datasets, dataset_lines, ADDED, REMOVED, CHANGED
+from core.hashing import subtree_hashes
+from core.reader import read_dataset, default_defer_size
+from core.table import DatasetTable
+# pydicom is MIT licenced
+import pydicom
+
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+default_threshold = 0.25  # a stage is flagged if it takes this fraction longer than its baseline
+min_seconds = 0.01  # stages quicker than this in the baseline are too noisy to flag
+# The application the qt filter stage needs, kept here so it isn't destroyed while the benchmarks run
+application = None
+
+
+def run_case(paths, timer, defer_size):
+    """
+    Runs every stage (other than those skipped) once on a pair of files, measuring each with timer
+    """
+    state = {}
+    for name, function in STAGES:
+        if name in timer.skip:
+            continue
+        with timer.measure(name):
+            function(state, paths, defer_size)
+
+
+def load(state, paths, defer_size):
+    state['datasets'] = [read_dataset(path, defer_size=defer_size) for path in paths]
+
+
+def build_tree(state, paths, defer_size):
+    # Everything the tree shows once it is fully expanded
+    state['tables'] = [DatasetTable(dataset) for dataset in state['datasets']]
+    for table in state['tables']:
+        table.expand_all()
+        for row in range(1, len(table)):
+            table.strings(row)
+
+
+def stringify(state, paths, defer_size):
+    state['lines'] = [dataset_lines(dataset) for dataset in state['datasets']]
+
+
+def text_diff(state, paths, defer_size):
+    state['text_diff'] = list(difflib.Differ().compare(state['lines'][0], state['lines'][1]))
+
+
+def hash_subtrees(state, paths, defer_size):
+    state['hashes'] = [subtree_hashes(dataset) for dataset in state['datasets']]
+
+
+def tree_diff(state, paths, defer_size):
+    state['records'] = diff_datasets(state['datasets'][0], state['datasets'][1], hashes=state.get('hashes'))
+
+
+def highlight(state, paths, defer_size):
+    # The same as the GUI does once a diff has finished
+    records = state['records']
+    left, right = state['tables']
+    left.apply_highlights(left.highlights([record.path for record in records if record.kind == CHANGED],
+                                          [record.path for record in records if record.kind == REMOVED]))
+    right.apply_highlights(right.highlights([record.right_path or record.path for record in records
+                                             if record.kind == CHANGED],
+                                            [record.path for record in records if record.kind == ADDED]))
+
+
+def filter_rows(state, paths, defer_size):
+    for table in state['tables']:
+        table.filter_rows('', '', 'value 1', False)
+        table.filter_rows('', '', '', True)
+
+
+def qt_filter(state, paths, defer_size):
+    # Filtering through the models the tree views use, which asks every row whether it is accepted
+    from PyQt5.QtCore import QModelIndex
+    import QDICOMDiffer
+    for table in state['tables']:
+        model = QDICOMDiffer.DatasetTreeModel()
+        model.set_table(table)
+        proxy = QDICOMDiffer.RecursiveProxyModel()
+        proxy.setSourceModel(model)
+        for filters in (('', '', 'value 1'), ('', 'private', '')):
+            proxy.set_filters(*filters)
+            _count_rows(proxy, QModelIndex())
+
+
+def _count_rows(model, parent):
+    count = model.rowCount(parent)
+    for row in range(count):
+        count += _count_rows(model, model.index(row, 0, parent))
+    return count
+
+
+STAGES = [
+    ('load', load),
+    ('tree', build_tree),
+    ('stringify', stringify),
+    ('text diff', text_diff),
+    ('hash', hash_subtrees),
+    ('tree diff', tree_diff),
+    ('highlight', highlight),
+    ('filter', filter_rows),
+    ('qt filter', qt_filter),
+]
+
+# Stages nothing else needs (apart from the text diff needing the lines from stringify), which can be left out
+optional_stages = ['stringify', 'text diff', 'hash', 'highlight', 'filter', 'qt filter']
+
+
+class Timer(object):
+    """
+    Records how long each stage takes, and optionally the peak memory it allocates
+    """
+
+    def __init__(self, skip, trace_memory=False):
+        self.skip = skip
+        self.trace_memory = trace_memory
+        self.seconds = OrderedDict()
+        self.peak_bytes = OrderedDict()
+
+    @contextmanager
+    def measure(self, name):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        yield
+        self.seconds[name] = time.perf_counter() - start
+        if self.trace_memory:
+            self.peak_bytes[name] = tracemalloc.get_traced_memory()[1] - start_memory
+
+
+def benchmark(case, repeat, defer_size, skip):
+    """
+    Times a case, returning the quickest time of each stage over repeat runs and its peak memory (from one more run,
+    as tracing memory slows everything down)
+    """
+    directory = tempfile.mkdtemp()
+    paths = [os.path.join(directory, side + '.dcm') for side in ('left', 'right')]
+    try:
+        for dataset, path in zip(make_pair(case), paths):
+            dataset.save_as(path, write_like_original=False)
+        results = OrderedDict()
+        for _ in range(repeat):
+            timer = Timer(skip)
+            run_case(paths, timer, defer_size)
+            for name, seconds in timer.seconds.items():
+                results.setdefault(name, {'seconds': seconds})
+                results[name]['seconds'] = min(results[name]['seconds'], seconds)
+        timer = Timer(skip, trace_memory=True)
+        tracemalloc.start()
+        try:
+            run_case(paths, timer, defer_size)
+        finally:
+            tracemalloc.stop()
+        for name, peak_bytes in timer.peak_bytes.items():
+            results[name]['peak_bytes'] = peak_bytes
+        return results
+    finally:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        os.rmdir(directory)
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the (case, stage, seconds, baseline seconds) of every stage that is slower than its baseline by more than
+    threshold
+    """
+    regressions = []
+    for case_name, stages in results.items():
+        for name, result in stages.items():
+            base = baseline.get('cases', {}).get(case_name, {}).get(name)
+            if base is not None and base['seconds'] >= min_seconds and \
+                    result['seconds'] > base['seconds'] * (1 + threshold):
+                regressions.append((case_name, name, result['seconds'], base['seconds']))
+    return regressions
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description='Benchmark loading and diffing')
+    parser.add_argument('--case', action='append', choices=[case.name for case in cases],
+                        help='run just this case (can be given more than once)')
+    parser.add_argument('--elements', type=int, help='run a custom case with this many elements in each dataset')
+    parser.add_argument('--depth', type=int, default=0, help='nesting depth of sequences in the custom case')
+    parser.add_argument('--items', type=int, default=0, help='items in each sequence of the custom case')
+    parser.add_argument('--value-size', type=int, default=256, help='bytes in each binary value of the custom case')
+    parser.add_argument('--different', type=float, default=0.01,
+                        help='fraction of elements that are different in the custom case')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs of each case, of which the quickest counts')
+    parser.add_argument('--defer-size', type=int, default=default_defer_size,
+                        help='values larger than this many bytes are left in the file (0 reads everything)')
+    parser.add_argument('--skip', action='append', default=[], choices=optional_stages,
+                        help='leave out a stage (can be given more than once)')
+    parser.add_argument('--baseline', default=default_baseline, help='baseline results to compare with')
+    parser.add_argument('--save', action='store_true', help='save the results as the baseline')
+    parser.add_argument('--threshold', type=float, default=default_threshold,
+                        help='flag stages slower than the baseline by more than this fraction')
+    args = parser.parse_args(arguments)
+
+    if args.elements is not None:
+        selected = [Case('custom', args.elements, args.depth, args.items, args.value_size, args.different)]
+    else:
+        selected = [case for case in cases if args.case is None or case.name in args.case]
+    skip = set(args.skip)
+    if 'stringify' in skip:
+        skip.add('text diff')
+    try:
+        import PyQt5.QtWidgets
+    except ImportError:
+        skip.add('qt filter')
+    if 'qt filter' not in skip:
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        # The models only need an application to exist, not a window
+        global application
+        application = PyQt5.QtWidgets.QApplication.instance() or PyQt5.QtWidgets.QApplication([])
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = OrderedDict()
+    print('{0:<14} {1:<10} {2:>10} {3:>10} {4:>10}'.format('case', 'stage', 'seconds', 'peak MB', 'baseline'))
+    for case in selected:
+        results[case.name] = benchmark(case, args.repeat, args.defer_size if args.defer_size > 0 else None, skip)
+        for name, result in results[case.name].items():
+            base = baseline.get('cases', {}).get(case.name, {}).get(name)
+            print('{0:<14} {1:<10} {2:>10.3f} {3:>10.1f} {4:>10}'.format(
+                case.name, name, result['seconds'], result['peak_bytes'] / 1024.0 / 1024.0,
+                '{0:.3f}'.format(base['seconds']) if base is not None else ''))
+
+    if args.save:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({'python': platform.python_version(), 'pydicom': pydicom.__version__,
+                       'machine': platform.platform(), 'cases': results}, baseline_file, indent=2)
+        print('Saved the results as the baseline in ' + args.baseline)
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for case_name, name, seconds, base_seconds in regressions:
+        print('REGRESSION: {0} {1} took {2:.3f} s, {3:.0%} longer than the baseline of {4:.3f} s'.format(
+            case_name, name, seconds, seconds / base_seconds - 1, base_seconds))
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
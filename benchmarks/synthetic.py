@@ -0,0 +1,87 @@
+"""
+    Synthetic DICOM datasets for the benchmarks, built in code so that every run times exactly the same data.
+
+    A case gives the number of elements in each dataset (the top level one, and each sequence item), how deeply
+    sequences are nested and how many items each has, the size of the binary values and the fraction of elements that
+    are different in the right hand dataset. Every dataset above the deepest level holds one sequence, so a case has
+    about elements * (1 + items + items ** 2 + ... + items ** depth) elements in all.
+"""
+from collections import namedtuple
+import random
+# pydicom is MIT licenced
+import pydicom
+from pydicom.dataset import Dataset, FileDataset
+from pydicom.sequence import Sequence
+
+Case = namedtuple('Case', ['name', 'elements', 'depth', 'items', 'value_size', 'different'])
+
+cases = [
+    Case('flat', 20000, 0, 0, 256, 0.01),
+    Case('nested', 40, 3, 10, 256, 0.01),
+    Case('multiframe', 20, 1, 3000, 64, 0.001),
+    Case('large values', 60, 0, 0, 4 * 1024 * 1024, 0.05),
+]
+
+group = 0x0019  # a private group, so the generated elements can't clash with anything in the dictionary
+first_element = 0x1000
+sequence_element = 0x0fff
+binary_every = 10  # one element in this many has a binary value of the case's value_size
+
+
+def make_pair(case, seed=0):
+    """
+    Returns the left and right datasets of a case. The right one is a copy of the left with a fraction of its values
+    changed, chosen at random (but the same for every run with the same seed).
+    """
+    left = _make_dataset(case, 0)
+    right = _make_dataset(case, 0)
+    _change_values(right, case.different, random.Random(seed))
+    return _file_dataset(left), _file_dataset(right)
+
+
+def _make_dataset(case, level, item_number=0):
+    dataset = Dataset()
+    for n in range(case.elements):
+        tag = pydicom.tag.Tag(group, first_element + n)
+        if n % binary_every == binary_every - 1:
+            dataset.add_new(tag, 'OB', bytes(bytearray((n + i) % 256 for i in range(256))) * (case.value_size // 256)
+                            + b'\x00' * (case.value_size % 256))
+        elif n % 3 == 0:
+            dataset.add_new(tag, 'LO', 'Value {0:d} of item {1:d} at level {2:d}'.format(n, item_number, level))
+        elif n % 3 == 1:
+            dataset.add_new(tag, 'DS', '{0:.4f}'.format(n / 7.0))
+        else:
+            dataset.add_new(tag, 'US', n % 65536)
+    if level < case.depth:
+        dataset.add_new(pydicom.tag.Tag(group, sequence_element), 'SQ',
+                        Sequence([_make_dataset(case, level + 1, item_number) for item_number in range(case.items)]))
+    return dataset
+
+
+def _change_values(dataset, fraction, rng):
+    for data_element in dataset:
+        if data_element.VR == 'SQ':
+            for item in data_element.value:
+                _change_values(item, fraction, rng)
+        elif rng.random() < fraction:
+            if data_element.VR == 'OB':
+                value = bytearray(data_element.value)
+                value[len(value) // 2] ^= 0xff
+                data_element.value = bytes(value)
+            elif data_element.VR == 'US':
+                data_element.value = (data_element.value + 1) % 65536
+            elif data_element.VR == 'DS':
+                data_element.value = '-1.0'
+            else:
+                data_element.value = 'Changed'
+
+
+def _file_dataset(dataset):
+    file_meta = Dataset()
+    file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.7'  # Secondary Capture Image Storage
+    file_meta.MediaStorageSOPInstanceUID = pydicom.uid.generate_uid()
+    file_meta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
+    file_dataset = FileDataset('', dataset, file_meta=file_meta, preamble=b'\x00' * 128)
+    file_dataset.is_little_endian = True
+    file_dataset.is_implicit_VR = False
+    return file_dataset
@@ -0,0 +1,214 @@
+"""
+    Command line batch diffing of many pairs of DICOM files, without a GUI (PyQt is never imported).
+
+    Each pair is diffed in a pool of worker processes, and the result for every pair is written as one line of JSON.
+    Pairs of directories are also accepted, in which case their files are paired up first. Alternatively, every file can
+    be diffed against a baseline profile of a single reference file (see core.profile), or searched (see core.search).
+    The exit status is 0 if no differences were found, 1 if any pair was different and 2 if any file couldn't be read.
+"""
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+import argparse
+import json
+import os
+import sys
+
+from core.diff import diff_files, parse_item_keys
+from core.directory import diff_directories, list_files, IDENTICAL
+from core.profile import compile_profile, diff_profile_file, load_profile
+from core.search import search_file
+from core.reader import default_defer_size
+
+EXIT_IDENTICAL = 0
+EXIT_DIFFERENT = 1
+EXIT_ERROR = 2
+
+
+class InProcessExecutor(Executor):
+    """
+    Runs everything in this process, one call at a time, for when only one worker is asked for (which also makes
+    problems easier to debug). map() is lazy, so results are written as they are found.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def map(self, fn, *iterables, timeout=None, chunksize=1):
+        return map(fn, *iterables)
+
+
+def _executor(workers):
+    return InProcessExecutor() if workers == 1 else ProcessPoolExecutor(max_workers=workers)
+
+
+def read_manifest(manifest_path):
+    """
+    Reads pairs of paths from a manifest file, one pair per line separated by a tab (or any whitespace if there is no
+    tab on the line). Blank lines and lines starting with # are ignored.
+    """
+    pairs = []
+    with open(manifest_path) as manifest:
+        for line_number, line in enumerate(manifest):
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            paths = line.split('\t') if '\t' in line else line.split()
+            if len(paths) != 2:
+                raise ValueError('{0} line {1}: expected two paths'.format(manifest_path, line_number + 1))
+            pairs.append((paths[0].strip(), paths[1].strip()))
+    return pairs
+
+
+def run_batch(pairs, output, workers=None, defer_size=default_defer_size, item_keys=None):
+    """
+    Diffs each pair of paths, writing a line of JSON to output for each (in the same order as pairs). A pair of
+    directories has its files paired up (see core.directory), and a line is written for each pair of files found.
+    Returns the exit status for the whole batch.
+    """
+    file_pairs = [pair for pair in pairs if not (os.path.isdir(pair[0]) and os.path.isdir(pair[1]))]
+    directory_pairs = [pair for pair in pairs if os.path.isdir(pair[0]) and os.path.isdir(pair[1])]
+
+    # Hand out the pairs in a few chunks per worker, so the overhead of passing them between processes stays small
+    chunksize = max(1, len(file_pairs) // (8 * (workers or os.cpu_count() or 1)))
+    with _executor(workers) as executor:
+        results = executor.map(diff_files, [left for left, _ in file_pairs], [right for _, right in file_pairs],
+                               [defer_size] * len(file_pairs), [item_keys] * len(file_pairs), chunksize=chunksize)
+        status = _write_results(results, output)
+        for left, right in directory_pairs:
+            results = (pair_result._asdict() for pair_result in
+                       diff_directories(left, right, executor, defer_size, item_keys))
+            status = max(status, _write_results(results, output))
+    return status
+
+
+def run_baseline(profile_path, paths, output, workers=None, defer_size=default_defer_size, item_keys=None):
+    """
+    Diffs each file (or every file below each directory) against a baseline profile, writing a line of JSON to output
+    for each. Returns the exit status for the whole batch.
+    """
+    profile = load_profile(profile_path)
+    if profile.is_stale():
+        sys.stderr.write('Warning: {0} has changed since {1} was compiled\n'.format(profile.source, profile_path))
+    files = _expand_directories(paths)
+    chunksize = max(1, len(files) // (8 * (workers or os.cpu_count() or 1)))
+    with _executor(workers) as executor:
+        results = executor.map(diff_profile_file, [profile_path] * len(files), files, [defer_size] * len(files),
+                               [item_keys] * len(files), chunksize=chunksize)
+        return _write_results(results, output)
+
+
+def run_search(query, paths, output, workers=None, defer_size=default_defer_size):
+    """
+    Searches each file (or every file below each directory), writing a line of JSON to output for each. Returns
+    EXIT_IDENTICAL (0) if anything was found, EXIT_DIFFERENT (1) if nothing was and EXIT_ERROR if any file couldn't be
+    read, like grep.
+    """
+    files = _expand_directories(paths)
+    chunksize = max(1, len(files) // (8 * (workers or os.cpu_count() or 1)))
+    status = EXIT_DIFFERENT
+    with _executor(workers) as executor:
+        for result in executor.map(search_file, files, [query] * len(files), [defer_size] * len(files),
+                                   chunksize=chunksize):
+            output.write(json.dumps(result) + '\n')
+            if 'error' in result:
+                status = EXIT_ERROR
+            elif len(result['matches']) > 0 and status == EXIT_DIFFERENT:
+                status = EXIT_IDENTICAL
+    return status
+
+
+def _expand_directories(paths):
+    files = []
+    for path in paths:
+        files.extend(list_files(path) if os.path.isdir(path) else [path])
+    return files
+
+
+def _write_results(results, output):
+    status = EXIT_IDENTICAL
+    for result in results:
+        output.write(json.dumps(result) + '\n')
+        if result.get('error') is not None:
+            status = EXIT_ERROR
+        elif not (result.get('identical') or result.get('status') == IDENTICAL) and status == EXIT_IDENTICAL:
+            status = EXIT_DIFFERENT
+    return status
+
+
+def _worker_count(text):
+    try:
+        workers = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError('must be a whole number')
+    if workers < 1:
+        raise argparse.ArgumentTypeError('must be at least 1')
+    return workers
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(prog='QDICOMDiffer.py --batch',
+                                     description='Diff pairs of DICOM files without a GUI, writing JSON Lines results')
+    parser.add_argument('files', nargs='*', help='pairs of files or directories to diff, '
+                                                 'i.e. left1 right1 left2 right2 ... (or single files with --baseline)')
+    parser.add_argument('-m', '--manifest', help='file listing a pair of tab separated paths on each line')
+    parser.add_argument('-o', '--output', help='file to write the results to (default: standard output)')
+    parser.add_argument('-j', '--workers', type=_worker_count, default=None,
+                        help='number of worker processes (default: one per CPU, 1 diffs in this process)')
+    parser.add_argument('--defer-size', type=int, default=default_defer_size,
+                        help='values larger than this many bytes are compared by streaming them from the file '
+                             '(0 reads everything up front)')
+    parser.add_argument('-b', '--baseline', metavar='PROFILE',
+                        help='diff each file against a compiled baseline profile instead of in pairs')
+    parser.add_argument('-s', '--search', metavar='QUERY',
+                        help='search each file for elements matching a query (e.g. "(0018,*)" or "*UID*") '
+                             'instead of diffing')
+    parser.add_argument('--compile-profile', nargs=2, metavar=('REFERENCE', 'PROFILE'),
+                        help='compile a reference file into a baseline profile, then exit')
+    parser.add_argument('--item-keys', metavar='KEYS', default='',
+                        help='elements used to match up the items of sequences, e.g. '
+                             '"ReferencedImageSequence: ReferencedSOPInstanceUID, ReferencedFrameNumber" '
+                             '(see the README)')
+    args = parser.parse_args(arguments)
+    defer_size = args.defer_size if args.defer_size > 0 else None
+    try:
+        item_keys = parse_item_keys(args.item_keys)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.compile_profile is not None:
+        try:
+            compile_profile(args.compile_profile[0], args.compile_profile[1], defer_size)
+        except Exception as e:
+            sys.stderr.write("Couldn't compile {0} into {1}: {2}: {3}\n".format(
+                args.compile_profile[0], args.compile_profile[1], type(e).__name__, e))
+            return EXIT_ERROR
+        return EXIT_IDENTICAL
+    if args.baseline is not None or args.search is not None:
+        if len(args.files) == 0:
+            parser.error('no files given')
+        if args.search is not None:
+            if args.output is None:
+                return run_search(args.search, args.files, sys.stdout, args.workers, defer_size)
+            with open(args.output, 'w') as output:
+                return run_search(args.search, args.files, output, args.workers, defer_size)
+        if args.output is None:
+            return run_baseline(args.baseline, args.files, sys.stdout, args.workers, defer_size, item_keys)
+        with open(args.output, 'w') as output:
+            return run_baseline(args.baseline, args.files, output, args.workers, defer_size, item_keys)
+
+    if len(args.files) % 2 != 0:
+        parser.error('files must be given in pairs')
+    pairs = list(zip(args.files[0::2], args.files[1::2]))
+    if args.manifest is not None:
+        pairs.extend(read_manifest(args.manifest))
+    if len(pairs) == 0:
+        parser.error('no files to diff')
+
+    if args.output is None:
+        return run_batch(pairs, sys.stdout, args.workers, defer_size, item_keys)
+    with open(args.output, 'w') as output:
+        return run_batch(pairs, output, args.workers, defer_size, item_keys)
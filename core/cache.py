@@ -0,0 +1,104 @@
+"""
+    An in-memory cache of read datasets and their tables, so reopening a recently used file is instant. Anything else
+    worked out from a file in the background (its search index and hashes) is kept with it, so isn't worked out again.
+"""
+from collections import OrderedDict
+import os
+import threading
+
+from core.reader import dataset_elements, DeferredElement
+
+default_cache_size = 512 * 1024 * 1024  # bytes
+
+
+class DatasetCache(object):
+    """
+    A least recently used cache of datasets and their tables. Entries are keyed by the path, size and modification
+    time of the file (so a file that has changed is always read again) along with the options it was read with. The
+    least recently used entries are dropped once the estimated memory they use goes over max_bytes.
+    """
+
+    def __init__(self, max_bytes=default_cache_size):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()  # files are read, and so cached, from several threads at once
+
+    @staticmethod
+    def key(filepath, *options):
+        """
+        Returns the key for a file read with the given options, or None if it can't be found
+        """
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        return (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns) + options
+
+    def get(self, key):
+        """
+        Returns the (dataset, table, extras) cached for a key, or None. The table is a copy, with no diff state, so it
+        can be used without affecting anything else using the same file. extras is a dictionary of anything kept with
+        the file by update().
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+        dataset, table, size, extras = entry
+        return dataset, table.copy(), dict(extras)
+
+    def put(self, key, dataset, table):
+        """
+        Caches a dataset and its table. The table must not be used elsewhere afterwards; use a copy from get() instead.
+        """
+        if key is None or self.max_bytes <= 0:
+            return
+        size = estimate_size(key[1], dataset)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.used_bytes -= self._entries.pop(key)[2]
+            self._entries[key] = (dataset, table, size, {})
+            self.used_bytes += size
+            self._evict()
+
+    def update(self, key, table=None, **extras):
+        """
+        Keeps extras (e.g. search_index=...) with a cached file, and estimates the memory it uses again, as values may
+        have been read into its dataset since it was cached. A table given replaces the cached one (e.g. once it has
+        been fully expanded), and like in put() must not be used elsewhere afterwards. Does nothing if the file is no
+        longer cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            dataset, cached_table, size, cached_extras = entry
+            new_size = estimate_size(key[1], dataset)
+            cached_extras.update(extras)
+            self._entries[key] = (dataset, table if table is not None else cached_table, new_size, cached_extras)
+            self.used_bytes += new_size - size
+            self._evict()
+
+    def _evict(self):
+        while self.used_bytes > self.max_bytes:
+            _, (_, _, evicted_size, _) = self._entries.popitem(last=False)
+            self.used_bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+
+def estimate_size(file_size, dataset):
+    """
+    Estimates the memory used by a dataset read from a file of file_size bytes, i.e. the file size less any values that
+    were left in the file
+    """
+    deferred_size = sum(data_element.length for data_element in dataset_elements(dataset)
+                        if isinstance(data_element, DeferredElement) and data_element.in_file)
+    return max(file_size - deferred_size, 0)
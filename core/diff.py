@@ -0,0 +1,407 @@
+"""
+    Structural diffing of pydicom datasets, independent of any GUI code.
+
+    Every row shown in the tree (an element or a sequence item) is identified by its path: the tags and item numbers
+    leading to it from the top level dataset, e.g. (0x300a0010, 1, 0x300a0012) is the Dose Reference Number of the
+    second item of the Dose Reference Sequence. Rows are aligned by this path rather than by their text, so an extra
+    element in one file can never shift the rest of the comparison out of step.
+
+    Items of a sequence are aligned by their position, unless the sequence has item keys: elements within each item
+    (e.g. the Referenced SOP Instance UID) whose values identify it. Items are then matched with the item that has the
+    same key in the other dataset, wherever it is, so an item inserted or moved in a sequence of thousands (e.g. the
+    per-frame functional groups of an enhanced multi-frame image) is reported as just that. Items without a key are
+    aligned by their position amongst the others without one.
+
+    Differences are found lazily by iter_differences(), so they can be streamed out as they are found, or the
+    comparison stopped after the first one, e.g.
+
+        identical = next(iter_differences('left.dcm', 'right.dcm'), None) is None
+"""
+from collections import namedtuple, deque
+import itertools
+import os
+import re
+import struct
+
+from core.hashing import value_digest, raw_vrs
+from core.reader import read_dataset, dataset_elements, elements_equal, DeferredElement, default_defer_size
+# pydicom is MIT licenced
+import pydicom
+
+ADDED = 'added'  # the row only exists in the right hand dataset
+REMOVED = 'removed'  # the row only exists in the left hand dataset
+CHANGED = 'changed'  # the row exists in both, but is displayed differently
+
+DiffRecord = namedtuple('DiffRecord', ['kind', 'path', 'left', 'right', 'right_path'])
+DiffRecord.__new__.__defaults__ = (None,)
+DiffRecord.__doc__ = """
+A single difference between two datasets. left and right are the displayed values of the row in each dataset, or None
+if the row doesn't exist on that side. path is the path of the row in the left dataset (or the right, for a row that
+was added). right_path is the path of a changed row in the right dataset, if its sequence items were matched by key
+and it isn't the same as path.
+"""
+
+# The item keys of sequences, by the tag of the sequence. Each key is the tags leading to an element within an item,
+# through the first item of any sequences on the way.
+default_item_keys = {
+    # Per-frame Functional Groups: the Dimension Index Values and In-Stack Position Number of the Frame Content
+    0x52009230: ((0x00209111, 0x00209157), (0x00209111, 0x00209057)),
+    0x00081115: ((0x0020000e,),),  # Referenced Series: Series Instance UID
+    0x00081140: ((0x00081155,),),  # Referenced Image: Referenced SOP Instance UID
+    0x0008114a: ((0x00081155,),),  # Referenced Instance: Referenced SOP Instance UID
+    0x00081199: ((0x00081155,),),  # Referenced SOP: Referenced SOP Instance UID
+    0x30060016: ((0x00081155,),),  # Contour Image: Referenced SOP Instance UID
+}
+
+# This regex is used to match a memory offset used in the description of pydicom sequences
+# comma, whitespace, the word 'at', whitespace, followed by seven to 12 hex digits
+sequence_regex = re.compile(r',\sat\s[0-9A-F]{7,12}')
+long_vrs = {'OB', 'OD', 'OF', 'OW', 'UN', 'UT'}  # VRs pydicom shows as "Array of N elements" once they are long
+max_value_lines = 100000  # lines of a whole value shown at most
+# The struct formats of VRs holding binary numbers, which are unpacked from a value streamed from the file
+number_formats = {'US': 'H', 'SS': 'h', 'UL': 'L', 'SL': 'l', 'FL': 'f', 'FD': 'd', 'UV': 'Q', 'SV': 'q'}
+
+
+def element_strings(data_element):
+    """
+    Returns the tag, description and value of an element as they are displayed in the tree
+    """
+    tag = str(data_element.tag)
+    desc = data_element.description()
+    # This is what str(data_element) shows after the tag and description, without formatting the whole line
+    value = '{0}: {1}'.format(data_element.VR, data_element.repval or '').strip()
+    """
+    This is a weird one. By default, pydicom includes a memory offset which we need to remove because it is
+    non deterministic. Any non-deterministic stuff in the description will make diffing two files impossible.
+    More info here https://github.com/darcymason/pydicom/issues/107
+    """
+    value = sequence_regex.sub('', value)
+    return tag, desc, value
+
+
+def is_truncated(data_element):
+    """
+    Returns True if the value displayed for an element is only part of it (or a placeholder for it), in which case
+    value_lines() gives the whole of it
+    """
+    if isinstance(data_element, DeferredElement):
+        return True
+    if data_element.VR == 'SQ':
+        return False
+    # pydicom shows values longer than this as "Array of N elements"
+    max_bytes = getattr(data_element, 'maxBytesToDisplay', 16)
+    if set(data_element.VR.split(' or ')) & long_vrs and isinstance(data_element.value, (bytes, str)):
+        return len(data_element.value) > max_bytes
+    return data_element.VM > max_bytes
+
+
+def value_lines(data_element, max_lines=max_value_lines):
+    """
+    Returns the whole value of an element as a list of lines of text (at most max_lines of them): a hex dump of binary
+    values, or a line for each value of multi-valued ones. Values that were left in the file are read from it, only as
+    far as the lines shown if they are binary (see is_streamed).
+    """
+    if isinstance(data_element, DeferredElement):
+        if is_streamed(data_element):
+            return list(itertools.islice(_streamed_lines(data_element), max_lines))
+        data_element = data_element.read()
+    value = data_element.value
+    if isinstance(value, bytes):
+        lines = ('{0:08x}  {1}'.format(offset, ' '.join('{0:02x}'.format(byte) for byte in value[offset:offset + 16]))
+                 for offset in range(0, len(value), 16))
+    elif isinstance(value, (list, tuple, pydicom.multival.MultiValue)):
+        lines = ('[{0:d}] {1!r}'.format(n, item) for n, item in enumerate(value))
+    else:
+        lines = str(value).splitlines()
+    return list(itertools.islice(lines, max_lines))
+
+
+def is_streamed(data_element):
+    """
+    Returns True if an element is a DeferredElement whose lines value_lines() makes from its bytes as they are streamed
+    from the file, rather than reading it all. Such values are always too long to be shown in full in the tree.
+    """
+    return isinstance(data_element, DeferredElement) and (data_element.VR in raw_vrs or
+                                                          data_element.VR in number_formats)
+
+
+def _streamed_lines(data_element):
+    # The same lines value_lines() makes from the value once it is read, a chunk of the value at a time
+    if data_element.VR in number_formats:
+        number_format = ('<' if data_element.is_little_endian else '>') + number_formats[data_element.VR]
+        size = struct.calcsize(number_format)
+    else:
+        size = 16
+    n = 0
+    rest = b''
+    for chunk in data_element.iter_chunks():
+        data = rest + bytes(chunk)
+        end = len(data) - len(data) % size
+        rest = data[end:]
+        if data_element.VR in number_formats:
+            for (number,) in struct.iter_unpack(number_format, data[:end]):
+                yield '[{0:d}] {1!r}'.format(n, number)
+                n += 1
+        else:
+            for offset in range(0, end, 16):
+                yield _hex_line(n * 16, data[offset:offset + 16])
+                n += 1
+    if len(rest) > 0 and data_element.VR not in number_formats:
+        yield _hex_line(n * 16, rest)
+
+
+def _hex_line(offset, data):
+    return '{0:08x}  {1}'.format(offset, ' '.join('{0:02x}'.format(byte) for byte in data))
+
+
+def dataset_lines(dataset, indent=0):
+    """
+    Returns the lines of a text dump of a dataset, each terminated with a newline. This is the same layout as
+    str(dataset) in pydicom, except that values still in the file are shown as placeholders rather than being read.
+    """
+    lines = []
+    indent_str = '   ' * indent
+    nextindent_str = '   ' * (indent + 1)
+    for data_element in dataset_elements(dataset):
+        if data_element.VR == 'SQ':
+            lines.append(indent_str + str(data_element.tag) + "  %s   %i item(s) ---- \n" %
+                         (data_element.description(), len(data_element.value)))
+            for item in data_element.value:
+                lines.extend(dataset_lines(item, indent + 1))
+                lines.append(nextindent_str + "---------\n")
+        else:
+            lines.append(indent_str + str(data_element) + "\n")
+    return lines
+
+
+def item_strings(data_element, item_number):
+    """
+    Returns the description and value displayed for item number item_number (counting from 0) of a sequence element
+    """
+    sq_item_description = data_element.name.replace(" Sequence", "")  # XXX not i18n
+    item_text = "{0:s} {1:d}".format(sq_item_description, item_number + 1)
+    return sq_item_description, item_text
+
+
+def path_to_list(path):
+    """
+    Converts a path to a list suitable for JSON, with tags as eight hex digits and item numbers counting from 1 (as
+    they are labelled in the tree), e.g. ['300A0010', 2, '300A0012']
+    """
+    return ['{0:08X}'.format(key) if n % 2 == 0 else key + 1 for n, key in enumerate(path)]
+
+
+def iter_differences(left, right, progress=None, hashes=None, item_keys=None, defer_size=default_defer_size):
+    """
+    Compares two datasets element by element, yielding a DiffRecord for each difference as it is found, in the order
+    the rows appear in the tree. Elements within a dataset are kept sorted by tag, so each level is aligned with a
+    single linear merge. Rows that are added or removed are reported once; everything beneath them is implied. Nothing
+    more is compared than is needed for the records taken, so stopping early skips the rest of the work.
+
+    left and right can also be paths, in which case the files are read (with defer_size) when the first record is
+    asked for.
+
+    If a core.progress.Progress is given, it is updated with the number of records found so far and checked for
+    cancellation as each dataset is compared.
+
+    hashes can be a pair of dictionaries from core.hashing.subtree_hashes() for the left and right datasets. Datasets
+    and sequence items with the same hash on both sides are then skipped without being compared, so the time taken
+    depends on the size of the differences rather than the size of the files.
+
+    item_keys are the keys used to match up sequence items (default_item_keys if not given).
+    """
+    if isinstance(left, (str, os.PathLike)):
+        left = read_dataset(left, defer_size=defer_size)
+    if isinstance(right, (str, os.PathLike)):
+        right = read_dataset(right, defer_size=defer_size)
+    count = 0
+    for record in _diff_dataset(left, right, ((), ()), progress, hashes,
+                                default_item_keys if item_keys is None else item_keys):
+        count += 1
+        if progress is not None:
+            progress.update(count)
+        yield record
+
+
+def diff_datasets(left, right, progress=None, hashes=None, item_keys=None):
+    """
+    Compares two datasets and returns the list of all their DiffRecords (see iter_differences)
+    """
+    return list(iter_differences(left, right, progress, hashes, item_keys))
+
+
+def diff_files(left_path, right_path, defer_size=default_defer_size, item_keys=None):
+    """
+    Diffs two files and returns the result as a dictionary that can be written out as JSON. Any problem reading the
+    files is returned as an error rather than raised, so one bad file doesn't stop the rest of a batch.
+    """
+    result = {'left': left_path, 'right': right_path}
+    try:
+        records = list(iter_differences(left_path, right_path, item_keys=item_keys, defer_size=defer_size))
+    except Exception as e:
+        result['error'] = '{0}: {1}'.format(type(e).__name__, e)
+        return result
+    result['identical'] = len(records) == 0
+    result['differences'] = [record_to_dict(record) for record in records]
+    return result
+
+
+def record_to_dict(record):
+    """
+    Converts a DiffRecord to a dictionary that can be written out as JSON
+    """
+    difference = {'kind': record.kind, 'path': path_to_list(record.path), 'left': record.left, 'right': record.right}
+    if record.right_path is not None:
+        difference['right_path'] = path_to_list(record.right_path)
+    return difference
+
+
+def parse_item_keys(text):
+    """
+    Parses item keys written as text, and returns them added to (or replacing) default_item_keys. Each sequence is
+    given as its keyword (or tag as eight hex digits), a colon and its keys separated by commas, with semicolons between
+    sequences. The tags of a key within a sequence of the item are separated by dots. e.g.
+        ReferencedImageSequence: ReferencedSOPInstanceUID, ReferencedFrameNumber; 00540016: 00540300.00080100
+    A sequence with no keys after the colon has its items aligned by position. Raises ValueError if the text can't be
+    parsed.
+    """
+    item_keys = dict(default_item_keys)
+    for sequence_text in text.split(';'):
+        if sequence_text.strip() == '':
+            continue
+        if ':' not in sequence_text:
+            raise ValueError('Expected a colon after the sequence in "{0}"'.format(sequence_text.strip()))
+        sequence, keys = sequence_text.split(':', 1)
+        sequence_tag = _parse_tag(sequence)
+        item_keys[sequence_tag] = tuple(tuple(_parse_tag(tag) for tag in key.split('.'))
+                                        for key in keys.split(',') if key.strip() != '')
+    return item_keys
+
+
+def _parse_tag(text):
+    text = text.strip()
+    tag = pydicom.datadict.tag_for_keyword(text)
+    if tag is not None:
+        return tag
+    try:
+        if len(text) == 8:
+            return int(text, 16)
+    except ValueError:
+        pass
+    raise ValueError('"{0}" is not a keyword or a tag'.format(text))
+
+
+def align_items(left_keys, right_keys):
+    """
+    Matches up the items of a sequence in two datasets given the key of each (None for an item without one). Each item
+    is matched with the first unmatched item with the same key on the other side, which for items without a key is the
+    next one by position. Returns a list of (left item number, right item number) pairs in the order of the left items,
+    with None for an item with no match, and the unmatched right items at the end.
+    """
+    unmatched = {}
+    for right_item_number, key in enumerate(right_keys):
+        unmatched.setdefault(key, deque()).append(right_item_number)
+    pairs = []
+    for left_item_number, key in enumerate(left_keys):
+        matches = unmatched.get(key)
+        pairs.append((left_item_number, matches.popleft() if matches else None))
+    matched = set(right_item_number for _, right_item_number in pairs)
+    pairs.extend((None, right_item_number) for right_item_number in range(len(right_keys))
+                 if right_item_number not in matched)
+    return pairs
+
+
+def item_key(item, keys):
+    """
+    Returns the key of a sequence item (see default_item_keys), as a tuple of the digests of the values of its key
+    elements, or None if it has none of them
+    """
+    key = tuple(_key_digest(item, key_tags) for key_tags in keys)
+    return key if any(digest is not None for digest in key) else None
+
+
+def _key_digest(dataset, key_tags):
+    for tag in key_tags[:-1]:
+        if tag not in dataset or dataset[tag].VR != 'SQ' or len(dataset[tag].value) == 0:
+            return None
+        dataset = dataset[tag].value[0]
+    if key_tags[-1] not in dataset or dataset[key_tags[-1]].VR == 'SQ':
+        return None
+    return value_digest(dataset[key_tags[-1]])
+
+
+def _diff_dataset(left, right, paths, progress, hashes, item_keys):
+    left_path, right_path = paths
+    if hashes is not None:
+        left_hash = hashes[0].get(left_path)
+        if left_hash is not None and left_hash == hashes[1].get(right_path):
+            return
+    if progress is not None:
+        progress.check()
+    left_elements = list(dataset_elements(left))
+    right_elements = list(dataset_elements(right))
+    i = 0
+    j = 0
+    while i < len(left_elements) and j < len(right_elements):
+        left_tag = left_elements[i].tag
+        right_tag = right_elements[j].tag
+        if left_tag == right_tag:
+            yield from _diff_element(left_elements[i], right_elements[j], (left_path + (int(left_tag),),
+                                                                           right_path + (int(right_tag),)),
+                                     progress, hashes, item_keys)
+            i += 1
+            j += 1
+        elif left_tag < right_tag:
+            yield DiffRecord(REMOVED, left_path + (int(left_tag),), element_strings(left_elements[i])[2], None)
+            i += 1
+        else:
+            yield DiffRecord(ADDED, right_path + (int(right_tag),), None, element_strings(right_elements[j])[2])
+            j += 1
+    for data_element in left_elements[i:]:
+        yield DiffRecord(REMOVED, left_path + (int(data_element.tag),), element_strings(data_element)[2], None)
+    for data_element in right_elements[j:]:
+        yield DiffRecord(ADDED, right_path + (int(data_element.tag),), None, element_strings(data_element)[2])
+
+
+def _diff_element(left, right, paths, progress, hashes, item_keys):
+    left_path, right_path = paths
+    left_items = left.value if left.VR == 'SQ' else []
+    right_items = right.value if right.VR == 'SQ' else []
+
+    deferred = isinstance(left, DeferredElement) or isinstance(right, DeferredElement)
+    if left.VR == 'SQ' and right.VR == 'SQ':
+        # Sequences are displayed by their length, so there is no need to render them to compare
+        identical = len(left_items) == len(right_items)
+    elif deferred:
+        # Large values are compared by digest, without converting them
+        identical = elements_equal(left, right)
+    else:
+        # Comparing the values directly is much cheaper than formatting them, and is all that is needed in most cases
+        try:
+            identical = left.VR == right.VR and left.value == right.value
+        except TypeError:
+            # pydicom can't compare some values with a different number of values (e.g. a Tag with a list of Tags)
+            identical = False
+    if not identical:
+        left_strings = element_strings(left)
+        right_strings = element_strings(right)
+        # Large values are shown truncated, and can look the same even though the values differ
+        if left_strings != right_strings or is_truncated(left) or is_truncated(right):
+            yield DiffRecord(CHANGED, left_path, left_strings[2], right_strings[2],
+                             right_path if right_path != left_path else None)
+
+    keys = item_keys.get(int(left.tag), ())
+    if len(keys) > 0 and len(left_items) > 0 and len(right_items) > 0:
+        pairs = align_items([item_key(item, keys) for item in left_items],
+                            [item_key(item, keys) for item in right_items])
+    else:
+        pairs = align_items([None] * len(left_items), [None] * len(right_items))
+    for left_item_number, right_item_number in pairs:
+        if right_item_number is None:
+            yield DiffRecord(REMOVED, left_path + (left_item_number,), item_strings(left, left_item_number)[1], None)
+        elif left_item_number is None:
+            yield DiffRecord(ADDED, right_path + (right_item_number,), None, item_strings(right, right_item_number)[1])
+        else:
+            yield from _diff_dataset(left_items[left_item_number], right_items[right_item_number],
+                                     (left_path + (left_item_number,), right_path + (right_item_number,)),
+                                     progress, hashes, item_keys)
@@ -0,0 +1,112 @@
+"""
+    Diffing two directories of DICOM files (e.g. a study before and after anonymisation or migration).
+
+    Files are paired by SOPInstanceUID, then by InstanceNumber, then by their path relative to the directory. Only
+    the headers needed to pair files are read to begin with, and both the header scans and the diffs of each pair are
+    spread over a pool of worker processes.
+"""
+from collections import namedtuple
+import os
+
+from core.diff import diff_files
+from core.reader import default_defer_size
+# pydicom is MIT licenced
+import pydicom
+from pydicom.errors import InvalidDicomError
+
+IDENTICAL = 'identical'
+DIFFERENT = 'different'
+MISSING_LEFT = 'missing left'  # the file is only in the right hand directory
+MISSING_RIGHT = 'missing right'  # the file is only in the left hand directory
+ERROR = 'error'
+
+FileHeader = namedtuple('FileHeader', ['path', 'relative_path', 'sop_instance_uid', 'instance_number'])
+PairResult = namedtuple('PairResult', ['status', 'left', 'right', 'differences', 'error'])
+PairResult.__doc__ = """
+The result of diffing a pair of files. left or right is None if the file is missing from that directory, and
+differences is the list of differences found (as returned by core.diff.diff_files).
+"""
+
+
+def list_files(directory):
+    """
+    Returns the paths of every file below a directory, in a stable order
+    """
+    paths = []
+    for root, directories, filenames in os.walk(directory):
+        directories.sort()
+        for filename in sorted(filenames):
+            paths.append(os.path.join(root, filename))
+    return paths
+
+
+def read_header(path, directory):
+    """
+    Reads just the elements needed to pair a file up. Returns None if the file isn't DICOM, or can't be read.
+    """
+    try:
+        dataset = pydicom.read_file(path, stop_before_pixels=True,
+                                    specific_tags=['SOPInstanceUID', 'InstanceNumber'])
+    except (InvalidDicomError, OSError):
+        # Directories often hold files that aren't DICOM (e.g. notes or thumbnails), which are just skipped
+        return None
+    instance_number = dataset.get('InstanceNumber', None)
+    return FileHeader(path, os.path.relpath(path, directory), dataset.get('SOPInstanceUID', None),
+                      str(instance_number) if instance_number is not None else None)
+
+
+def pair_files(left_headers, right_headers):
+    """
+    Pairs up the files of two directories. Returns a list of (left, right) FileHeaders, where left or right is None
+    for a file that has no match in the other directory.
+    """
+    pairs = []
+    unpaired = [list(left_headers), list(right_headers)]
+    for key in ('sop_instance_uid', 'instance_number', 'relative_path'):
+        # Only use keys that identify a single file on both sides
+        lookups = []
+        for headers in unpaired:
+            lookup = {}
+            for header in headers:
+                value = getattr(header, key)
+                if value is not None:
+                    lookup.setdefault(value, []).append(header)
+            lookups.append(dict((value, found[0]) for value, found in lookup.items() if len(found) == 1))
+        matched = set(lookups[0]) & set(lookups[1])
+        for value in sorted(matched):
+            pairs.append((lookups[0][value], lookups[1][value]))
+        paired = set(id(header) for pair in pairs for header in pair)
+        unpaired = [[header for header in headers if id(header) not in paired] for headers in unpaired]
+    pairs.extend((header, None) for header in unpaired[0])
+    pairs.extend((None, header) for header in unpaired[1])
+    pairs.sort(key=lambda pair: (pair[0] or pair[1]).relative_path)
+    return pairs
+
+
+def diff_directories(left_directory, right_directory, executor, defer_size=default_defer_size, item_keys=None):
+    """
+    Pairs up and diffs the files of two directories using executor (e.g. a ProcessPoolExecutor). Yields a PairResult
+    for each pair, starting with the files missing from one side and then the diffs in the order they were started.
+    """
+    headers = []
+    for directory in (left_directory, right_directory):
+        paths = list_files(directory)
+        found = executor.map(read_header, paths, [directory] * len(paths), chunksize=max(1, len(paths) // 64))
+        headers.append([header for header in found if header is not None])
+
+    futures = []
+    for left, right in pair_files(headers[0], headers[1]):
+        if left is None:
+            yield PairResult(MISSING_LEFT, None, right.path, [], None)
+        elif right is None:
+            yield PairResult(MISSING_RIGHT, left.path, None, [], None)
+        else:
+            futures.append(executor.submit(diff_files, left.path, right.path, defer_size, item_keys))
+
+    for future in futures:
+        result = future.result()
+        if 'error' in result:
+            yield PairResult(ERROR, result['left'], result['right'], [], result['error'])
+        else:
+            yield PairResult(IDENTICAL if result['identical'] else DIFFERENT, result['left'], result['right'],
+                             result['differences'], None)
@@ -0,0 +1,116 @@
+"""
+    Merkle style hashes of datasets: each element is hashed from its value, each sequence item and dataset from the
+    hashes of its elements, and so on up to the top level dataset. Two subtrees with the same hash are the same, so a
+    diff can skip them without looking inside, and two files with the same top level hash are identical.
+
+    Values are hashed so that values diff_datasets() would find equal have the same digest, e.g. numbers by their value
+    rather than how they were written.
+
+    Values that were left in the file (see core.reader) aren't read just to hash them, unless asked to. Their hash is
+    unknown (None), as is the hash of every item and dataset above them, so those are always compared by the diff.
+"""
+from collections import namedtuple
+import hashlib
+import struct
+
+from core.reader import dataset_elements, DeferredElement
+# pydicom is MIT licenced
+import pydicom
+
+# Values with these VRs are hashed as their raw bytes, so it makes no difference whether they were deferred or not
+raw_vrs = ('OB', 'OD', 'OF', 'OL', 'OV', 'OW', 'UN', 'OB or OW', 'OW or OB')
+
+HashedDataset = namedtuple('HashedDataset', ['hash', 'elements'])
+HashedElement = namedtuple('HashedElement', ['data_element', 'digest', 'hash', 'items'])
+
+
+def value_digest(data_element):
+    """
+    Returns a digest of the VR and value of an element (other than a sequence)
+    """
+    digest = hashlib.blake2b(data_element.VR.encode('ascii'), digest_size=16)
+    if isinstance(data_element, DeferredElement):
+        if data_element.VR in raw_vrs:
+            digest.update(data_element.digest())
+            return digest.digest()
+        data_element = data_element.read()
+    value = data_element.value
+    if isinstance(value, bytes):
+        # The same as the digest of a DeferredElement, for values that weren't deferred
+        value = hashlib.blake2b(value, digest_size=16).digest()
+    else:
+        value = repr(_plain_value(value)).encode('utf-8', 'backslashreplace')
+    digest.update(value)
+    return digest.digest()
+
+
+def _plain_value(value):
+    # Numbers are compared by value rather than by how they were written (e.g. a DS of '1.000' equals one of '1'),
+    # so they are hashed as plain numbers
+    if isinstance(value, (list, tuple, pydicom.multival.MultiValue)):
+        return [_plain_value(item) for item in value]
+    if isinstance(value, float):
+        return float(value)
+    if isinstance(value, int):
+        return int(value)
+    return value
+
+
+def hash_dataset(dataset, read_deferred=True):
+    """
+    Hashes every element and sequence item of a dataset, bottom up. Returns a HashedDataset, with a HashedElement for
+    each of its elements (and a HashedDataset for each item of a sequence). If read_deferred is False, values still in
+    the file aren't read, and are left with no digest or hash, as is everything above them.
+    """
+    dataset_hash = hashlib.blake2b(digest_size=16)
+    known = True
+    elements = []
+    for data_element in dataset_elements(dataset):
+        if data_element.VR == 'SQ':
+            items = [hash_dataset(item, read_deferred) for item in data_element.value]
+            digest = None
+            if any(item.hash is None for item in items):
+                element_hash = None
+            else:
+                element_hash = hashlib.blake2b(b'SQ' + struct.pack('<Q', len(items)), digest_size=16)
+                for item in items:
+                    element_hash.update(item.hash)
+                element_hash = element_hash.digest()
+        elif not read_deferred and _needs_reading(data_element):
+            items = []
+            digest = None
+            element_hash = None
+        else:
+            items = []
+            digest = value_digest(data_element)
+            element_hash = digest
+        if element_hash is None:
+            known = False
+        elif known:
+            dataset_hash.update(struct.pack('<Q', int(data_element.tag)) + element_hash)
+        elements.append(HashedElement(data_element, digest, element_hash, items))
+    return HashedDataset(dataset_hash.digest() if known else None, elements)
+
+
+def _needs_reading(data_element):
+    # Whether hashing an element would read its value from the file, rather than use a digest worked out already
+    return isinstance(data_element, DeferredElement) and data_element.in_file and \
+        (data_element.VR not in raw_vrs or not data_element.has_digest())
+
+
+def subtree_hashes(dataset):
+    """
+    Hashes a dataset, and returns a dictionary of the hash of the dataset and of each of its sequence items, by their
+    path (see core.diff), for diff_datasets() to skip those that are the same. Values still in the file aren't read, so
+    the hashes of the datasets and items holding them are None.
+    """
+    hashes = {}
+    _add_hashes(hash_dataset(dataset, read_deferred=False), (), hashes)
+    return hashes
+
+
+def _add_hashes(hashed, path, hashes):
+    hashes[path] = hashed.hash
+    for hashed_element in hashed.elements:
+        for item_number, item in enumerate(hashed_element.items):
+            _add_hashes(item, path + (int(hashed_element.data_element.tag), item_number), hashes)
@@ -0,0 +1,169 @@
+"""
+    Side by side HTML reports of the text diff of two datasets, rendered a page at a time.
+
+    difflib.HtmlDiff marks up every line of both files into one document before anything can be shown, which for large
+    headers takes a long time and a lot of memory. Here the lines are matched once, and each page of the report is only
+    rendered when it is looked at. By default only the changes and a few lines either side of them are included, and a
+    report can be written to a file page by page, so the whole thing never has to be held in memory.
+"""
+import difflib
+import html
+
+default_context = 3  # unchanged lines shown either side of each change
+default_page_rows = 500
+
+header = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<style type="text/css">
+table.diff {font-family: Courier; border: medium;}
+.diff_header {background-color: #e0e0e0;}
+.diff_next {background-color: #c0c0c0;}
+.diff_add {background-color: #aaffaa;}
+.diff_chg {background-color: #ffff77;}
+.diff_sub {background-color: #ffaaaa;}
+</style>
+</head>
+<body>
+<table class="diff" cellspacing="0" cellpadding="1" rules="groups">
+<thead><tr><th colspan="2">{0}</th><th colspan="2">{1}</th></tr></thead>
+<tbody>
+"""
+footer = """</tbody>
+</table>
+</body>
+</html>
+"""
+
+
+class HtmlDiffReport(object):
+    """
+    The diff of two lists of lines, split into pages of at most page_rows rows
+    """
+
+    def __init__(self, left_lines, right_lines, titles=('', ''), context=default_context,
+                 page_rows=default_page_rows):
+        self.left_lines = left_lines
+        self.right_lines = right_lines
+        self.titles = titles
+        self.matcher = difflib.SequenceMatcher(None, left_lines, right_lines)
+        self.pages = None
+        self.context = context
+        self.page_rows = page_rows
+
+    def match(self):
+        """
+        Matches up the lines of the two files. This is the slow part, and is done when the report is first paged
+        unless it is called beforehand (e.g. from a worker thread).
+        """
+        self.matcher.get_opcodes()  # the matcher keeps these, so they are only worked out once
+        self.set_context(self.context)
+
+    def is_identical(self):
+        return all(tag == 'equal' for tag, _, _, _, _ in self.matcher.get_opcodes())
+
+    def set_context(self, context):
+        """
+        Sets the number of unchanged lines shown either side of each change (None shows every line), and pages the
+        report again
+        """
+        self.context = context
+        if context is None:
+            groups = [self.matcher.get_opcodes()]
+        elif self.is_identical():
+            groups = []
+        else:
+            groups = self.matcher.get_grouped_opcodes(context)
+
+        self.pages = []
+        page = []
+        rows = 0
+        for group in groups:
+            if len(page) > 0:
+                page.append(None)  # marks the lines skipped between groups
+            for tag, i1, i2, j1, j2 in group:
+                # Long runs of lines are split up, so no page is longer than page_rows
+                while i1 < i2 or j1 < j2:
+                    size = min(max(i2 - i1, j2 - j1), self.page_rows - rows)
+                    page.append((tag, i1, min(i1 + size, i2), j1, min(j1 + size, j2)))
+                    i1 = min(i1 + size, i2)
+                    j1 = min(j1 + size, j2)
+                    rows += size
+                    if rows >= self.page_rows:
+                        self.pages.append(page)
+                        page = []
+                        rows = 0
+        if len(page) > 0:
+            self.pages.append(page)
+
+    def page_count(self):
+        if self.pages is None:
+            self.match()
+        return len(self.pages)
+
+    def page_html(self, page_number):
+        """
+        Returns a complete HTML document of a single page of the report
+        """
+        if self.page_count() == 0:
+            return self._header() + '<tr><td colspan="4">No differences found</td></tr>\n' + footer
+        return self._header() + ''.join(self._page_rows(page_number)) + footer
+
+    def write(self, file):
+        """
+        Writes the whole report to a file object, a page at a time
+        """
+        file.write(self._header())
+        for page_number in range(self.page_count()):
+            file.write(''.join(self._page_rows(page_number)))
+        file.write(footer)
+
+    def _header(self):
+        return header.replace('{0}', html.escape(self.titles[0])).replace('{1}', html.escape(self.titles[1]))
+
+    def _page_rows(self, page_number):
+        for piece in self.pages[page_number]:
+            if piece is None:
+                yield '<tr><td class="diff_next" colspan="4">&nbsp;</td></tr>\n'
+                continue
+            tag, i1, i2, j1, j2 = piece
+            for n in range(max(i2 - i1, j2 - j1)):
+                left = i1 + n if i1 + n < i2 else None
+                right = j1 + n if j1 + n < j2 else None
+                yield self._row(tag, left, right)
+
+    def _row(self, tag, left, right):
+        left_line = self.left_lines[left].rstrip('\n') if left is not None else None
+        right_line = self.right_lines[right].rstrip('\n') if right is not None else None
+        if tag == 'equal':
+            left_html, right_html = _escape(left_line), _escape(right_line)
+        elif left_line is not None and right_line is not None:
+            left_html, right_html = _mark_changes(left_line, right_line)
+        else:
+            left_html = '<span class="diff_sub">' + _escape(left_line) + '</span>' if left_line is not None else ''
+            right_html = '<span class="diff_add">' + _escape(right_line) + '</span>' if right_line is not None else ''
+        return '<tr><td class="diff_header">{0}</td><td nowrap="nowrap">{1}</td>' \
+               '<td class="diff_header">{2}</td><td nowrap="nowrap">{3}</td></tr>\n'.format(
+                   left + 1 if left is not None else '', left_html, right + 1 if right is not None else '', right_html)
+
+
+def _escape(line):
+    # Indentation shows the depth of sequence items, so spaces have to be kept
+    return html.escape(line).replace(' ', '&nbsp;')
+
+
+def _mark_changes(left_line, right_line):
+    # Highlights the characters that differ between two versions of a line
+    left_html = []
+    right_html = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, left_line, right_line).get_opcodes():
+        if tag == 'equal':
+            left_html.append(_escape(left_line[i1:i2]))
+            right_html.append(_escape(right_line[j1:j2]))
+        else:
+            if i2 > i1:
+                left_html.append('<span class="diff_chg">' + _escape(left_line[i1:i2]) + '</span>')
+            if j2 > j1:
+                right_html.append('<span class="diff_chg">' + _escape(right_line[j1:j2]) + '</span>')
+    return ''.join(left_html), ''.join(right_html)
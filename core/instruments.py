@@ -0,0 +1,198 @@
+"""
+    Lightweight timers and counters around the hot paths (loading, building the tree, diffing, highlighting,
+    filtering ...), for finding out where the time went when something is slow. Everything is off until enable() is
+    called (e.g. by the --profile option), and costs next to nothing while it is.
+
+    A capture can also be taken with cProfile and tracemalloc, and written out with the timers and counters as a report
+    that can be attached to a bug report.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+import time
+
+
+_enabled = False
+_lock = threading.Lock()
+_timers = OrderedDict()
+# Counters are kept per thread, as they are counted often enough (e.g. for each row created) that threads would
+# otherwise contend for the lock
+_local = threading.local()
+_thread_counters = []
+_profiler = None
+_thread_profilers = []  # profiles of the work done in other threads during a capture
+
+
+def enable(enabled=True):
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled():
+    return _enabled
+
+
+@contextmanager
+def timed(name):
+    """
+    Times the work done inside the with block under name, if instruments are enabled
+    """
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start)
+
+
+def add_time(name, seconds):
+    """
+    Adds a call taking seconds to the timer name, if instruments are enabled (e.g. for something already timed)
+    """
+    if not _enabled:
+        return
+    # Timers are added to from worker threads as well as the GUI thread
+    with _lock:
+        timer = _timers.get(name)
+        if timer is None:
+            _timers[name] = [1, seconds, seconds]
+        else:
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+
+def count(name, n=1):
+    """
+    Adds n to the counter name, if instruments are enabled
+    """
+    if not _enabled:
+        return
+    thread_counters = getattr(_local, 'counters', None)
+    if thread_counters is None:
+        thread_counters = _local.counters = {}
+        with _lock:
+            _thread_counters.append(thread_counters)
+    thread_counters[name] = thread_counters.get(name, 0) + n
+
+
+def timers():
+    """
+    Returns a copy of the timers, as a dictionary of name -> (calls, total seconds, longest seconds)
+    """
+    with _lock:
+        return OrderedDict((name, tuple(timer)) for name, timer in _timers.items())
+
+
+def counters():
+    """
+    Returns the total of each counter over every thread, as a dictionary of name -> count
+    """
+    totals = OrderedDict()
+    with _lock:
+        for thread_counters in _thread_counters:
+            for name, value in thread_counters.copy().items():
+                totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+def reset():
+    with _lock:
+        _timers.clear()
+        for thread_counters in _thread_counters:
+            thread_counters.clear()
+
+
+def report():
+    """
+    Returns the timers and counters as text
+    """
+    lines = ['{0:<36} {1:>8} {2:>10} {3:>10} {4:>10}'.format('Timer', 'calls', 'total s', 'mean ms', 'max ms')]
+    for name, (calls, total, longest) in timers().items():
+        lines.append('{0:<36} {1:>8d} {2:>10.3f} {3:>10.2f} {4:>10.2f}'.format(
+            name, calls, total, 1000.0 * total / calls, 1000.0 * longest))
+    lines.append('')
+    lines.append('{0:<36} {1:>8}'.format('Counter', 'count'))
+    for name, value in counters().items():
+        lines.append('{0:<36} {1:>8d}'.format(name, value))
+    return '\n'.join(lines) + '\n'
+
+
+def is_capturing():
+    return _profiler is not None
+
+
+def start_capture():
+    """
+    Starts profiling every call with cProfile and tracing memory allocations with tracemalloc (which both slow
+    everything down considerably). Instruments are enabled too.
+    """
+    global _profiler
+    if _profiler is not None:
+        return
+    # These are only imported when needed, as this module is imported while the program starts up
+    import cProfile
+    import tracemalloc
+    enable()
+    tracemalloc.start()
+    _profiler = cProfile.Profile()
+    _profiler.enable()
+
+
+@contextmanager
+def profiled_thread():
+    """
+    Profiles the work done inside the with block as part of the capture, if one is being taken. cProfile only sees the
+    thread it was started in, so this is needed around the work of each worker thread.
+    """
+    if _profiler is None:
+        yield
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        with _lock:
+            _thread_profilers.append(profiler)
+
+
+def stop_capture(report_path, top=40):
+    """
+    Stops a capture, writing the timers and counters, the top functions by cumulative time and the top allocations
+    (with the peak memory) to report_path as text. The raw cProfile statistics are written next to it, with .prof
+    added to the name, for viewing in other tools.
+    """
+    global _profiler
+    if _profiler is None:
+        return
+    import io
+    import pstats
+    import tracemalloc
+    _profiler.disable()
+    profiler = _profiler
+    _profiler = None
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    profile_text = io.StringIO()
+    stats = pstats.Stats(profiler, stream=profile_text)
+    with _lock:
+        for thread_profiler in _thread_profilers:
+            stats.add(thread_profiler)
+        del _thread_profilers[:]
+    stats.sort_stats('cumulative').print_stats(top)
+    stats.dump_stats(report_path + '.prof')
+    with open(report_path, 'w') as report_file:
+        report_file.write(report())
+        report_file.write('\nProfile\n\n')
+        report_file.write(profile_text.getvalue())
+        report_file.write('\nMemory: {0:.1f} MB allocated now, {1:.1f} MB at the peak\n\n'.format(
+            current / 1024.0 / 1024.0, peak / 1024.0 / 1024.0))
+        for statistic in snapshot.statistics('lineno')[:top]:
+            report_file.write(str(statistic) + '\n')
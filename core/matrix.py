@@ -0,0 +1,127 @@
+"""
+    Comparing many files (e.g. every instance of a series) with one reference file.
+
+    The reference is compiled into a profile (see core.profile) once, rather than being read and walked again for each
+    file, and the files are diffed against it in a pool of worker processes, each of which only loads the profile once
+    however many files it is given. The results are collected into a matrix with a row for each element (or sequence
+    item) that is different in any of the files, and a column for each file.
+"""
+from collections import namedtuple
+import bisect
+import os
+import tempfile
+
+from core.diff import ADDED
+from core.profile import compile_profile, diff_profile_file
+from core.reader import default_defer_size
+# pydicom is MIT licenced
+import pydicom
+
+MatrixRow = namedtuple('MatrixRow', ['path', 'added'])
+MatrixRow.__doc__ = """
+A row of a DifferenceMatrix. path is the path (as given by core.diff.path_to_list) of an element or sequence item in the
+reference, or in the file it was added to if added is True. Once sequence items are matched by key, the same path can
+be a different row in the reference and in a file, so rows that were added are kept apart from those of the reference.
+Rows compare in the order they appear in the tree, with a row added at a path after the reference's row there.
+"""
+
+
+def diff_against_reference(reference_path, paths, executor, defer_size=default_defer_size, item_keys=None):
+    """
+    Diffs each file against a reference file using executor (e.g. a ProcessPoolExecutor). Yields the result for each
+    file in the same order as paths, in the same form as core.diff.diff_files (with the reference on the left).
+    """
+    handle, profile_path = tempfile.mkstemp(suffix='.profile')
+    os.close(handle)
+    try:
+        compile_profile(reference_path, profile_path, defer_size)
+        # Hand out the files in a few chunks per worker, so the overhead of passing them between processes stays small
+        chunksize = max(1, len(paths) // (8 * (os.cpu_count() or 1)))
+        for result in executor.map(diff_profile_file, [profile_path] * len(paths), paths,
+                                   [defer_size] * len(paths), [item_keys] * len(paths), chunksize=chunksize):
+            result['left'] = reference_path
+            yield result
+    finally:
+        os.remove(profile_path)
+
+
+def path_text(path):
+    """
+    Returns a path as given by core.diff.path_to_list as text, e.g. (300A,0010)[2] (300A,0012)
+    """
+    parts = []
+    for n, key in enumerate(path):
+        if n % 2 == 0:
+            parts.append('({0},{1})'.format(key[:4], key[4:]))
+        else:
+            parts[-1] += '[{0:d}]'.format(key)
+    return ' '.join(parts)
+
+
+def path_description(path):
+    """
+    Returns the description of the row at a path as given by core.diff.path_to_list
+    """
+    tag = int(path[-1] if len(path) % 2 == 1 else path[-2], 16)
+    try:
+        description = pydicom.datadict.dictionary_description(tag)
+    except KeyError:
+        description = 'Private tag data' if tag >> 16 & 1 else ''
+    if len(path) % 2 == 0:
+        return '{0} {1:d}'.format(description.replace(' Sequence', ''), path[-1])
+    return description
+
+
+class DifferenceMatrix(object):
+    """
+    The differences of many files from a reference. Rows are the MatrixRows of every element or sequence item that is
+    different in any file, kept in the order they appear in the tree, and columns are the files.
+    """
+
+    def __init__(self, reference_path):
+        self.reference_path = reference_path
+        self.files = []
+        self.errors = []  # the error reading each file, or None
+        self.rows = []
+        self.reference_values = {}  # the value of each row in the reference, or None if it isn't there
+        self.cells = []  # for each file, a dictionary of the value of each row that is different in it
+
+    def add_result(self, result):
+        """
+        Adds the result of diffing a file against the reference as a new column, returning the positions in rows of the
+        rows that were added, in increasing order, so that a view can be updated
+        """
+        self.files.append(result['right'])
+        self.errors.append(result.get('error'))
+        cells = {}
+        new_rows = []
+        for difference in result.get('differences', []):
+            row = MatrixRow(tuple(difference['path']), difference['kind'] == ADDED)
+            if row not in self.reference_values:
+                self.reference_values[row] = difference['left']
+                new_rows.append(row)
+            cells[row] = difference['right']
+        self.cells.append(cells)
+        # Rows compare in the order they appear in the tree, as tags are fixed width hex and keys alternate. Each
+        # new row goes after the ones before it, so inserting rows into a view at these positions in turn matches up.
+        positions = []
+        for row in sorted(new_rows):
+            position = bisect.bisect(self.rows, row)
+            self.rows.insert(position, row)
+            positions.append(position)
+        return positions
+
+    def value(self, row, column):
+        """
+        Returns the value of a row in a file, and whether it is different from the reference
+        """
+        cells = self.cells[column]
+        if row in cells:
+            return cells[row], True
+        return self.reference_values[row], False
+
+    def different_count(self, row):
+        """
+        The number of files in which a row is different from the reference
+        """
+        return sum(1 for cells in self.cells if row in cells)
@@ -0,0 +1,259 @@
+"""
+    Baseline profiles: a reference ("golden") file compiled once into a small SQLite database, so that many files can
+    be compared against it without reading or rendering the reference again.
+
+    A profile holds a row for each element and sequence item of the reference, in the order they appear in the tree,
+    with a digest of its value, the value as displayed and a hash of everything below it. The file being compared is
+    hashed the same way, and only subtrees whose hashes differ are walked to find the differences, which are the same
+    DiffRecords diff_datasets() would give for the reference file itself.
+"""
+from collections import namedtuple
+import os
+import sqlite3
+
+from core.diff import DiffRecord, ADDED, REMOVED, CHANGED, element_strings, item_strings, record_to_dict, \
+    align_items, default_item_keys, is_truncated
+from core.hashing import hash_dataset
+from core.reader import read_dataset, default_defer_size
+# pydicom is MIT licenced
+import pydicom
+
+PROFILE_VERSION = 3
+
+ProfileRow = namedtuple('ProfileRow', ['parent', 'key', 'is_element', 'VR', 'digest', 'text', 'truncated',
+                                       'item_count', 'hash'])
+
+
+def compile_profile(reference_path, profile_path, defer_size=default_defer_size):
+    """
+    Compiles a reference file into a profile, replacing any profile already at profile_path
+    """
+    hashed = hash_dataset(read_dataset(reference_path, defer_size=defer_size))
+    rows = [(0, -1, 0, 0, None, None, None, 0, 0, hashed.hash)]
+    _add_rows(hashed, 0, rows)
+
+    if os.path.exists(profile_path):
+        os.remove(profile_path)
+    connection = sqlite3.connect(profile_path)
+    try:
+        connection.execute('CREATE TABLE profile (name TEXT PRIMARY KEY, value TEXT)')
+        connection.execute('CREATE TABLE rows (row INTEGER PRIMARY KEY, parent INTEGER, key INTEGER, '
+                           'is_element INTEGER, vr TEXT, digest BLOB, text TEXT, truncated INTEGER, '
+                           'item_count INTEGER, hash BLOB)')
+        stat = os.stat(reference_path)
+        connection.executemany('INSERT INTO profile VALUES (?, ?)', [
+            ('version', str(PROFILE_VERSION)), ('pydicom', pydicom.__version__),
+            ('source', os.path.abspath(reference_path)), ('size', str(stat.st_size)),
+            ('mtime', str(stat.st_mtime_ns))])
+        connection.executemany('INSERT INTO rows VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def _add_rows(hashed, parent, rows):
+    # Rows are added in the order they appear in the tree, and the children of each row are contiguous
+    start = len(rows)
+    for hashed_element in hashed.elements:
+        data_element = hashed_element.data_element
+        rows.append([len(rows), parent, int(data_element.tag), 1, data_element.VR, hashed_element.digest,
+                     element_strings(data_element)[2], int(is_truncated(data_element)),
+                     len(hashed_element.items), hashed_element.hash])
+    for row, hashed_element in zip(range(start, len(rows)), hashed.elements):
+        for item_number, item in enumerate(hashed_element.items):
+            item_row = len(rows)
+            rows.append([item_row, row, item_number, 0, None, None,
+                         item_strings(hashed_element.data_element, item_number)[1], 0, 0, item.hash])
+            _add_rows(item, item_row, rows)
+
+
+class Profile(object):
+    """
+    A compiled reference file, read back from disk
+    """
+
+    def __init__(self, profile_path):
+        self.path = profile_path
+        connection = sqlite3.connect(profile_path)
+        try:
+            self.info = dict(connection.execute('SELECT name, value FROM profile'))
+            if self.info.get('version') != str(PROFILE_VERSION) or self.info.get('pydicom') != pydicom.__version__:
+                # Values are hashed as pydicom reads them, so a different version could hash them differently
+                raise ValueError('{0} was compiled by a different version, and needs compiling again'.format(
+                    profile_path))
+            self.rows = [ProfileRow(*values[1:]) for values in
+                         connection.execute('SELECT * FROM rows ORDER BY row')]
+        finally:
+            connection.close()
+        self.children = [[] for _ in self.rows]
+        for row, profile_row in enumerate(self.rows):
+            if profile_row.parent >= 0:
+                self.children[profile_row.parent].append(row)
+
+    @property
+    def source(self):
+        return self.info['source']
+
+    def is_stale(self):
+        """
+        Returns True if the reference file has changed (or gone) since the profile was compiled
+        """
+        try:
+            stat = os.stat(self.source)
+        except OSError:
+            return True
+        return str(stat.st_size) != self.info['size'] or str(stat.st_mtime_ns) != self.info['mtime']
+
+
+_loaded_profiles = {}
+
+
+def load_profile(profile_path):
+    """
+    Returns the Profile at a path, only reading it once per process (unless the file changes)
+    """
+    stat = os.stat(profile_path)
+    key = (os.path.abspath(profile_path), stat.st_size, stat.st_mtime_ns)
+    if key not in _loaded_profiles:
+        _loaded_profiles.clear()
+        _loaded_profiles[key] = Profile(profile_path)
+    return _loaded_profiles[key]
+
+
+def diff_profile(profile, dataset, progress=None, item_keys=None):
+    """
+    Compares the reference of a profile (on the left) with a dataset (on the right), returning the same list of
+    DiffRecords as diff_datasets() would. Subtrees with the same hash on both sides are skipped without being walked.
+    """
+    records = []
+    _diff_dataset(profile, 0, hash_dataset(dataset), ((), ()), records, progress,
+                  default_item_keys if item_keys is None else item_keys)
+    return records
+
+
+def diff_profile_file(profile_path, right_path, defer_size=default_defer_size, item_keys=None):
+    """
+    Diffs a file against a profile, returning the result as a dictionary in the same form as core.diff.diff_files
+    """
+    result = {'left': profile_path, 'right': right_path}
+    try:
+        records = diff_profile(load_profile(profile_path), read_dataset(right_path, defer_size=defer_size),
+                               item_keys=item_keys)
+    except Exception as e:
+        result['error'] = '{0}: {1}'.format(type(e).__name__, e)
+        return result
+    result['identical'] = len(records) == 0
+    result['differences'] = [record_to_dict(record) for record in records]
+    return result
+
+
+def _diff_dataset(profile, row, hashed, paths, records, progress, item_keys):
+    if profile.rows[row].hash == hashed.hash:
+        return
+    if progress is not None:
+        progress.check()
+        progress.update(len(records))
+    left_path, right_path = paths
+    left_rows = profile.children[row]
+    right_elements = hashed.elements
+    i = 0
+    j = 0
+    while i < len(left_rows) and j < len(right_elements):
+        left = profile.rows[left_rows[i]]
+        right_tag = int(right_elements[j].data_element.tag)
+        if left.key == right_tag:
+            _diff_element(profile, left_rows[i], right_elements[j],
+                          (left_path + (left.key,), right_path + (right_tag,)), records, progress, item_keys)
+            i += 1
+            j += 1
+        elif left.key < right_tag:
+            records.append(DiffRecord(REMOVED, left_path + (left.key,), left.text, None))
+            i += 1
+        else:
+            records.append(DiffRecord(ADDED, right_path + (right_tag,), None,
+                                      element_strings(right_elements[j].data_element)[2]))
+            j += 1
+    for left_row in left_rows[i:]:
+        left = profile.rows[left_row]
+        records.append(DiffRecord(REMOVED, left_path + (left.key,), left.text, None))
+    for hashed_element in right_elements[j:]:
+        data_element = hashed_element.data_element
+        records.append(DiffRecord(ADDED, right_path + (int(data_element.tag),), None,
+                                  element_strings(data_element)[2]))
+
+
+def _diff_element(profile, row, right, paths, records, progress, item_keys):
+    left = profile.rows[row]
+    if left.hash == right.hash:
+        return
+    left_path, right_path = paths
+    right_element = right.data_element
+    if left.VR == 'SQ' and right_element.VR == 'SQ':
+        identical = left.item_count == len(right.items)
+    else:
+        identical = left.digest == right.digest
+    if not identical:
+        right_text = element_strings(right_element)[2]
+        # Values shown truncated can look the same even though they differ
+        if left.text != right_text or left.truncated or is_truncated(right_element):
+            records.append(DiffRecord(CHANGED, left_path, left.text, right_text,
+                                      right_path if right_path != left_path else None))
+
+    left_items = profile.children[row] if left.VR == 'SQ' else []
+    keys = item_keys.get(left.key, ())
+    if len(keys) > 0 and len(left_items) > 0 and len(right.items) > 0:
+        pairs = align_items([_profile_item_key(profile, item_row, keys) for item_row in left_items],
+                            [_hashed_item_key(item, keys) for item in right.items])
+    else:
+        pairs = align_items([None] * len(left_items), [None] * len(right.items))
+    for left_item_number, right_item_number in pairs:
+        if right_item_number is None:
+            records.append(DiffRecord(REMOVED, left_path + (left_item_number,),
+                                      profile.rows[left_items[left_item_number]].text, None))
+        elif left_item_number is None:
+            records.append(DiffRecord(ADDED, right_path + (right_item_number,), None,
+                                      item_strings(right_element, right_item_number)[1]))
+        else:
+            _diff_dataset(profile, left_items[left_item_number], right.items[right_item_number],
+                          (left_path + (left_item_number,), right_path + (right_item_number,)), records, progress,
+                          item_keys)
+
+
+def _profile_item_key(profile, item_row, keys):
+    # The same as core.diff.item_key, from the digests kept in the profile
+    key = []
+    for key_tags in keys:
+        row = item_row
+        for n, tag in enumerate(key_tags):
+            row = next((child for child in profile.children[row] if profile.rows[child].key == tag), None)
+            if row is None or (n < len(key_tags) - 1) != (profile.rows[row].VR == 'SQ'):
+                row = None
+                break
+            if n < len(key_tags) - 1:
+                if len(profile.children[row]) == 0:
+                    row = None
+                    break
+                row = profile.children[row][0]
+        key.append(profile.rows[row].digest if row is not None else None)
+    return tuple(key) if any(digest is not None for digest in key) else None
+
+
+def _hashed_item_key(hashed, keys):
+    # The same as core.diff.item_key, from the digests of a hashed item
+    key = []
+    for key_tags in keys:
+        item = hashed
+        digest = None
+        for n, tag in enumerate(key_tags):
+            hashed_element = next((element for element in item.elements if int(element.data_element.tag) == tag),
+                                  None)
+            if hashed_element is None or (n < len(key_tags) - 1) != (hashed_element.data_element.VR == 'SQ'):
+                break
+            if n < len(key_tags) - 1:
+                if len(hashed_element.items) == 0:
+                    break
+                item = hashed_element.items[0]
+            else:
+                digest = hashed_element.digest
+        key.append(digest)
+    return tuple(key) if any(digest is not None for digest in key) else None
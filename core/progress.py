@@ -0,0 +1,88 @@
+"""
+    Progress reporting, timing and cancellation for long running work, independent of any GUI code.
+"""
+from contextlib import contextmanager
+from collections import namedtuple
+import logging
+import time
+
+from core import instruments
+
+logger = logging.getLogger(__name__)
+
+StageTiming = namedtuple('StageTiming', ['name', 'seconds', 'count'])
+
+
+class Cancelled(Exception):
+    """
+    Raised from Progress.check() once the work has been cancelled
+    """
+    pass
+
+
+class Progress(object):
+    """
+    Keeps track of the progress through a series of stages. Updates are passed on to callback(stage, done, total) at
+    most max_rate times a second, so reporting progress is cheap however often it is done. The work is expected to
+    call check() regularly, which raises Cancelled if cancel() has been called (from any thread).
+    """
+
+    def __init__(self, callback=None, max_rate=30):
+        self.callback = callback
+        self.min_interval = 1.0 / max_rate
+        self.timings = []
+        self.stage_name = None
+        self.total = 0
+        self.done = 0
+        self._cancelled = False
+        self._last_report = 0.0
+
+    @contextmanager
+    def stage(self, name, total=0):
+        """
+        Times the work done inside the with block as a stage. The number of items processed is taken from the last
+        call to update(), or total if it was never called.
+        """
+        self.check()
+        self.stage_name = name
+        self.total = total
+        self.done = 0
+        self._report(force=True)
+        start = time.perf_counter()
+        yield self
+        seconds = time.perf_counter() - start
+        timing = StageTiming(name, seconds, self.done or total)
+        self.timings.append(timing)
+        instruments.add_time(name, seconds)
+        logger.info('%s took %.3f s (%d items)', timing.name, timing.seconds, timing.count)
+
+    def update(self, done, total=None):
+        if total is not None:
+            self.total = total
+        self.done = done
+        self._report()
+
+    def _report(self, force=False):
+        if self.callback is None:
+            return
+        now = time.perf_counter()
+        if force or now - self._last_report >= self.min_interval or self.done == self.total:
+            self._last_report = now
+            self.callback(self.stage_name, self.done, self.total)
+
+    def cancel(self):
+        self._cancelled = True
+
+    def is_cancelled(self):
+        return self._cancelled
+
+    def check(self):
+        if self._cancelled:
+            raise Cancelled()
+
+
+def format_timings(timings):
+    """
+    Returns a human readable summary of a list of StageTimings, one stage per line
+    """
+    return '\n'.join('{0}: {1:.3f} s ({2:d} items)'.format(*timing) for timing in timings)
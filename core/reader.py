@@ -0,0 +1,183 @@
+"""
+    Reading DICOM files, optionally leaving large values (pixel data, waveforms, overlays ...) in the file until they
+    are actually needed.
+
+    pydicom reads a deferred value in full as soon as the element is accessed, which includes just iterating over the
+    dataset. dataset_elements() is used instead wherever we iterate, and yields a DeferredElement placeholder for these
+    values. Its bytes can then be streamed in chunks from a memory map of the file, without ever holding them all.
+
+    Large values that were read (e.g. a LUT, or a long list of DS values) get the same placeholder, so they are left as
+    the raw bytes pydicom read rather than being converted and formatted. They are shown truncated, with their length,
+    and compared by a digest of their bytes; the whole value is only converted when it is asked for.
+"""
+import hashlib
+import mmap
+# pydicom is MIT licenced
+import pydicom
+
+default_defer_size = 1024 * 1024  # values larger than this many bytes are left in the file by default
+default_chunk_size = 1024 * 1024
+large_value_size = 4096  # values read into memory that are larger than this many bytes are left as raw bytes
+preview_length = 64  # characters shown of a large text value
+# Values with these VRs are text, which can be written differently (e.g. with different padding) and still be equal,
+# so their raw bytes being different doesn't mean their values are
+text_vrs = ('AE', 'AS', 'CS', 'DA', 'DS', 'DT', 'IS', 'LO', 'LT', 'PN', 'SH', 'ST', 'TM', 'UC', 'UI', 'UR', 'UT')
+
+
+def read_dataset(filepath, defer_size=None, stop_before_pixels=False):
+    """
+    Reads a DICOM file. Values longer than defer_size bytes are left in the file, and if stop_before_pixels is True
+    the pixel data (and anything after it) isn't read at all.
+    """
+    return pydicom.read_file(filepath, defer_size=defer_size, stop_before_pixels=stop_before_pixels)
+
+
+def dataset_elements(dataset):
+    """
+    Yields the elements of a dataset in tag order, like iterating over it, except that values which were deferred when
+    the file was read (or are large, and haven't been converted yet) are left as they are, and a DeferredElement is
+    yielded in their place
+    """
+    # pydicom 1.0 and later keep the elements in _dict, older versions are a dict themselves
+    elements = getattr(dataset, '_dict', dataset)
+    for tag in sorted(elements.keys()):
+        raw_data_element = dict.get(elements, tag)
+        # Deferred elements are the only raw (tuple) elements with a length but no value
+        if isinstance(raw_data_element, tuple) and (
+                (raw_data_element.value is None and raw_data_element.length > 0) or
+                (raw_data_element.value is not None and len(raw_data_element.value) > large_value_size)):
+            deferred_element = _deferred_element(dataset, tag, raw_data_element)
+            # The contents of sequences are needed to show the tree, so there is no point keeping them in the file
+            if deferred_element.VR != 'SQ':
+                yield deferred_element
+                continue
+        yield dataset[tag]
+
+
+def _deferred_element(dataset, tag, raw_data_element):
+    # The placeholders are kept with the dataset, so the digest of each value is only worked out once however many
+    # times the dataset is walked (e.g. by hashing, and then each diff). One is made again if its element has been
+    # replaced, e.g. by the value being read in.
+    deferred_elements = dataset.__dict__.get('_deferred_elements')
+    if deferred_elements is None:
+        deferred_elements = dataset.__dict__['_deferred_elements'] = {}
+    deferred_element = deferred_elements.get(tag)
+    if deferred_element is None or deferred_element._raw_data_element is not raw_data_element:
+        deferred_element = deferred_elements[tag] = DeferredElement(raw_data_element, dataset)
+    return deferred_element
+
+
+def elements_equal(left, right):
+    """
+    Compares the values of two elements where at least one is a DeferredElement. Where possible this compares digests
+    of their raw bytes, streamed in chunks, rather than converting the values.
+    """
+    if isinstance(left, DeferredElement) and isinstance(right, DeferredElement) and \
+            left.is_little_endian == right.is_little_endian:
+        if left.VR != right.VR:
+            return False
+        if left.length == right.length and left.digest() == right.digest():
+            return True
+        if left.VR not in text_vrs:
+            return False
+    if isinstance(left, DeferredElement):
+        left = left.read()
+    if isinstance(right, DeferredElement):
+        right = right.read()
+    return left.VR == right.VR and left.value == right.value
+
+
+class DeferredElement(object):
+    """
+    Stands in for an element whose value was left in the file when it was read, or is large and still raw bytes
+    """
+
+    def __init__(self, raw_data_element, dataset):
+        self.tag = pydicom.tag.Tag(raw_data_element.tag)
+        self.VR = raw_data_element.VR
+        if self.VR is None:
+            # Files with implicit VRs don't store them, so fall back to the dictionary like pydicom does
+            try:
+                self.VR = pydicom.datadict.dictionary_VR(self.tag)
+            except KeyError:
+                self.VR = 'UN'
+        self.in_file = raw_data_element.value is None
+        # Values of undefined length (e.g. encapsulated pixel data) are only deferred once they have been read
+        self.length = raw_data_element.length if self.in_file else len(raw_data_element.value)
+        self.is_little_endian = raw_data_element.is_little_endian
+        self.value = None
+        self.filename = getattr(dataset, 'filename', None)
+        self.encoding = getattr(dataset, '_character_set', None)
+        self._raw_data_element = raw_data_element
+        self._digest = None
+
+    def description(self):
+        try:
+            return pydicom.datadict.dictionary_description(self.tag)
+        except KeyError:
+            return 'Private tag data' if self.tag.is_private else ''
+
+    @property
+    def name(self):
+        return self.description()
+
+    @property
+    def repval(self):
+        """
+        The value as it is displayed: a placeholder with its length, and the start of it if it is text
+        """
+        if self.in_file:
+            return '<deferred, {0:d} bytes>'.format(self.length)
+        if self.VR in text_vrs:
+            preview = bytes(self._raw_data_element.value[:preview_length]).decode('latin-1')
+            # Line breaks in long text (e.g. an LT) would break up the line in the text diff
+            preview = ''.join(character if character.isprintable() else ' ' for character in preview)
+            return "'{0}...' <{1:d} bytes>".format(preview, self.length)
+        return '<{0:d} bytes>'.format(self.length)
+
+    def __str__(self):
+        return '{0} {1:<35} {2}: {3}'.format(str(self.tag), self.description(), self.VR, self.repval)
+
+    def iter_chunks(self, chunk_size=default_chunk_size):
+        """
+        Yields the raw bytes of the value, chunk_size bytes at a time
+        """
+        if not self.in_file:
+            value = memoryview(self._raw_data_element.value)
+            for offset in range(0, self.length, chunk_size):
+                yield value[offset:offset + chunk_size]
+            return
+        start = self._raw_data_element.value_tell
+        end = start + self.length
+        with open(self.filename, 'rb') as file:
+            mapped_file = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for offset in range(start, end, chunk_size):
+                    yield mapped_file[offset:min(offset + chunk_size, end)]
+            finally:
+                mapped_file.close()
+
+    def has_digest(self):
+        return self._digest is not None
+
+    def digest(self):
+        """
+        Returns a BLAKE2 digest of the raw bytes of the value, which is only worked out once
+        """
+        if self._digest is None:
+            digest = hashlib.blake2b(digest_size=16)
+            for chunk in self.iter_chunks():
+                digest.update(chunk)
+            self._digest = digest.digest()
+        return self._digest
+
+    def read(self):
+        """
+        Reads the whole value (from the file if it was left there), and returns it as a normal pydicom data element
+        """
+        raw_data_element = self._raw_data_element
+        if self.in_file:
+            raw_data_element = raw_data_element._replace(value=b''.join(self.iter_chunks()))
+        if self.encoding is not None:
+            return pydicom.dataelem.DataElement_from_raw(raw_data_element, self.encoding)
+        return pydicom.dataelem.DataElement_from_raw(raw_data_element)
@@ -0,0 +1,161 @@
+"""
+    Searching the elements of a dataset by tag, keyword, description or value.
+
+    A SearchIndex maps every word (run of letters and digits) found in the rows of a DatasetTable to the rows it was
+    found in, so a query only has to look at the rows containing its words. Queries can be:
+        words, e.g. patient name                      rows containing all of the words, in any column
+        tags, e.g. (0018,0050), (0018,*), (*,0010)    rows whose tag matches, with * or x as wildcards
+        wildcards, e.g. *UID* or Patient*             rows whose keyword, description or value matches as a whole
+        regular expressions, e.g. /^(sop|series)/     rows where the expression is found in any column
+    Matching ignores case.
+"""
+from array import array
+import fnmatch
+import re
+
+from core import instruments
+from core.diff import path_to_list
+from core.reader import read_dataset, default_defer_size
+from core.table import DatasetTable
+# pydicom is MIT licenced
+import pydicom
+
+tag_query_regex = re.compile(r'^\(?\s*([0-9a-fx*]{1,4})\s*,\s*([0-9a-fx*]{1,4})\s*\)?$', re.IGNORECASE)
+word_regex = re.compile(r'[0-9a-z]+')
+
+
+class SearchIndex(object):
+    def __init__(self, table):
+        table.expand_all()
+        self.table = table
+        self.postings = {}  # word -> rows containing it, in row order
+        self.tag_rows = {}  # tag -> element rows with that tag
+        self.keywords = [''] * len(table)
+        self._word_rows = {}  # part of a word -> rows with a word containing it, for the parts searched for so far
+        self.order = array('l', [0]) * len(table)  # position of each row in the tree, for sorting results
+        self._number_rows()
+        for row in range(1, len(table)):
+            tag_string, desc, value = table.lower_strings(row)
+            words = set(word_regex.findall(tag_string))
+            words.update(word_regex.findall(desc))
+            words.update(word_regex.findall(value))
+            if table.is_element[row]:
+                tag = table.key[row]
+                self.keywords[row] = _keyword(tag).lower()
+                if self.keywords[row] != '':
+                    words.add(self.keywords[row])
+                words.add('{0:08x}'.format(tag))
+                self.tag_rows.setdefault(tag, []).append(row)
+            for word in words:
+                self.postings.setdefault(word, []).append(row)
+
+    def _number_rows(self):
+        table = self.table
+        position = 0
+        stack = [0]
+        while len(stack) > 0:
+            row = stack.pop()
+            self.order[row] = position
+            position += 1
+            count = table.child_count(row)
+            if count > 0:
+                start = table.child(row, 0)
+                stack.extend(range(start + count - 1, start - 1, -1))
+
+    def search(self, query):
+        """
+        Returns the rows matching a query, in the order they appear in the tree
+        """
+        instruments.count('searches')
+        with instruments.timed('search'):
+            return self._search(query.strip())
+
+    def _search(self, query):
+        if query == '':
+            return []
+        tag_match = tag_query_regex.match(query)
+        if tag_match is not None:
+            rows = self._search_tags(*tag_match.groups())
+        elif len(query) > 1 and query.startswith('/') and query.endswith('/'):
+            regex = re.compile(query[1:-1], re.IGNORECASE)
+            rows = [row for row in range(1, len(self.table))
+                    if any(regex.search(text) for text in self._texts(row))]
+        elif '*' in query or '?' in query:
+            regex = re.compile(fnmatch.translate(query.lower()))
+            rows = [row for row in self._candidates(re.split(r'[*?]', query.lower()))
+                    if any(regex.match(text) for text in self._texts(row))]
+        else:
+            words = query.lower().split()
+            rows = [row for row in self._candidates(words)
+                    if all(any(word in text for text in self._texts(row)) for word in words)]
+        return sorted(rows, key=self.order.__getitem__)
+
+    def _texts(self, row):
+        # The value is matched both as displayed and without the VR and quotes around it
+        tag_string, desc, value = self.table.lower_strings(row)
+        return self.keywords[row], tag_string, desc, value, value.split(': ', 1)[-1].strip('\'"')
+
+    def _candidates(self, parts):
+        """
+        Returns the rows that could contain all of the parts of a query, i.e. those with a word containing each of
+        the words in the parts
+        """
+        candidates = None
+        for part in parts:
+            for word in word_regex.findall(part):
+                rows = self._rows_with_word_containing(word)
+                candidates = rows if candidates is None else candidates & rows
+        return sorted(candidates) if candidates is not None else range(1, len(self.table))
+
+    def _rows_with_word_containing(self, part):
+        rows = self._word_rows.get(part, None)
+        if rows is None:
+            # There are far fewer distinct words than rows, so it is quick to look through them all
+            rows = set()
+            for word, word_rows in self.postings.items():
+                if part in word:
+                    rows.update(word_rows)
+            self._word_rows[part] = rows
+        return rows
+
+    def _search_tags(self, group, element):
+        group_regex = _hex_regex(group)
+        element_regex = _hex_regex(element)
+        rows = []
+        for tag, tag_rows in self.tag_rows.items():
+            if group_regex.match('{0:04x}'.format(tag >> 16)) and element_regex.match('{0:04x}'.format(tag & 0xffff)):
+                rows.extend(tag_rows)
+        return rows
+
+
+def _keyword(tag):
+    try:
+        return pydicom.datadict.keyword_for_tag(tag)
+    except KeyError:
+        return ''
+
+
+def _hex_regex(pattern):
+    # e.g. 0018 matches just 0018, 00x8 any single digit in place of the x, and * anything at all
+    pattern = pattern.lower()
+    if '*' not in pattern and 'x' not in pattern:
+        pattern = pattern.zfill(4)
+    return re.compile(re.escape(pattern).replace(r'\*', '.*').replace('x', '.') + r'\Z')
+
+
+def search_file(filepath, query, defer_size=default_defer_size):
+    """
+    Searches a file, and returns the matching elements as a dictionary that can be written out as JSON. Any problem
+    reading the file is returned as an error rather than raised, so one bad file doesn't stop the rest of a batch.
+    """
+    result = {'file': filepath}
+    try:
+        table = DatasetTable(read_dataset(filepath, defer_size=defer_size))
+        index = SearchIndex(table)
+        rows = index.search(query)
+    except Exception as e:
+        result['error'] = '{0}: {1}'.format(type(e).__name__, e)
+        return result
+    result['matches'] = [dict(zip(('tag', 'description', 'value'), table.strings(row)),
+                              path=path_to_list(table.path_for_row(row))) for row in rows]
+    return result
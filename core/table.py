@@ -0,0 +1,277 @@
+"""
+    Column-wise storage of the rows of a pydicom dataset, as displayed in the tree.
+
+    Each row (an element or a sequence item) is a number, and everything known about it lives at that position in a
+    handful of flat arrays. Rows are only created when something asks for the children of their parent, so opening a
+    file costs about the same however deep its sequences go. Row 0 is the dataset itself, which is never displayed.
+"""
+from array import array
+from collections import namedtuple
+import threading
+
+from core import instruments
+from core.diff import element_strings, item_strings, is_truncated
+from core.reader import dataset_elements, DeferredElement
+
+# Diff states of a row
+SAME = 0
+DIRECT = 1  # the row itself is different
+INDIRECT = 2  # something below the row is different
+DIRECT_SUBTREE = 3  # the row and everything below it is different (the row only exists in one of the files)
+
+# Sets of row numbers to be given each diff state
+Highlights = namedtuple('Highlights', ['direct', 'subtree', 'indirect'])
+
+
+class DatasetTable(object):
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.parent = array('l')  # row number of the parent of each row
+        self.row_in_parent = array('l')  # position of each row amongst the children of its parent
+        self.key = array('q')  # tag of element rows, or item number of sequence item rows
+        self.is_element = bytearray()  # 1 for element rows, 0 for sequence item rows (and the root)
+        self.child_start = array('l')  # row number of the first child, or -1 if the children haven't been created yet
+        self.state = bytearray()  # diff state of each row, one of the constants above
+        # The state of a row is only current if it was set in the current generation, and is SAME otherwise, so
+        # clearing every row is just a matter of starting a new generation
+        self.state_generation = array('q')
+        self.generation = 0
+        self.source = []  # the pydicom data element or dataset each row was created from
+        self._strings = []  # the (tag, description, value) displayed for each row, filled in when first needed
+        self._lower_strings = []  # the same in lower case, for filtering
+        self._expand_lock = threading.Lock()
+        self._append_row(-1, 0, 0, False, dataset)
+
+    def __len__(self):
+        """
+        The number of rows created so far (including the root)
+        """
+        return len(self.source)
+
+    def _append_row(self, parent, row_in_parent, key, is_element, source):
+        self.parent.append(parent)
+        self.row_in_parent.append(row_in_parent)
+        self.key.append(key)
+        self.is_element.append(is_element)
+        self.child_start.append(-1)
+        self.state.append(DIRECT_SUBTREE if parent >= 0 and self.diff_state(parent) == DIRECT_SUBTREE else SAME)
+        self.state_generation.append(self.generation)
+        self._strings.append(None)
+        self._lower_strings.append(None)
+        # source is the length of the table, so it goes last, for anything looking at the table from another thread
+        self.source.append(source)
+
+    def copy(self):
+        """
+        Returns a table of the same rows with no diff state, sharing the dataset (and the strings worked out so far)
+        """
+        with self._expand_lock:
+            table = DatasetTable.__new__(DatasetTable)
+            table.dataset = self.dataset
+            table.parent = array('l', self.parent)
+            table.row_in_parent = array('l', self.row_in_parent)
+            table.key = array('q', self.key)
+            table.is_element = bytearray(self.is_element)
+            table.child_start = array('l', self.child_start)
+            table.state = bytearray(len(self.state))
+            table.state_generation = array('q', bytes(8 * len(self.state)))
+            table.generation = 0
+            table.source = list(self.source)
+            table._strings = list(self._strings)
+            table._lower_strings = list(self._lower_strings)
+            table._expand_lock = threading.Lock()
+        return table
+
+    def child_count(self, row):
+        source = self.source[row]
+        if self.is_element[row]:
+            return len(source.value) if source.VR == 'SQ' else 0
+        return len(source)
+
+    def child(self, row, n):
+        """
+        Returns the row number of the n'th child of row, creating the children of row if needed
+        """
+        if self.child_start[row] == -1:
+            self._expand(row)
+        return self.child_start[row] + n
+
+    def _expand(self, row):
+        # Rows can be asked for by both the GUI and a diff running in the background
+        with self._expand_lock:
+            if self.child_start[row] != -1:
+                return
+            start = len(self.source)
+            source = self.source[row]
+            if self.is_element[row]:
+                for n, dataset in enumerate(source.value):
+                    self._append_row(row, n, n, False, dataset)
+            else:
+                for n, data_element in enumerate(dataset_elements(source)):
+                    self._append_row(row, n, int(data_element.tag), True, data_element)
+            self.child_start[row] = start
+            instruments.count('rows created', len(self.source) - start)
+
+    def strings(self, row):
+        """
+        Returns the tag, description and value displayed for a row
+        """
+        strings = self._strings[row]
+        if strings is None:
+            if self.is_element[row]:
+                strings = element_strings(self.source[row])
+            else:
+                sq_item_description, item_text = item_strings(self.source[self.parent[row]], self.key[row])
+                strings = ('', sq_item_description, item_text)
+            self._strings[row] = strings
+        return strings
+
+    def lower_strings(self, row):
+        strings = self._lower_strings[row]
+        if strings is None:
+            strings = tuple(string.lower() for string in self.strings(row))
+            self._lower_strings[row] = strings
+        return strings
+
+    def expand_all(self):
+        """
+        Creates every row of the table
+        """
+        # Children are always created after their parent, so one pass in row order reaches every row
+        row = 0
+        while row < len(self.source):
+            if self.child_start[row] == -1 and self.child_count(row) > 0:
+                self._expand(row)
+            row += 1
+
+    def filter_rows(self, tag_filter, desc_filter, value_filter, only_different, candidates=None):
+        """
+        Works out which rows match every filter (given in lower case), and which rows need to be shown: those that
+        match, and every parent of them. Returns the list of matching rows, and a bytearray with a 1 for each row to be
+        shown. If candidates is given, only those rows are tested (e.g. the rows that matched a shorter filter).
+        """
+        with instruments.timed('filter rows'):
+            self.expand_all()
+            if candidates is None:
+                candidates = range(1, len(self.source))
+            matches = []
+            for row in candidates:
+                if only_different and self.diff_state(row) == SAME:
+                    continue
+                tag, desc, value = self.lower_strings(row)
+                if tag_filter in tag and desc_filter in desc and value_filter in value:
+                    matches.append(row)
+            visible = bytearray(len(self.source))
+            for row in matches:
+                # Any parent already shown has had its own parents shown, so each row is only visited once
+                while row > 0 and not visible[row]:
+                    visible[row] = 1
+                    row = self.parent[row]
+        instruments.count('rows filtered', len(candidates))
+        return matches, visible
+
+    def is_deferred(self, row):
+        return isinstance(self.source[row], DeferredElement)
+
+    def is_truncated(self, row):
+        """
+        Returns True if only part of the value of a row is displayed (see core.diff.value_lines for the whole)
+        """
+        return bool(self.is_element[row]) and is_truncated(self.source[row])
+
+    def load_deferred(self, row):
+        """
+        Reads the value of a deferred element row from its file (or converts a large one), so that it can be displayed
+        in full
+        """
+        data_element = self.source[row].read()
+        self.source[self.parent[row]][data_element.tag] = data_element
+        self.source[row] = data_element
+        self._strings[row] = None
+        self._lower_strings[row] = None
+
+    def row_for_path(self, path):
+        """
+        Returns the row number identified by a path (see core.diff)
+        """
+        row = 0
+        for key in path:
+            count = self.child_count(row)
+            if count == 0:
+                raise KeyError(path)
+            if not self.is_element[row]:
+                # Elements are sorted by tag, so the one we want can be found with a binary search
+                low = self.child(row, 0)
+                high = low + count
+                while low < high:
+                    middle = (low + high) // 2
+                    if self.key[middle] < key:
+                        low = middle + 1
+                    else:
+                        high = middle
+                if low == self.child_start[row] + count or self.key[low] != key:
+                    raise KeyError(path)
+                row = low
+            else:
+                if key >= count:
+                    raise KeyError(path)
+                row = self.child(row, key)
+        return row
+
+    def path_for_row(self, row):
+        """
+        Returns the path identifying a row (see core.diff)
+        """
+        path = []
+        while row > 0:
+            path.append(self.key[row])
+            row = self.parent[row]
+        return tuple(reversed(path))
+
+    def highlights(self, direct_paths, subtree_paths):
+        """
+        Works out the rows to highlight given the paths of rows that are different, and the paths of rows that are
+        different along with everything below them. Every parent of these rows is indirectly different.
+        """
+        direct = set(self.row_for_path(path) for path in direct_paths)
+        subtree = set(self.row_for_path(path) for path in subtree_paths)
+        indirect = set()
+        for row in direct | subtree:
+            # Any parent already in the set has had its own parents added, so we can stop as soon as we find one,
+            # which keeps the total work linear in the size of the tree
+            parent = self.parent[row]
+            while parent > 0 and parent not in indirect:
+                indirect.add(parent)
+                parent = self.parent[parent]
+        return Highlights(direct, subtree, indirect)
+
+    def apply_highlights(self, highlights):
+        """
+        Replaces the diff state of every row with the given Highlights
+        """
+        with instruments.timed('apply highlights'):
+            self.generation += 1
+            for row in highlights.indirect:
+                self._set_diff_state(row, INDIRECT)
+            for row in highlights.direct:
+                self._set_diff_state(row, DIRECT)
+            for row in highlights.subtree:
+                self._mark_subtree(row)
+
+    def _mark_subtree(self, row):
+        # Children that haven't been created yet will pick up the state from their parent when they are
+        self._set_diff_state(row, DIRECT_SUBTREE)
+        start = self.child_start[row]
+        if start != -1:
+            for child in range(start, start + self.child_count(row)):
+                self._mark_subtree(child)
+
+    def reset_diff_state(self):
+        self.generation += 1
+
+    def diff_state(self, row):
+        return self.state[row] if self.state_generation[row] == self.generation else SAME
+
+    def _set_diff_state(self, row, state):
+        self.state[row] = state
+        self.state_generation[row] = self.generation
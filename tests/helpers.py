@@ -0,0 +1,57 @@
+"""
+    Datasets and files shared by the tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+# pydicom is MIT licenced
+import pydicom
+from pydicom.dataset import Dataset, FileDataset
+
+
+def make_dataset(**elements):
+    """
+    Returns a dataset with the given elements by keyword, e.g. make_dataset(PatientID='1234'). A list of datasets is
+    the items of a sequence.
+    """
+    dataset = Dataset()
+    for keyword, value in elements.items():
+        setattr(dataset, keyword, value)
+    return dataset
+
+
+def file_dataset(dataset):
+    """
+    Returns a dataset with the file meta information needed to save it, as explicit VR little endian
+    """
+    file_meta = Dataset()
+    file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.7'
+    file_meta.MediaStorageSOPInstanceUID = pydicom.uid.generate_uid()
+    file_meta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
+    saved = FileDataset('', dataset, file_meta=file_meta, preamble=b'\x00' * 128)
+    saved.is_little_endian = True
+    saved.is_implicit_VR = False
+    return saved
+
+
+def save_dataset(dataset, path):
+    """
+    Saves a dataset to a file, returning the path
+    """
+    file_dataset(dataset).save_as(path, write_like_original=False)
+    return path
+
+
+class TemporaryDirectoryTest(unittest.TestCase):
+    """
+    A test with a directory to write files to, which is removed afterwards
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def path(self, *names):
+        return os.path.join(self.directory, *names)
@@ -0,0 +1,75 @@
+"""
+    The batch mode writes a line of JSON for each pair, and its exit status says whether any were different or
+    couldn't be read.
+"""
+import contextlib
+import io
+import json
+
+from core.batch import main, EXIT_IDENTICAL, EXIT_DIFFERENT, EXIT_ERROR
+from tests.helpers import make_dataset, save_dataset, TemporaryDirectoryTest
+
+
+class BatchTest(TemporaryDirectoryTest):
+
+    def setUp(self):
+        super(BatchTest, self).setUp()
+        self.left = save_dataset(make_dataset(PatientName='Test^Patient', PatientID='1234'), self.path('left.dcm'))
+        self.right = save_dataset(make_dataset(PatientName='Test^Patient', PatientID='4321'), self.path('right.dcm'))
+
+    def run_batch(self, *arguments):
+        output_path = self.path('results.jsonl')
+        status = main(list(arguments) + ['-j', '1', '-o', output_path])
+        with open(output_path) as output:
+            return status, [json.loads(line) for line in output]
+
+    def test_identical(self):
+        status, results = self.run_batch(self.left, self.left)
+        self.assertEqual(status, EXIT_IDENTICAL)
+        self.assertEqual(results, [{'left': self.left, 'right': self.left, 'identical': True, 'differences': []}])
+
+    def test_different(self):
+        status, results = self.run_batch(self.left, self.right)
+        self.assertEqual(status, EXIT_DIFFERENT)
+        self.assertFalse(results[0]['identical'])
+        self.assertEqual([(difference['kind'], difference['path']) for difference in results[0]['differences']],
+                         [('changed', ['00100020'])])
+
+    def test_unreadable(self):
+        status, results = self.run_batch(self.left, self.path('missing.dcm'))
+        self.assertEqual(status, EXIT_ERROR)
+        self.assertIn('error', results[0])
+
+    def test_worst_status(self):
+        # One pair that can't be read doesn't stop the rest
+        status, results = self.run_batch(self.left, self.path('missing.dcm'), self.left, self.right,
+                                         self.left, self.left)
+        self.assertEqual(status, EXIT_ERROR)
+        self.assertEqual([result['right'] for result in results], [self.path('missing.dcm'), self.right, self.left])
+
+    def test_item_keys(self):
+        items = [make_dataset(ReferencedSOPInstanceUID='1.2.{0:d}'.format(n)) for n in range(3)]
+        left = save_dataset(make_dataset(ReferencedStudySequence=items), self.path('left.dcm'))
+        right = save_dataset(make_dataset(ReferencedStudySequence=items[::-1]), self.path('right.dcm'))
+        self.assertEqual(self.run_batch(left, right)[0], EXIT_DIFFERENT)
+        self.assertEqual(self.run_batch('--item-keys', 'ReferencedStudySequence: ReferencedSOPInstanceUID',
+                                        left, right)[0], EXIT_IDENTICAL)
+
+    def test_baseline(self):
+        profile = self.path('left.profile')
+        self.assertEqual(main(['--compile-profile', self.left, profile]), EXIT_IDENTICAL)
+        status, results = self.run_batch('--baseline', profile, self.left, self.right)
+        self.assertEqual(status, EXIT_DIFFERENT)
+        self.assertEqual([result['identical'] for result in results], [True, False])
+
+    def test_compile_profile_error(self):
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            status = main(['--compile-profile', self.path('missing.dcm'), self.path('missing.profile')])
+        self.assertEqual(status, EXIT_ERROR)
+        self.assertIn('missing.dcm', errors.getvalue())
+
+    def test_bad_arguments(self):
+        for arguments in (['--item-keys', 'ReferencedStudySequence'], ['-j', '0'], [self.left]):
+            with self.subTest(arguments=arguments):
+                self.assertRaises(SystemExit, main, arguments + [self.left, self.right])
@@ -0,0 +1,66 @@
+"""
+    The dataset cache keeps recently read files, and what was worked out from them, until it runs out of room.
+"""
+from core.cache import DatasetCache
+from core.reader import read_dataset
+from core.table import DatasetTable
+from tests.helpers import make_dataset, save_dataset, TemporaryDirectoryTest
+
+defer_size = 1024 * 1024
+
+
+class DatasetCacheTest(TemporaryDirectoryTest):
+
+    def setUp(self):
+        super(DatasetCacheTest, self).setUp()
+        self.cache = DatasetCache()
+
+    def cache_file(self, name, dataset):
+        path = save_dataset(dataset, self.path(name))
+        key = self.cache.key(path, defer_size, False)
+        dataset = read_dataset(path, defer_size=defer_size)
+        self.cache.put(key, dataset, DatasetTable(dataset))
+        return key
+
+    def test_tables_are_copies(self):
+        key = self.cache_file('a.dcm', make_dataset(PatientID='1234'))
+        dataset, table, extras = self.cache.get(key)
+        self.assertIs(self.cache.get(key)[0], dataset)
+        self.assertIsNot(self.cache.get(key)[1], table)
+        self.assertEqual(len(self.cache.get(key)[1]), len(table))
+
+    def test_changed_files_are_read_again(self):
+        key = self.cache_file('a.dcm', make_dataset(PatientID='1234'))
+        save_dataset(make_dataset(PatientID='12345678'), self.path('a.dcm'))
+        self.assertNotEqual(self.cache.key(self.path('a.dcm'), defer_size, False), key)
+        self.assertIsNone(self.cache.key(self.path('missing.dcm'), defer_size, False))
+
+    def test_least_recently_used_are_dropped(self):
+        keys = [self.cache_file(name, make_dataset(PatientID=name)) for name in ('a.dcm', 'b.dcm')]
+        # Room for two files, but not three
+        self.cache.max_bytes = self.cache.used_bytes * 5 // 4
+        self.cache.get(keys[0])
+        keys.append(self.cache_file('c.dcm', make_dataset(PatientID='c.dcm')))
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNotNone(self.cache.get(keys[2]))
+        self.assertLessEqual(self.cache.used_bytes, self.cache.max_bytes)
+
+    def test_extras_are_kept(self):
+        key = self.cache_file('a.dcm', make_dataset(PatientID='1234'))
+        self.assertEqual(self.cache.get(key)[2], {})
+        self.cache.update(key, hashes={(): b'hash'})
+        self.assertEqual(self.cache.get(key)[2], {'hashes': {(): b'hash'}})
+
+    def test_loaded_values_are_counted(self):
+        # Two binary values of 2 MB, which are left in the file
+        dataset = make_dataset(PatientID='1234')
+        for tag in (0x00191010, 0x00191011):
+            dataset.add_new(tag, 'OB', bytes(range(256)) * 8192)
+        key = self.cache_file('a.dcm', dataset)
+        used_bytes = self.cache.used_bytes
+        _, table, _ = self.cache.get(key)
+        table.expand_all()
+        table.load_deferred(next(row for row in range(1, len(table)) if table.is_truncated(row)))
+        self.cache.update(key)
+        self.assertGreaterEqual(self.cache.used_bytes, used_bytes + 2 * 1024 * 1024)
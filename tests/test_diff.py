@@ -0,0 +1,202 @@
+"""
+    Diffing datasets: rows are aligned by their path, sequence items by their keys, and values that are shown truncated
+    are still compared in full.
+"""
+import copy
+import unittest
+
+from core import reader
+from core.diff import diff_datasets, iter_differences, parse_item_keys, align_items, default_item_keys, is_truncated, \
+    value_lines, ADDED, REMOVED, CHANGED
+from core.profile import compile_profile, diff_profile, load_profile
+from tests.helpers import make_dataset, save_dataset, TemporaryDirectoryTest
+
+# One pair of values of each kind of VR that is shown truncated, differing only at the end
+truncated_pairs = [
+    ('OB', b'\x01' * 100, b'\x01' * 99 + b'\x02'),  # binary, shown as "Array of N elements"
+    ('UT', 'x' * 100, 'x' * 99 + 'y'),  # long text
+    ('DS', ['1.5'] * 20, ['1.5'] * 19 + ['2.5']),  # multi-valued strings
+    ('US', [7] * 20, [7] * 19 + [8]),  # multi-valued numbers
+]
+
+
+def kinds_and_paths(records):
+    return [(record.kind, record.path) for record in records]
+
+
+def private_dataset(vr, value):
+    dataset = make_dataset(PatientName='Test^Patient')
+    dataset.add_new(0x00191010, vr, value)
+    return dataset
+
+
+def study_dataset():
+    return make_dataset(StudyDescription='Head', PatientName='Test^Patient', PatientID='1234',
+                        ReferencedStudySequence=[make_dataset(ReferencedSOPInstanceUID='1.2.3'),
+                                                 make_dataset(ReferencedSOPInstanceUID='1.2.4')])
+
+
+class DiffDatasetsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.left = study_dataset()
+        self.right = copy.deepcopy(self.left)
+
+    def test_identical(self):
+        self.assertEqual(diff_datasets(self.left, self.right), [])
+
+    def test_changed(self):
+        self.right.PatientID = '4321'
+        records = diff_datasets(self.left, self.right)
+        self.assertEqual(kinds_and_paths(records), [(CHANGED, (0x00100020,))])
+        self.assertIn('1234', records[0].left)
+        self.assertIn('4321', records[0].right)
+
+    def test_added_and_removed(self):
+        # Neither shifts the comparison of the elements after it
+        del self.right.PatientName
+        self.right.PatientBirthDate = '19700101'
+        self.right.StudyDescription = 'Chest'
+        self.assertEqual(kinds_and_paths(diff_datasets(self.left, self.right)),
+                         [(CHANGED, (0x00081030,)), (REMOVED, (0x00100010,)), (ADDED, (0x00100030,))])
+
+    def test_sequence_items(self):
+        self.right.ReferencedStudySequence[1].ReferencedSOPInstanceUID = '1.2.5'
+        self.right.ReferencedStudySequence.append(make_dataset(ReferencedSOPInstanceUID='1.2.6'))
+        self.assertEqual(kinds_and_paths(diff_datasets(self.left, self.right)),
+                         [(CHANGED, (0x00081110,)), (CHANGED, (0x00081110, 1, 0x00081155)), (ADDED, (0x00081110, 2))])
+        self.assertEqual(kinds_and_paths(diff_datasets(self.right, self.left))[-1], (REMOVED, (0x00081110, 2)))
+
+
+class ItemKeysTest(unittest.TestCase):
+
+    def setUp(self):
+        self.left = make_dataset(ReferencedImageSequence=[
+            make_dataset(ReferencedSOPInstanceUID='1.2.{0:d}'.format(n), ReferencedFrameNumber=str(n)) for n in range(3)])
+        self.right = copy.deepcopy(self.left)
+        self.right.ReferencedImageSequence.reverse()
+
+    def test_parse_item_keys(self):
+        item_keys = parse_item_keys('ReferencedStudySequence: ReferencedSOPInstanceUID, 00081160; '
+                                    '00540016: 00540300.00080100')
+        self.assertEqual(item_keys[0x00081110], ((0x00081155,), (0x00081160,)))
+        self.assertEqual(item_keys[0x00540016], ((0x00540300, 0x00080100),))
+        self.assertEqual(item_keys[0x00081140], default_item_keys[0x00081140])
+        self.assertEqual(parse_item_keys(''), default_item_keys)
+        self.assertEqual(parse_item_keys('ReferencedImageSequence:')[0x00081140], ())
+
+    def test_parse_item_keys_errors(self):
+        for text in ('ReferencedImageSequence', 'NoSuchKeyword: ReferencedSOPInstanceUID',
+                     'ReferencedImageSequence: 0008115'):
+            with self.subTest(text=text):
+                self.assertRaises(ValueError, parse_item_keys, text)
+
+    def test_align_items(self):
+        self.assertEqual(align_items(['a', 'b', 'c'], ['c', 'a', 'd']), [(0, 1), (1, None), (2, 0), (None, 2)])
+        # Items without a key are aligned by position amongst the others without one
+        self.assertEqual(align_items([None, 'a', None], ['a', None]), [(0, 1), (1, 0), (2, None)])
+        self.assertEqual(align_items(['a', 'a'], ['a']), [(0, 0), (1, None)])
+
+    def test_reordered_items_are_matched(self):
+        self.assertEqual(diff_datasets(self.left, self.right), [])
+        self.right.ReferencedImageSequence[0].ReferencedFrameNumber = '5'
+        records = diff_datasets(self.left, self.right)
+        self.assertEqual(kinds_and_paths(records), [(CHANGED, (0x00081140, 2, 0x00081160))])
+        self.assertEqual(records[0].right_path, (0x00081140, 0, 0x00081160))
+
+    def test_items_by_position(self):
+        records = diff_datasets(self.left, self.right, item_keys=parse_item_keys('ReferencedImageSequence:'))
+        self.assertEqual(kinds_and_paths(records), [(CHANGED, (0x00081140, 0, 0x00081155)),
+                                                    (CHANGED, (0x00081140, 0, 0x00081160)),
+                                                    (CHANGED, (0x00081140, 2, 0x00081155)),
+                                                    (CHANGED, (0x00081140, 2, 0x00081160))])
+
+
+class IterDifferencesTest(TemporaryDirectoryTest):
+
+    def setUp(self):
+        super(IterDifferencesTest, self).setUp()
+        self.left = study_dataset()
+        self.right = study_dataset()
+        self.right.PatientID = '4321'
+        self.right.StudyDescription = 'Chest'
+
+    def test_differences_are_yielded_as_found(self):
+        differences = iter_differences(self.left, self.right)
+        self.assertEqual(kinds_and_paths([next(differences)]), [(CHANGED, (0x00081030,))])
+        self.assertEqual([next(differences)] + list(differences), diff_datasets(self.left, self.right)[1:])
+
+    def test_files(self):
+        paths = [save_dataset(dataset, self.path(name)) for dataset, name in ((self.left, 'left.dcm'),
+                                                                                  (self.right, 'right.dcm'))]
+        self.assertEqual(list(iter_differences(*paths)), diff_datasets(self.left, self.right))
+
+
+class TruncatedValueTest(TemporaryDirectoryTest):
+    """
+    Values that are displayed truncated must still be reported as changed when they differ after the cut-off, by both
+    the diff and a diff against a profile
+    """
+
+    def test_values_are_truncated(self):
+        for vr, left, right in truncated_pairs:
+            with self.subTest(vr=vr):
+                self.assertTrue(is_truncated(private_dataset(vr, left)[0x00191010]))
+
+    def test_same_values_are_identical(self):
+        for vr, left, right in truncated_pairs:
+            with self.subTest(vr=vr):
+                self.assertEqual(diff_datasets(private_dataset(vr, left), private_dataset(vr, left)), [])
+
+    def test_diff_reports_change(self):
+        for vr, left, right in truncated_pairs:
+            with self.subTest(vr=vr):
+                records = diff_datasets(private_dataset(vr, left), private_dataset(vr, right))
+                self.assertEqual(kinds_and_paths(records), [(CHANGED, (0x00191010,))])
+
+    def test_profile_diff_reports_change(self):
+        reference_path = self.path('reference.dcm')
+        profile_path = self.path('reference.profile')
+        for vr, left, right in truncated_pairs:
+            with self.subTest(vr=vr):
+                save_dataset(private_dataset(vr, left), reference_path)
+                compile_profile(reference_path, profile_path)
+                records = diff_profile(load_profile(profile_path), private_dataset(vr, right))
+                self.assertEqual(kinds_and_paths(records), [(CHANGED, (0x00191010,))])
+
+
+class StreamedValueTest(TemporaryDirectoryTest):
+    """
+    The lines of binary values left in the file are the same as once they are read, and only as much of the value as
+    is shown is read
+    """
+
+    def setUp(self):
+        super(StreamedValueTest, self).setUp()
+        dataset = make_dataset()
+        dataset.add_new(0x00191010, 'OB', bytes(range(256)) * 16384 + b'\x01\x02\x03')
+        dataset.add_new(0x00191011, 'US', list(range(3000)))
+        dataset.add_new(0x00191012, 'FL', [n / 3.0 for n in range(3000)])
+        dataset = reader.read_dataset(save_dataset(dataset, self.path('streamed.dcm')), defer_size=1024)
+        self.deferred_elements = list(reader.dataset_elements(dataset))
+
+    def test_lines_match_read_value(self):
+        for data_element in self.deferred_elements:
+            with self.subTest(vr=data_element.VR):
+                self.assertIsInstance(data_element, reader.DeferredElement)
+                self.assertEqual(value_lines(data_element), value_lines(data_element.read()))
+                self.assertEqual(value_lines(data_element, max_lines=10), value_lines(data_element.read())[:10])
+
+    def test_only_lines_shown_are_read(self):
+        data_element = self.deferred_elements[0]
+        read_bytes = sum(len(chunk) for chunk in data_element.iter_chunks(chunk_size=1024))
+        chunks = []
+        iter_chunks = data_element.iter_chunks
+
+        def recording_iter_chunks(chunk_size=reader.default_chunk_size):
+            for chunk in iter_chunks(chunk_size=1024):
+                chunks.append(len(chunk))
+                yield chunk
+        data_element.iter_chunks = recording_iter_chunks
+        self.assertEqual(len(value_lines(data_element, max_lines=10)), 10)
+        self.assertLess(sum(chunks), read_bytes)
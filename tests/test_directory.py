@@ -0,0 +1,85 @@
+"""
+    Files in two directories are paired by SOPInstanceUID, then InstanceNumber, then their relative path.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import unittest
+
+from core.directory import diff_directories, pair_files, read_header, FileHeader, IDENTICAL, DIFFERENT, MISSING_LEFT, \
+    MISSING_RIGHT
+from tests.helpers import make_dataset, save_dataset, TemporaryDirectoryTest
+
+
+def header(relative_path, sop_instance_uid=None, instance_number=None):
+    return FileHeader(os.path.join('data', relative_path), relative_path, sop_instance_uid, instance_number)
+
+
+def relative_paths(pairs):
+    return [tuple(header.relative_path if header is not None else None for header in pair) for pair in pairs]
+
+
+class PairFilesTest(unittest.TestCase):
+
+    def test_sop_instance_uid(self):
+        left = [header('a.dcm', '1.2.1', '1'), header('b.dcm', '1.2.2', '2')]
+        right = [header('a.dcm', '1.2.2', '1'), header('b.dcm', '1.2.1', '2')]
+        self.assertEqual(relative_paths(pair_files(left, right)), [('a.dcm', 'b.dcm'), ('b.dcm', 'a.dcm')])
+
+    def test_instance_number(self):
+        # e.g. after anonymisation has replaced the UIDs
+        left = [header('a.dcm', '1.2.1', '1'), header('b.dcm', '1.2.2', '2')]
+        right = [header('a.dcm', '1.3.1', '2'), header('b.dcm', '1.3.2', '1')]
+        self.assertEqual(relative_paths(pair_files(left, right)), [('a.dcm', 'b.dcm'), ('b.dcm', 'a.dcm')])
+
+    def test_relative_path(self):
+        left = [header('a.dcm'), header('b.dcm')]
+        right = [header('b.dcm'), header('a.dcm')]
+        self.assertEqual(relative_paths(pair_files(left, right)), [('a.dcm', 'a.dcm'), ('b.dcm', 'b.dcm')])
+
+    def test_keys_shared_by_several_files_are_skipped(self):
+        left = [header('a.dcm', '1.2.1', '1'), header('b.dcm', '1.2.1', '2')]
+        right = [header('a.dcm', '1.2.1', '2'), header('b.dcm', '1.2.1', '1')]
+        self.assertEqual(relative_paths(pair_files(left, right)), [('a.dcm', 'b.dcm'), ('b.dcm', 'a.dcm')])
+
+    def test_unpaired(self):
+        left = [header('a.dcm', '1.2.1'), header('b.dcm', '1.2.2')]
+        right = [header('c.dcm', '1.2.2')]
+        self.assertEqual(relative_paths(pair_files(left, right)), [('a.dcm', None), ('b.dcm', 'c.dcm')])
+        self.assertEqual(relative_paths(pair_files(right, left)), [(None, 'a.dcm'), ('c.dcm', 'b.dcm')])
+
+
+class ReadHeaderTest(TemporaryDirectoryTest):
+
+    def test_read_header(self):
+        path = save_dataset(make_dataset(SOPInstanceUID='1.2.1', InstanceNumber='3'), self.path('a.dcm'))
+        self.assertEqual(read_header(path, self.directory), FileHeader(path, 'a.dcm', '1.2.1', '3'))
+
+    def test_files_that_arent_dicom_are_skipped(self):
+        with open(self.path('notes.txt'), 'w') as notes:
+            notes.write('Not a DICOM file\n')
+        self.assertIsNone(read_header(self.path('notes.txt'), self.directory))
+        self.assertIsNone(read_header(self.path('missing.dcm'), self.directory))
+
+
+class DiffDirectoriesTest(TemporaryDirectoryTest):
+
+    def test_diff_directories(self):
+        for side in ('left', 'right'):
+            os.mkdir(self.path(side))
+            # Files that aren't DICOM are skipped
+            with open(self.path(side, 'notes.txt'), 'w') as notes:
+                notes.write('Not a DICOM file\n')
+        save_dataset(make_dataset(SOPInstanceUID='1.2.1', PatientID='1234'), self.path('left', 'a.dcm'))
+        save_dataset(make_dataset(SOPInstanceUID='1.2.1', PatientID='1234'), self.path('right', 'renamed.dcm'))
+        save_dataset(make_dataset(SOPInstanceUID='1.2.2', PatientID='1234'), self.path('left', 'b.dcm'))
+        save_dataset(make_dataset(SOPInstanceUID='1.2.2', PatientID='4321'), self.path('right', 'b.dcm'))
+        save_dataset(make_dataset(SOPInstanceUID='1.2.3'), self.path('left', 'c.dcm'))
+        save_dataset(make_dataset(SOPInstanceUID='1.2.4'), self.path('right', 'd.dcm'))
+        with ThreadPoolExecutor() as executor:
+            results = list(diff_directories(self.path('left'), self.path('right'), executor))
+        self.assertEqual(sorted((result.status, result.left, result.right) for result in results), [
+            (DIFFERENT, self.path('left', 'b.dcm'), self.path('right', 'b.dcm')),
+            (IDENTICAL, self.path('left', 'a.dcm'), self.path('right', 'renamed.dcm')),
+            (MISSING_LEFT, None, self.path('right', 'd.dcm')),
+            (MISSING_RIGHT, self.path('left', 'c.dcm'), None),
+        ])
@@ -0,0 +1,76 @@
+"""
+    Subtrees with the same hash are skipped by the diff, and values left in the file are not read to hash them.
+"""
+import copy
+import unittest
+
+from core import reader
+from core.diff import diff_datasets
+from core.hashing import subtree_hashes
+from tests.helpers import make_dataset, save_dataset, TemporaryDirectoryTest
+
+
+class SubtreeHashesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.left = make_dataset(PatientID='1234', ReferencedStudySequence=[
+            make_dataset(ReferencedSOPInstanceUID='1.2.{0:d}'.format(n)) for n in range(3)])
+        self.right = copy.deepcopy(self.left)
+
+    def test_same_datasets(self):
+        hashes = subtree_hashes(self.left)
+        self.assertEqual(sorted(hashes), [(), (0x00081110, 0), (0x00081110, 1), (0x00081110, 2)])
+        self.assertEqual(subtree_hashes(self.right), hashes)
+
+    def test_changed_item(self):
+        self.right.ReferencedStudySequence[1].ReferencedSOPInstanceUID = '1.2.9'
+        left_hashes = subtree_hashes(self.left)
+        right_hashes = subtree_hashes(self.right)
+        self.assertEqual([path for path in sorted(left_hashes) if left_hashes[path] != right_hashes[path]],
+                         [(), (0x00081110, 1)])
+
+    def test_diff_is_the_same_with_hashes(self):
+        self.right.PatientID = '4321'
+        self.right.ReferencedStudySequence[1].ReferencedSOPInstanceUID = '1.2.9'
+        hashes = [subtree_hashes(self.left), subtree_hashes(self.right)]
+        self.assertEqual(diff_datasets(self.left, self.right, hashes=hashes), diff_datasets(self.left, self.right))
+
+
+class DeferredHashingTest(TemporaryDirectoryTest):
+    """
+    Values left in the file are not read to hash them, and are only read once by the diff
+    """
+
+    def setUp(self):
+        super(DeferredHashingTest, self).setUp()
+        # Two binary values of 64 KB in each file, one of them different
+        self.datasets = []
+        for name, last_byte in (('left.dcm', b'\x01'), ('right.dcm', b'\x02')):
+            dataset = make_dataset(PatientID='1234')
+            dataset.add_new(0x00191010, 'OB', b'\x00' * 65536)
+            dataset.add_new(0x00191011, 'OB', b'\x00' * 65535 + last_byte)
+            self.datasets.append(reader.read_dataset(save_dataset(dataset, self.path(name)), defer_size=1024))
+        self.reads = 0
+        iter_chunks = reader.DeferredElement.iter_chunks
+
+        def counting_iter_chunks(deferred_element, *args, **kwargs):
+            if deferred_element.in_file:
+                self.reads += 1
+            return iter_chunks(deferred_element, *args, **kwargs)
+        reader.DeferredElement.iter_chunks = counting_iter_chunks
+        self.addCleanup(setattr, reader.DeferredElement, 'iter_chunks', iter_chunks)
+
+    def test_hashing_leaves_values_in_file(self):
+        hashes = [subtree_hashes(dataset) for dataset in self.datasets]
+        self.assertEqual(self.reads, 0)
+        self.assertIsNone(hashes[0][()])
+
+    def test_values_are_read_once(self):
+        hashes = [subtree_hashes(dataset) for dataset in self.datasets]
+        records = diff_datasets(self.datasets[0], self.datasets[1], hashes=hashes)
+        self.assertEqual(self.reads, 4)
+        # The digests worked out by the diff are used by hashing and diffing again
+        hashes = [subtree_hashes(dataset) for dataset in self.datasets]
+        self.assertIsNotNone(hashes[0][()])
+        self.assertEqual(diff_datasets(self.datasets[0], self.datasets[1], hashes=hashes), records)
+        self.assertEqual(self.reads, 4)
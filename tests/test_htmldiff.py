@@ -0,0 +1,71 @@
+"""
+    HTML diff reports are split into pages of at most page_rows rows, holding only the changes and their context.
+"""
+import io
+import unittest
+
+from core.htmldiff import HtmlDiffReport
+
+lines = ['line {0:d}\n'.format(n) for n in range(100)]
+
+
+def changed(*line_numbers):
+    return [line.replace('line', 'changed') if n in line_numbers else line for n, line in enumerate(lines)]
+
+
+def page_rows(page):
+    return sum(max(i2 - i1, j2 - j1) for i1, i2, j1, j2 in (piece[1:] for piece in page if piece is not None))
+
+
+def html_rows(html):
+    return html.count('<td class="diff_header">') // 2
+
+
+class HtmlDiffReportTest(unittest.TestCase):
+
+    def test_identical(self):
+        report = HtmlDiffReport(lines, list(lines))
+        self.assertEqual(report.page_count(), 0)
+        self.assertIn('No differences found', report.page_html(0))
+
+    def test_context(self):
+        report = HtmlDiffReport(lines, changed(50), context=3)
+        self.assertEqual(report.page_count(), 1)
+        self.assertEqual(page_rows(report.pages[0]), 7)
+        self.assertEqual(html_rows(report.page_html(0)), 7)
+        self.assertIn('class="diff_chg"', report.page_html(0))
+
+    def test_skipped_lines_are_marked(self):
+        report = HtmlDiffReport(lines, changed(10, 80), context=3)
+        self.assertEqual(report.page_count(), 1)
+        self.assertEqual(report.pages[0].count(None), 1)
+        self.assertEqual(html_rows(report.page_html(0)), 14)
+
+    def test_pages_are_split(self):
+        report = HtmlDiffReport(lines, changed(50), context=None, page_rows=30)
+        self.assertEqual(report.page_count(), 4)
+        self.assertEqual([page_rows(page) for page in report.pages], [30, 30, 30, 10])
+        # The pages follow on from each other, with every line once
+        left_lines = [n for page in report.pages for _, i1, i2, _, _ in page for n in range(i1, i2)]
+        self.assertEqual(left_lines, list(range(100)))
+
+    def test_page_boundary_within_a_change(self):
+        report = HtmlDiffReport(lines, changed(*range(40, 60)), context=3, page_rows=10)
+        self.assertEqual(report.page_count(), 3)
+        self.assertEqual([page_rows(page) for page in report.pages], [10, 10, 6])
+        self.assertEqual(sum(html_rows(report.page_html(n)) for n in range(report.page_count())), 26)
+
+    def test_set_context(self):
+        report = HtmlDiffReport(lines, changed(50), context=3, page_rows=30)
+        report.set_context(None)
+        self.assertEqual(report.page_count(), 4)
+        report.set_context(0)
+        self.assertEqual(report.page_count(), 1)
+        self.assertEqual(page_rows(report.pages[0]), 1)
+
+    def test_write(self):
+        report = HtmlDiffReport(lines, changed(10, 80), context=3, page_rows=5)
+        output = io.StringIO()
+        report.write(output)
+        self.assertEqual(html_rows(output.getvalue()), 14)
+        self.assertEqual(output.getvalue().count('<table'), 1)
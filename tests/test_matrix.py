@@ -0,0 +1,93 @@
+"""
+    The matrix of differences of many files from a reference, with a row for each element different in any of them.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import unittest
+
+from core.matrix import DifferenceMatrix, MatrixRow, diff_against_reference, path_text, path_description
+from tests.helpers import make_dataset, save_dataset, TemporaryDirectoryTest
+
+
+def result(right, *differences):
+    return {'left': 'reference.dcm', 'right': right, 'identical': len(differences) == 0,
+            'differences': [{'kind': kind, 'path': path, 'left': left, 'right': right}
+                            for kind, path, left, right in differences]}
+
+
+class DifferenceMatrixTest(unittest.TestCase):
+
+    def setUp(self):
+        self.matrix = DifferenceMatrix('reference.dcm')
+
+    def test_rows_in_tree_order(self):
+        self.assertEqual(self.matrix.add_result(result('a.dcm', ('changed', ['00100020'], '1234', '4321'),
+                                                       ('changed', ['00081110', 2, '00081155'], '1.2.3', '1.2.4'))),
+                         [0, 1])
+        # Each new row's position is after the rows inserted before it
+        self.assertEqual(self.matrix.add_result(result('b.dcm', ('changed', ['00080018'], '1.2', '1.3'),
+                                                       ('changed', ['00100020'], '1234', '5678'),
+                                                       ('added', ['00100030'], None, '19700101'))), [0, 3])
+        self.assertEqual(self.matrix.rows, [MatrixRow(('00080018',), False), MatrixRow(('00081110', 2, '00081155'), False),
+                                            MatrixRow(('00100020',), False), MatrixRow(('00100030',), True)])
+
+    def test_values(self):
+        self.matrix.add_result(result('a.dcm', ('changed', ['00100020'], '1234', '4321')))
+        self.matrix.add_result(result('b.dcm'))
+        self.matrix.add_result(result('c.dcm', ('changed', ['00100020'], '1234', '5678')))
+        row = MatrixRow(('00100020',), False)
+        self.assertEqual([self.matrix.value(row, column) for column in range(3)],
+                         [('4321', True), ('1234', False), ('5678', True)])
+        self.assertEqual(self.matrix.different_count(row), 2)
+        self.assertEqual(self.matrix.reference_values[row], '1234')
+
+    def test_errors(self):
+        self.matrix.add_result({'left': 'reference.dcm', 'right': 'a.dcm', 'error': 'InvalidDicomError: a.dcm'})
+        self.assertEqual(self.matrix.files, ['a.dcm'])
+        self.assertEqual(self.matrix.errors, ['InvalidDicomError: a.dcm'])
+        self.assertEqual(self.matrix.rows, [])
+
+    def test_path_text(self):
+        self.assertEqual(path_text(['300A0010', 2, '300A0012']), '(300A,0010)[2] (300A,0012)')
+        self.assertEqual(path_description(['300A0010', 2, '300A0012']), 'Dose Reference Number')
+        self.assertEqual(path_description(['300A0010', 2]), 'Dose Reference 2')
+
+
+class DiffAgainstReferenceTest(TemporaryDirectoryTest):
+
+    def test_diff_against_reference(self):
+        reference = save_dataset(make_dataset(PatientName='Test^Patient', PatientID='1234'), self.path('reference.dcm'))
+        paths = [save_dataset(make_dataset(PatientName='Test^Patient', PatientID=patient_id),
+                              self.path('{0:d}.dcm'.format(n))) for n, patient_id in enumerate(('1234', '4321'))]
+        paths.append(self.path('missing.dcm'))
+        matrix = DifferenceMatrix(reference)
+        with ThreadPoolExecutor() as executor:
+            for file_result in diff_against_reference(reference, paths, executor):
+                self.assertEqual(file_result['left'], reference)
+                matrix.add_result(file_result)
+        self.assertEqual(matrix.files, paths)
+        self.assertEqual([error is not None for error in matrix.errors], [False, False, True])
+        self.assertEqual(matrix.rows, [MatrixRow(('00100020',), False)])
+        self.assertEqual(matrix.different_count(matrix.rows[0]), 1)
+
+    def test_reordered_items(self):
+        # The items are matched by their Referenced SOP Instance UID. The Referenced Frame Number of the reference's
+        # second item is changed, and one is added to its first item, which is second in the file, so the changed and
+        # added elements have the same path.
+        reference = save_dataset(make_dataset(ReferencedImageSequence=[
+            make_dataset(ReferencedSOPInstanceUID='1.2.1'),
+            make_dataset(ReferencedSOPInstanceUID='1.2.2', ReferencedFrameNumber='1')]), self.path('reference.dcm'))
+        path = save_dataset(make_dataset(ReferencedImageSequence=[
+            make_dataset(ReferencedSOPInstanceUID='1.2.2', ReferencedFrameNumber='2'),
+            make_dataset(ReferencedSOPInstanceUID='1.2.1', ReferencedFrameNumber='3')]), self.path('reordered.dcm'))
+        matrix = DifferenceMatrix(reference)
+        with ThreadPoolExecutor() as executor:
+            for file_result in diff_against_reference(reference, [path], executor):
+                matrix.add_result(file_result)
+        changed = MatrixRow(('00081140', 2, '00081160'), False)
+        added = MatrixRow(('00081140', 2, '00081160'), True)
+        self.assertEqual(matrix.rows, [changed, added])
+        self.assertIn('1', matrix.reference_values[changed])
+        self.assertIsNone(matrix.reference_values[added])
+        self.assertEqual([matrix.value(row, 0)[1] for row in matrix.rows], [True, True])
+        self.assertIn('2', matrix.value(changed, 0)[0])
+        self.assertIn('3', matrix.value(added, 0)[0])
@@ -0,0 +1,42 @@
+"""
+    Searching a dataset by words, tags, wildcards and regular expressions.
+"""
+import unittest
+
+from core.search import SearchIndex
+from core.table import DatasetTable
+from tests.helpers import make_dataset
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        dataset = make_dataset(SOPInstanceUID='1.2.3', PatientName='Test^Patient', PatientID='1234',
+                               SliceThickness='2.5', SeriesInstanceUID='1.2.4',
+                               ReferencedImageSequence=[make_dataset(ReferencedSOPInstanceUID='1.2.5')])
+        self.table = DatasetTable(dataset)
+        self.index = SearchIndex(self.table)
+
+    def search(self, query):
+        return [self.table.path_for_row(row) for row in self.index.search(query)]
+
+    def test_words(self):
+        self.assertEqual(self.search('test patient'), [(0x00100010,)])
+        self.assertEqual(self.search('PATIENT'), [(0x00100010,), (0x00100020,)])
+        self.assertEqual(self.search(''), [])
+
+    def test_tags(self):
+        self.assertEqual(self.search('(0018,0050)'), [(0x00180050,)])
+        self.assertEqual(self.search('0018,50'), [(0x00180050,)])
+        self.assertEqual(self.search('(0010,*)'), [(0x00100010,), (0x00100020,)])
+        self.assertEqual(self.search('(*,0018)'), [(0x00080018,)])
+        self.assertEqual(self.search('(0008,115x)'), [(0x00081140, 0, 0x00081155)])
+
+    def test_wildcards(self):
+        self.assertEqual(self.search('*UID*'), [(0x00080018,), (0x00081140, 0, 0x00081155), (0x0020000e,)])
+        self.assertEqual(self.search('Patient*'), [(0x00100010,), (0x00100020,)])
+        self.assertEqual(self.search('1.2.?'), [(0x00080018,), (0x00081140, 0, 0x00081155), (0x0020000e,)])
+
+    def test_regular_expressions(self):
+        self.assertEqual(self.search('/^(sop|series)instanceuid$/'), [(0x00080018,), (0x0020000e,)])
+        self.assertEqual(self.search(r'/2\.5/'), [(0x00081140, 0, 0x00081155), (0x00180050,)])
@@ -58,6 +58,11 @@ class Ui_MainWindow(object):
         self.labelPath.setText("")
         self.labelPath.setObjectName("labelPath")
         self.verticalLayout_2.addWidget(self.labelPath)
+        self.progressBarLoading = QtWidgets.QProgressBar(self.layoutWidget)
+        self.progressBarLoading.setMaximum(0)
+        self.progressBarLoading.setTextVisible(False)
+        self.progressBarLoading.setObjectName("progressBarLoading")
+        self.verticalLayout_2.addWidget(self.progressBarLoading)
         self.treeView = DroppableTreeView(self.layoutWidget)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
         sizePolicy.setHorizontalStretch(0)
@@ -82,6 +87,11 @@ class Ui_MainWindow(object):
         self.labelPath_2.setText("")
         self.labelPath_2.setObjectName("labelPath_2")
         self.verticalLayout.addWidget(self.labelPath_2)
+        self.progressBarLoading_2 = QtWidgets.QProgressBar(self.layoutWidget1)
+        self.progressBarLoading_2.setMaximum(0)
+        self.progressBarLoading_2.setTextVisible(False)
+        self.progressBarLoading_2.setObjectName("progressBarLoading_2")
+        self.verticalLayout.addWidget(self.progressBarLoading_2)
         self.treeView_2 = DroppableTreeView(self.layoutWidget1)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
         sizePolicy.setHorizontalStretch(0)
@@ -107,6 +117,10 @@ class Ui_MainWindow(object):
         self.actionOpen.setObjectName("actionOpen")
         self.actionDiff = QtWidgets.QAction(MainWindow)
         self.actionDiff.setObjectName("actionDiff")
+        self.actionDiff_directories = QtWidgets.QAction(MainWindow)
+        self.actionDiff_directories.setObjectName("actionDiff_directories")
+        self.actionDiff_reference = QtWidgets.QAction(MainWindow)
+        self.actionDiff_reference.setObjectName("actionDiff_reference")
         self.actionExpand_all = QtWidgets.QAction(MainWindow)
         self.actionExpand_all.setObjectName("actionExpand_all")
         self.actionCollapse_all = QtWidgets.QAction(MainWindow)
@@ -115,17 +129,25 @@ class Ui_MainWindow(object):
         self.actionText_diff.setObjectName("actionText_diff")
         self.actionHTML_diff = QtWidgets.QAction(MainWindow)
         self.actionHTML_diff.setObjectName("actionHTML_diff")
+        self.actionSearch = QtWidgets.QAction(MainWindow)
+        self.actionSearch.setObjectName("actionSearch")
         self.actionAbout = QtWidgets.QAction(MainWindow)
         self.actionAbout.setObjectName("actionAbout")
         self.actionAppearance = QtWidgets.QAction(MainWindow)
         self.actionAppearance.setObjectName("actionAppearance")
+        self.actionPerformance = QtWidgets.QAction(MainWindow)
+        self.actionPerformance.setObjectName("actionPerformance")
         self.menuFile.addAction(self.actionOpen)
         self.menuFile.addAction(self.actionDiff)
+        self.menuFile.addAction(self.actionDiff_directories)
+        self.menuFile.addAction(self.actionDiff_reference)
         self.menuView.addAction(self.actionAppearance)
         self.menuView.addAction(self.actionExpand_all)
         self.menuView.addAction(self.actionCollapse_all)
         self.menuView.addAction(self.actionText_diff)
         self.menuView.addAction(self.actionHTML_diff)
+        self.menuView.addAction(self.actionSearch)
+        self.menuHelp.addAction(self.actionPerformance)
         self.menuHelp.addAction(self.actionAbout)
         self.menubar.addAction(self.menuFile.menuAction())
         self.menubar.addAction(self.menuView.menuAction())
@@ -145,12 +167,17 @@ class Ui_MainWindow(object):
         self.menuHelp.setTitle(_translate("MainWindow", "Help"))
         self.actionOpen.setText(_translate("MainWindow", "&Open"))
         self.actionDiff.setText(_translate("MainWindow", "&Diff"))
+        self.actionDiff_directories.setText(_translate("MainWindow", "Diff di&rectories"))
+        self.actionDiff_reference.setText(_translate("MainWindow", "Diff against a re&ference"))
         self.actionExpand_all.setText(_translate("MainWindow", "&Expand all"))
         self.actionCollapse_all.setText(_translate("MainWindow", "&Collapse all"))
         self.actionText_diff.setText(_translate("MainWindow", "&Text diff"))
         self.actionText_diff.setToolTip(_translate("MainWindow", "Text diff"))
         self.actionHTML_diff.setText(_translate("MainWindow", "&HTML diff"))
+        self.actionSearch.setText(_translate("MainWindow", "&Search"))
+        self.actionSearch.setShortcut(_translate("MainWindow", "Ctrl+F"))
         self.actionAbout.setText(_translate("MainWindow", "&About"))
         self.actionAppearance.setText(_translate("MainWindow", "&Appearance"))
+        self.actionPerformance.setText(_translate("MainWindow", "&Performance"))
 
 from QDICOMDiffer import DroppableTreeView, EnhancedQLabel